@@ -7,16 +7,74 @@ for real-time image frame processing from the TEMI robot.
 Routes:
 - /ws           : Main endpoint for live YOLO + Scenario recognition
 - /save_frames  : Optional endpoint for saving frames from the robot
+- /events       : Scenario events and track summaries for dashboards (?robot=<id> for one robot)
+- /history/... : Stored scenario events, incidents and per-day aggregates (see routes/history.py)
+- /sessions     : Robot sessions held for reconnects, with their estimated memory
+- /metrics      : Prometheus metrics (per-stage latencies, per-robot frame counters, ...)
+- /healthz      : Liveness (the process is up)
+- /readyz       : Readiness (models loaded and warmed up) – robots should wait for 200
+
+Models are loaded in the lifespan start-up, in the background, so /healthz answers
+right away while YOLO and MoonDream load and warm up. Paths come from settings.py.
 
 Author: Idan Vahab
 """
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse
+import settings
 from routes.websocket import websocket_endpoint
+from routes.events import events_endpoint
+from routes.history import event_history, daily_aggregates
+from services import event_store, inference_client
+from services.inference_worker import sessions
+from services.startup import load_models, unload_models, readiness
 from utils.frame_saver import save_frame_from_websocket
+from utils.metrics import render_prometheus
+from utils.structured_log import configure_logging
+
+# ✅ Structured (JSON lines) logging for the frame path; level from LOG_LEVEL
+configure_logging(settings.LOG_LEVEL)
+
+# WebSocket close code "Try Again Later" – sent to robots that connect before the models are ready
+TRY_AGAIN_LATER = 1013
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads and warms up the models in the background and opens the event store;
+    stops the MoonDream worker and flushes the event store on shutdown.
+    """
+    if event_store.store is not None:
+        event_store.store.start()
+    loading = asyncio.create_task(load_models())
+    yield
+    loading.cancel()
+    await asyncio.gather(loading, return_exceptions=True)
+    await unload_models()
+    if event_store.store is not None:
+        await asyncio.get_running_loop().run_in_executor(None, event_store.store.close)
 
 # ✅ Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# ✅ Probes
+@app.get("/healthz")
+async def healthz_route():
+    """
+    Liveness probe: the server process is running.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz_route():
+    """
+    Readiness probe: 200 once YOLO (and MoonDream, if enabled) are loaded and warm, else 503.
+    """
+    ready, models = readiness()
+    return JSONResponse({"ready": ready, "models": models}, status_code=200 if ready else 503)
 
 # ✅ WebSocket endpoint for real-time YOLO + scenario analysis
 @app.websocket("/ws")
@@ -25,6 +83,10 @@ async def websocket_route(websocket: WebSocket):
     Main WebSocket route.
     Receives image frames, analyzes with YOLO, sends scenario responses.
     """
+    ready, _ = readiness()
+    if not ready:
+        await websocket.close(code=TRY_AGAIN_LATER)
+        return
     await websocket_endpoint(websocket)
 
 # ✅ WebSocket endpoint to save frames manually (optional)
@@ -34,3 +96,53 @@ async def save_frames_route(websocket: WebSocket):
     WebSocket route to save incoming frames to disk (for dataset collection).
     """
     await save_frame_from_websocket(websocket)
+
+# ✅ WebSocket endpoint for dashboards / caregiver apps
+@app.websocket("/events")
+async def events_route(websocket: WebSocket):
+    """
+    Streams scenario events and track summaries of all robots, or of `?robot=<id>`.
+    """
+    await events_endpoint(websocket)
+
+# ✅ Scenario history (services/event_store.py)
+@app.get("/history/events")
+async def history_events_route(robot: str = None, session: str = None, scenario: str = None,
+                               since: float = None, until: float = None, before_id: int = None, limit: int = 100):
+    """
+    Stored scenario events, newest first (pass the returned `next` as `until` / `before_id` to page back).
+    """
+    return await event_history(robot, session, scenario, since, until, before_id, incidents_only=False, limit=limit)
+
+@app.get("/history/incidents")
+async def history_incidents_route(robot: str = None, session: str = None, scenario: str = None,
+                                  since: float = None, until: float = None, before_id: int = None, limit: int = 100):
+    """
+    Stored emergencies (scenarios with an incident id), newest first.
+    """
+    return await event_history(robot, session, scenario, since, until, before_id, incidents_only=True, limit=limit)
+
+@app.get("/history/daily")
+async def history_daily_route(robot: str = None, scenario: str = None, since: str = None, until: str = None):
+    """
+    Events and incidents per day and scenario (`since` / `until` as YYYY-MM-DD).
+    """
+    return await daily_aggregates(robot, scenario, since, until)
+
+# ✅ Robot sessions (services/session_registry.py)
+@app.get("/sessions")
+async def sessions_route():
+    """
+    Robot sessions held by this process (or, with multi-process serving, by the inference servers).
+    """
+    if settings.INFERENCE_SERVERS:
+        return await inference_client.session_stats()
+    return sessions.stats()
+
+# ✅ Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_route():
+    """
+    All in-process metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
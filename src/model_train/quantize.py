@@ -0,0 +1,339 @@
+"""
+quantize.py - INT8 post-training quantization of the kitchen detector
+
+This script exports the trained FP32 `best.pt` to ONNX, calibrates a static INT8
+quantization on the Roboflow training images and validates both models.
+The INT8 model is only published (copied next to best.pt as best_int8.onnx)
+if mAP on the safety-critical classes drops by no more than MAX_MAP_DROP – and
+never if one of them could not be measured (unknown to the model or without
+labels in the val split).
+
+A report with per-class mAP, CPU latency and memory of FP32 vs INT8 is written
+to quantization_report.md / .json next to the weights in every case.
+
+Requirements:
+- ultralytics (YOLOv8)
+- onnx, onnxruntime
+- psutil
+
+Usage (from the repository root):
+    python src/model_train/quantize.py
+    python src/model_train/quantize.py --max-map-drop 0.01 --calibration-images 300
+
+Author: Idan Vahab
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import random
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # make `services` importable
+
+from services.inference_backends import DEFAULT_WEIGHTS, load_backend, _to_tensor
+from services.preprocess import LetterboxPool
+
+# =======================
+# CONFIGURATION SECTION
+# =======================
+
+# Relative path to dataset configuration (same as train.py)
+data_yaml = Path("roboflow/data.yaml")
+
+# Classes whose accuracy must not regress
+SAFETY_CLASSES = ["metal pot in a microwave", "pot", "open microwave"]
+
+# Maximum allowed absolute mAP50-95 drop on any safety class
+MAX_MAP_DROP = 0.02
+
+img_size = 640
+calibration_images = 200
+latency_iterations = 50
+seed = 42
+
+INT8_NAME = "best_int8.onnx"
+REPORT_NAME = "quantization_report"
+
+
+# =======================
+# CALIBRATION
+# =======================
+
+def resolve_split_dir(data_yaml_path: Path, split: str) -> Path:
+    """
+    Resolves the image folder of a dataset split the way Roboflow writes data.yaml.
+    """
+    with open(data_yaml_path) as f:
+        data = yaml.safe_load(f)
+    root = data_yaml_path.parent
+    candidates = [root / split / "images"]
+    if data.get(split):
+        # Roboflow writes paths like "../train/images", relative to a folder inside the dataset
+        candidates = [root / data[split], root / data[split].lstrip("./"), *candidates]
+    for candidate in candidates:
+        if candidate.is_dir():
+            return candidate.resolve()
+    raise SystemExit(f"❌ Could not find the '{split}' images for {data_yaml_path}")
+
+
+def load_calibration_inputs(image_dir: Path, imgsz: int, limit: int) -> list:
+    """
+    Letterboxes a random sample of training images exactly like the server does.
+    """
+    paths = sorted(p for p in image_dir.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    random.Random(seed).shuffle(paths)
+
+    pool = LetterboxPool(imgsz, slots=1)
+    inputs = []
+    for path in paths[:limit]:
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        model_input, _, _ = pool.letterbox(image, 0)
+        inputs.append(model_input.copy())
+    return inputs
+
+
+class LetterboxCalibrationReader:
+    """
+    onnxruntime CalibrationDataReader over preprocessed training images.
+    """
+
+    def __init__(self, input_name: str, inputs: list):
+        self.input_name = input_name
+        self._iter = iter(inputs)
+
+    def get_next(self):
+        model_input = next(self._iter, None)
+        if model_input is None:
+            return None
+        return {self.input_name: _to_tensor([model_input])}
+
+
+def detect_head_nodes(onnx_path: Path) -> list:
+    """
+    Names of the nodes in the YOLOv8 Detect head (the last `/model.N/` block).
+
+    The head mixes box coordinates and class scores of very different ranges,
+    so it is kept in FP32 – quantizing it costs most of the accuracy loss.
+    """
+    import onnx
+
+    graph = onnx.load(str(onnx_path)).graph
+    blocks = [int(node.name.split("/")[1].split(".")[1]) for node in graph.node
+              if node.name.startswith("/model.") and node.name.split("/")[1].split(".")[1].isdigit()]
+    if not blocks:
+        return []
+    head_prefix = f"/model.{max(blocks)}/"
+    return [node.name for node in graph.node if node.name.startswith(head_prefix)]
+
+
+def quantize(fp32_onnx: Path, int8_onnx: Path, calibration_inputs: list, exclude_head: bool):
+    """
+    Static QDQ INT8 quantization of an exported YOLO ONNX model.
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared = fp32_onnx.with_name(fp32_onnx.stem + "_prep.onnx")
+    quant_pre_process(str(fp32_onnx), str(prepared))
+
+    input_name = ort.InferenceSession(str(prepared), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        str(prepared),
+        str(int8_onnx),
+        LetterboxCalibrationReader(input_name, calibration_inputs),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=detect_head_nodes(prepared) if exclude_head else [],
+    )
+    prepared.unlink(missing_ok=True)
+
+    # Keep the class names for OnnxBackend
+    import onnx
+    source, target = onnx.load(str(fp32_onnx)), onnx.load(str(int8_onnx))
+    del target.metadata_props[:]
+    target.metadata_props.extend(source.metadata_props)
+    onnx.save(target, str(int8_onnx))
+
+
+# =======================
+# EVALUATION
+# =======================
+
+def validate(model_path: Path, imgsz: int, data: Path = data_yaml) -> dict:
+    """
+    Runs the ultralytics validation pass on the dataset's val split (CPU).
+
+    Returns:
+        dict: Overall mAP50 / mAP50-95, per-class mAP50-95 and per-class recall
+              (classes without validation labels have no recall entry).
+    """
+    from ultralytics import YOLO
+
+    metrics = YOLO(str(model_path), task="detect").val(
+        data=str(data), imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False
+    )
+    per_class = {name: float(metrics.box.maps[i]) for i, name in metrics.names.items()}
+    recall = {metrics.names[int(c)]: float(metrics.box.r[i]) for i, c in enumerate(metrics.box.ap_class_index)}
+    return {
+        "map50": float(metrics.box.map50), "map50_95": float(metrics.box.map),
+        "per_class": per_class, "per_class_recall": recall,
+    }
+
+
+def _measure_worker(config: dict, inputs: list, iterations: int, queue):
+    import psutil
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    backend = load_backend(config)
+    backend.predict([inputs[0]])
+    rss_loaded = process.memory_info().rss
+
+    latencies = []
+    peak_rss = rss_loaded
+    for i in range(iterations):
+        start = time.perf_counter()
+        backend.predict([inputs[i % len(inputs)]])
+        latencies.append((time.perf_counter() - start) * 1000)
+        peak_rss = max(peak_rss, process.memory_info().rss)
+
+    queue.put({
+        "median_ms": round(statistics.median(latencies), 2),
+        "model_rss_mb": round((rss_loaded - rss_before) / 2 ** 20, 1),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+    })
+
+
+def measure_cpu(config: dict, inputs: list, iterations: int) -> dict:
+    """
+    Measures single-frame CPU latency and memory of one model in a fresh process,
+    so the numbers of the two models don't pollute each other.
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    worker = ctx.Process(target=_measure_worker, args=(config, inputs, iterations, queue))
+    worker.start()
+    result = queue.get()
+    worker.join()
+    return result
+
+
+def write_report(report: dict, weights_dir: Path):
+    with open(weights_dir / f"{REPORT_NAME}.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    fp32, int8 = report["fp32"], report["int8"]
+    lines = [
+        "# INT8 quantization report",
+        "",
+        f"Status: **{'PUBLISHED' if report['published'] else 'REJECTED'}** "
+        f"(max allowed safety-class mAP50-95 drop: {report['max_map_drop']})",
+        "",
+        "| Metric | FP32 (best.pt) | INT8 (ONNX) |",
+        "|---|---|---|",
+        f"| mAP50 | {fp32['map50']:.4f} | {int8['map50']:.4f} |",
+        f"| mAP50-95 | {fp32['map50_95']:.4f} | {int8['map50_95']:.4f} |",
+        f"| CPU latency (median, ms) | {fp32['median_ms']} | {int8['median_ms']} |",
+        f"| Model memory (MB) | {fp32['model_rss_mb']} | {int8['model_rss_mb']} |",
+        f"| Peak RSS (MB) | {fp32['peak_rss_mb']} | {int8['peak_rss_mb']} |",
+        f"| File size (MB) | {fp32['file_mb']} | {int8['file_mb']} |",
+        "",
+        "| Safety class | FP32 mAP50-95 | INT8 mAP50-95 | Drop |",
+        "|---|---|---|---|",
+    ]
+    for name, drop in report["safety_drops"].items():
+        lines.append(f"| {name} | {fp32['per_class'][name]:.4f} | {int8['per_class'][name]:.4f} | {drop:+.4f} |")
+    for name in report["unmeasured"]:
+        lines.append(f"| {name} | not measured | not measured | – |")
+    with open(weights_dir / f"{REPORT_NAME}.md", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization with an accuracy gate.")
+    parser.add_argument("--weights", default=str(DEFAULT_WEIGHTS), help="FP32 PyTorch weights")
+    parser.add_argument("--imgsz", type=int, default=img_size)
+    parser.add_argument("--calibration-images", type=int, default=calibration_images)
+    parser.add_argument("--max-map-drop", type=float, default=MAX_MAP_DROP)
+    parser.add_argument("--quantize-head", action="store_true", help="Also quantize the Detect head")
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+
+    weights = Path(args.weights)
+    weights_dir = weights.parent
+    work_dir = weights_dir / "int8_work"
+    work_dir.mkdir(exist_ok=True)
+
+    # ✅ Export FP32 ONNX (static batch of 1 – what the robot-side servers run)
+    fp32_onnx = work_dir / "best_fp32.onnx"
+    exported = YOLO(str(weights)).export(format="onnx", imgsz=args.imgsz, simplify=True)
+    shutil.move(exported, fp32_onnx)
+
+    # ✅ Calibrate + quantize
+    calibration_dir = resolve_split_dir(data_yaml, "train")
+    inputs = load_calibration_inputs(calibration_dir, args.imgsz, args.calibration_images)
+    print(f"📏 Calibrating on {len(inputs)} images from {calibration_dir}")
+    int8_onnx = work_dir / INT8_NAME
+    quantize(fp32_onnx, int8_onnx, inputs, exclude_head=not args.quantize_head)
+
+    # ✅ Validate both models
+    print("🧪 Validating FP32 ...")
+    fp32 = validate(weights, args.imgsz)
+    print("🧪 Validating INT8 ...")
+    int8 = validate(int8_onnx, args.imgsz)
+
+    # ✅ CPU latency / memory side by side
+    fp32.update(measure_cpu({"backend": "torch", "weights": str(weights), "imgsz": args.imgsz}, inputs, latency_iterations))
+    int8.update(measure_cpu({"backend": "onnx", "weights": str(int8_onnx), "imgsz": args.imgsz}, inputs, latency_iterations))
+    fp32["file_mb"] = round(weights.stat().st_size / 2 ** 20, 1)
+    int8["file_mb"] = round(int8_onnx.stat().st_size / 2 ** 20, 1)
+
+    # ✅ Accuracy gate on the safety-critical classes – a class that can't be measured
+    # (not in the model, or no val labels and hence no recall entry) fails the gate
+    unmeasured = [
+        name for name in SAFETY_CLASSES
+        if not all(name in model["per_class"] and name in model["per_class_recall"] for model in (fp32, int8))
+    ]
+    safety_drops = {
+        name: fp32["per_class"][name] - int8["per_class"][name] for name in SAFETY_CLASSES if name not in unmeasured
+    }
+    published = not unmeasured and all(drop <= args.max_map_drop for drop in safety_drops.values())
+
+    if published:
+        shutil.copy(int8_onnx, weights_dir / INT8_NAME)
+        print(f"✅ INT8 model published: {weights_dir / INT8_NAME}")
+    elif unmeasured:
+        print(f"⛔ INT8 model rejected: no validation result for safety class(es) {', '.join(unmeasured)}")
+    else:
+        worst = max(safety_drops, key=safety_drops.get)
+        print(f"⛔ INT8 model rejected: mAP on '{worst}' dropped by {safety_drops[worst]:.4f} (> {args.max_map_drop})")
+
+    write_report({
+        "published": published,
+        "max_map_drop": args.max_map_drop,
+        "safety_drops": safety_drops,
+        "unmeasured": unmeasured,
+        "fp32": fp32,
+        "int8": int8,
+    }, weights_dir)
+    print(f"📄 Report: {weights_dir / (REPORT_NAME + '.md')}")
+    sys.exit(0 if published else 1)
+
+
+if __name__ == "__main__":
+    main()
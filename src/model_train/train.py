@@ -1,23 +1,54 @@
 """
-train.py - YOLOv8 custom training script for kitchen scenario detection
+train.py - YOLOv8 model family training / distillation for kitchen scenario detection
 
-This script loads a pre-trained YOLOv8 model and retrains it using a Roboflow dataset
-that includes labels such as metal_pot, plate, microwave, and cutlery.
-Results are saved to a structured output folder and include plots and CSV metrics.
+Trains a family of candidate detectors (YOLOv8n / YOLOv8s at several input sizes)
+on the Roboflow dataset (labels such as metal_pot, plate, microwave and cutlery),
+benchmarks every candidate on this machine's CPU and writes a latency-vs-accuracy
+Pareto report, so the fastest model that still finds the hazards can be deployed.
+
+Distillation: by default the trained `best.pt` acts as teacher. Its confident
+detections on the training images are added where the annotators left no box of
+the same class (and, with --unlabeled, on extra robot frames that were never
+labelled), and each student is trained on that enlarged label set, starting from
+the COCO-pretrained YOLOv8 weights of its size. --no-distill trains on the
+ground-truth labels only.
+
+For every candidate the report lists mAP50 / mAP50-95, recall on the hazard
+classes, median single-frame CPU latency and peak memory (measured in a fresh
+process, see quantize.py). It is written as model_family_report.md / .json next
+to the teacher's results.csv; each candidate's own run folder (with its
+results.csv) is under yolo_custom_training/family/.
 
 Requirements:
 - Python 3.8
 - ultralytics (YOLOv8)
 - torch
+- psutil
+
+Usage (from the repository root):
+    python src/model_train/train.py                                   # full family: v8n/v8s x 320/480/640
+    python src/model_train/train.py --candidates v8n:320,v8n:480 --epochs 30
+    python src/model_train/train.py --unlabeled src/frames_jpg        # distill on extra robot frames too
+    python src/model_train/train.py --benchmark-only                  # re-measure already trained runs
 
 Author: Idan Vahab
 """
 
-from ultralytics import YOLO
-from pathlib import Path
-import os
+import argparse
+import json
 import random
-import torch
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # make `services` importable
+
+from services.inference_backends import DEFAULT_WEIGHTS
+from services.iou_tracker import iou_matrix
+from quantize import SAFETY_CLASSES, load_calibration_inputs, measure_cpu, resolve_split_dir, validate
 
 # =======================
 # CONFIGURATION SECTION
@@ -26,60 +57,154 @@ import torch
 # Relative path to dataset configuration
 data_yaml = Path("roboflow/data.yaml")
 
-# Project and run names
-project_name = "yolo_custom_training"
-run_name = "yolov8s_run"
+# Project folder; every candidate gets its own run under <project>/family/
+project_name = Path(__file__).resolve().parent / "yolo_custom_training"
 
-# Path to YOLO weights
-model_arch = Path("src/model_train/yolo_custom_training/yolov8s_run/weights/best.pt")
+# Candidate architectures (COCO-pretrained starting points) and input sizes
+ARCHITECTURES = {"v8n": "yolov8n.pt", "v8s": "yolov8s.pt"}
+IMAGE_SIZES = [320, 480, 640]
+
+# Hazard classes a deployed model must keep finding, and the recall each needs
+HAZARD_CLASSES = SAFETY_CLASSES
+MIN_HAZARD_RECALL = 0.9
+
+# Input size the teacher (best.pt) was trained at
+TEACHER_IMGSZ = 640
+
+# Teacher detections at or above this confidence become extra training labels
+DISTILL_CONF = 0.5
+# ... unless they overlap a ground-truth box of the same class this much
+DISTILL_IOU = 0.5
 
 # Training hyperparameters
-img_size = 640
 epochs = 50
 batch = 8
 seed = 42
+latency_iterations = 50
+benchmark_images = 50
 
-# =======================
-# OUTPUT SETUP
-# =======================
+REPORT_NAME = "model_family_report"
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
 
-output_dir = Path(f"runs/detect/{run_name}")
-os.makedirs(output_dir, exist_ok=True)
 
 # =======================
-# REPRODUCIBILITY
+# DISTILLATION DATASET
 # =======================
 
-random.seed(seed)
-torch.manual_seed(seed)
-torch.cuda.manual_seed_all(seed)
+def read_labels(label_path: Path) -> np.ndarray:
+    """
+    YOLO txt labels as an (N, 5) array of class, cx, cy, w, h (normalized).
+    """
+    if not label_path.exists():
+        return np.zeros((0, 5))
+    return np.loadtxt(label_path, ndmin=2).reshape(-1, 5)
+
+
+def _xyxy(labels: np.ndarray) -> np.ndarray:
+    cx, cy, w, h = labels[:, 1], labels[:, 2], labels[:, 3], labels[:, 4]
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def merge_teacher_labels(ground_truth: np.ndarray, teacher: np.ndarray) -> np.ndarray:
+    """
+    Ground truth plus the teacher boxes that no ground-truth box of the same class covers.
+    """
+    if len(teacher) == 0:
+        return ground_truth
+    if len(ground_truth) == 0:
+        return teacher
+    iou = iou_matrix(_xyxy(teacher), _xyxy(ground_truth))
+    same_class = teacher[:, :1] == ground_truth[:, 0]
+    covered = ((iou >= DISTILL_IOU) & same_class).any(axis=1)
+    return np.concatenate([ground_truth, teacher[~covered]])
+
+
+def build_distillation_dataset(teacher_weights: Path, data: Path, out_dir: Path, imgsz: int, unlabeled: Path = None) -> Path:
+    """
+    Writes a dataset whose training labels are ground truth + teacher detections.
+
+    Images are linked, not copied; the validation split is the original one, so
+    every candidate is scored against the human labels only.
+
+    Returns:
+        Path: data.yaml of the new dataset.
+    """
+    from ultralytics import YOLO
+
+    with open(data) as f:
+        config = yaml.safe_load(f)
+    train_images = resolve_split_dir(data, "train")
+    train_labels = train_images.parent / "labels"
+    sources = [(p, train_labels / f"{p.stem}.txt") for p in sorted(train_images.iterdir()) if p.suffix.lower() in IMAGE_SUFFIXES]
+    if unlabeled is not None:
+        sources += [(p, None) for p in sorted(Path(unlabeled).iterdir()) if p.suffix.lower() in IMAGE_SUFFIXES]
+
+    images_dir, labels_dir = out_dir / "train" / "images", out_dir / "train" / "labels"
+    shutil.rmtree(out_dir / "train", ignore_errors=True)
+    images_dir.mkdir(parents=True)
+    labels_dir.mkdir(parents=True)
+
+    teacher = YOLO(str(teacher_weights))
+    added = 0
+    for i in range(0, len(sources), batch):
+        chunk = sources[i:i + batch]
+        results = teacher.predict([str(p) for p, _ in chunk], imgsz=imgsz, conf=DISTILL_CONF, verbose=False)
+        for (image_path, label_path), result in zip(chunk, results):
+            boxes = result.boxes
+            predicted = np.zeros((0, 5))
+            if boxes is not None and len(boxes):
+                predicted = np.concatenate([boxes.cls.cpu().numpy()[:, None], boxes.xywhn.cpu().numpy()], axis=1)
+            ground_truth = read_labels(label_path) if label_path is not None else np.zeros((0, 5))
+            labels = merge_teacher_labels(ground_truth, predicted)
+            added += len(labels) - len(ground_truth)
+
+            # Unlabelled frames may share names with training images
+            name = image_path.name if label_path is not None else f"unlabeled_{image_path.name}"
+            try:
+                (images_dir / name).symlink_to(image_path.resolve())
+            except OSError:  # no symlink permission (Windows)
+                shutil.copy(image_path, images_dir / name)
+            np.savetxt(labels_dir / f"{Path(name).stem}.txt", labels, fmt=["%d", "%.6f", "%.6f", "%.6f", "%.6f"])
+
+    distilled = {
+        "names": config["names"],
+        "nc": len(config["names"]),
+        "train": str(images_dir.resolve()),
+        "val": str(resolve_split_dir(data, "val")),
+    }
+    distilled_yaml = out_dir / "data.yaml"
+    with open(distilled_yaml, "w") as f:
+        yaml.safe_dump(distilled, f)
+    print(f"🧑‍🏫 Distillation set: {len(sources)} images, {added} teacher labels added → {distilled_yaml}")
+    return distilled_yaml
+
 
 # =======================
-# LOAD MODEL
+# TRAINING
 # =======================
 
-model = YOLO(str(model_arch))
-
-if __name__ == "__main__":
+def train_candidate(arch: str, imgsz: int, data: Path, device: str, run_epochs: int) -> Path:
     """
-    Start YOLOv8 training with custom configuration.
+    Trains one candidate and returns the path of its best weights.
     """
-    model.train(
-        data=str(data_yaml),
-        epochs=epochs,
-        imgsz=img_size,
+    from ultralytics import YOLO
+
+    run_name = f"yolo{arch}_{imgsz}"
+    YOLO(ARCHITECTURES[arch]).train(
+        data=str(data),
+        epochs=run_epochs,
+        imgsz=imgsz,
         batch=batch,
         seed=seed,
-        project=project_name,
+        project=str(project_name / "family"),
         name=run_name,
         workers=4,
-        device=0,
+        device=device,
         val=True,
         verbose=True,
         save=True,
-        save_period=1,
         exist_ok=True,
-        pretrained=False,
+        pretrained=True,
         resume=False,
         lr0=0.01,
         warmup_epochs=3,
@@ -97,7 +222,154 @@ if __name__ == "__main__":
         save_conf=True,
         plots=True
     )
+    return project_name / "family" / run_name / "weights" / "best.pt"
+
+
+# =======================
+# REPORT
+# =======================
+
+def pareto_front(candidates: list) -> list:
+    """
+    Names of the candidates no other candidate beats on both CPU latency and mAP50-95.
+    """
+    front = []
+    for c in candidates:
+        dominated = any(
+            o["median_ms"] <= c["median_ms"] and o["map50_95"] >= c["map50_95"]
+            and (o["median_ms"] < c["median_ms"] or o["map50_95"] > c["map50_95"])
+            for o in candidates
+        )
+        if not dominated:
+            front.append(c["name"])
+    return front
+
+
+def hazard_recall(result: dict) -> dict:
+    return {name: result["per_class_recall"].get(name, 0.0) for name in HAZARD_CLASSES}
+
+
+def write_report(report: dict, report_dir: Path):
+    with open(report_dir / f"{REPORT_NAME}.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    candidates = sorted(report["candidates"], key=lambda c: c["median_ms"])
+    lines = [
+        "# Model family report",
+        "",
+        f"Hazard recall target: **{report['min_hazard_recall']}** on {', '.join(HAZARD_CLASSES)} "
+        f"(CPU: {report['cpu']}, {report['iterations']} single-frame predicts per model).",
+        "",
+        f"Recommended: **{report['recommended'] or 'none – no candidate meets the recall target'}**",
+        "",
+        "| Model | imgsz | Latency (median, ms) | Peak RSS (MB) | mAP50 | mAP50-95 | "
+        + " | ".join(f"Recall {name}" for name in HAZARD_CLASSES) + " | Pareto | Meets target |",
+        "|---|---|---|---|---|---|" + "---|" * len(HAZARD_CLASSES) + "---|---|",
+    ]
+    for c in candidates:
+        recalls = " | ".join(f"{c['hazard_recall'][name]:.3f}" for name in HAZARD_CLASSES)
+        lines.append(
+            f"| {c['name']} | {c['imgsz']} | {c['median_ms']} | {c['peak_rss_mb']} | {c['map50']:.4f} | "
+            f"{c['map50_95']:.4f} | {recalls} | {'✅' if c['pareto'] else ''} | {'✅' if c['meets_target'] else '⛔'} |"
+        )
+    with open(report_dir / f"{REPORT_NAME}.md", "w") as f:
+        f.write("\n".join(lines) + "\n")
 
-    print(f"✅ Training complete. Results saved in: {output_dir}")
-    print(f"📈 To visualize metrics: open {output_dir}/results.png")
-    print(f"📉 To analyze CSV: open {output_dir}/results.csv")
+
+def parse_candidates(value: str) -> list:
+    candidates = []
+    for item in value.split(","):
+        arch, imgsz = item.split(":")
+        if arch not in ARCHITECTURES:
+            raise SystemExit(f"❌ Unknown architecture {arch!r}, expected one of {', '.join(ARCHITECTURES)}")
+        candidates.append((arch, int(imgsz)))
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train/distill a family of detectors and write a latency-vs-accuracy report.")
+    parser.add_argument("--data", default=str(data_yaml), help="Roboflow data.yaml")
+    parser.add_argument("--teacher", default=str(DEFAULT_WEIGHTS), help="Teacher weights (the current best.pt)")
+    parser.add_argument("--candidates", default=",".join(f"{a}:{s}" for a in ARCHITECTURES for s in IMAGE_SIZES),
+                        help="Comma-separated arch:imgsz pairs")
+    parser.add_argument("--epochs", type=int, default=epochs)
+    parser.add_argument("--device", default=None, help="Training device, e.g. 0 or cpu (default: first GPU if available)")
+    parser.add_argument("--no-distill", action="store_true", help="Train on the ground-truth labels only")
+    parser.add_argument("--unlabeled", default=None, help="Folder of unlabelled robot frames the teacher labels as well")
+    parser.add_argument("--min-recall", type=float, default=MIN_HAZARD_RECALL, help="Required recall on every hazard class")
+    parser.add_argument("--benchmark-only", action="store_true", help="Skip training, evaluate existing family runs")
+    args = parser.parse_args()
+
+    import psutil
+    import torch
+
+    random.seed(seed)
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+    device = args.device or ("0" if torch.cuda.is_available() else "cpu")
+
+    data = Path(args.data)
+    teacher = Path(args.teacher)
+    candidates = parse_candidates(args.candidates)
+
+    # ✅ Training data: ground truth, or ground truth + teacher labels
+    train_data = data
+    if not args.benchmark_only and not args.no_distill:
+        train_data = build_distillation_dataset(teacher, data, project_name / "distill_data", TEACHER_IMGSZ, args.unlabeled)
+
+    # ✅ Train every candidate (the teacher is measured as the reference)
+    models = [("teacher", teacher, TEACHER_IMGSZ)]
+    for arch, imgsz in candidates:
+        if args.benchmark_only:
+            weights = project_name / "family" / f"yolo{arch}_{imgsz}" / "weights" / "best.pt"
+            if not weights.exists():
+                print(f"⚠️ No trained weights for {arch}@{imgsz} ({weights}), skipping")
+                continue
+        else:
+            print(f"🏋️ Training {arch} @ {imgsz} for {args.epochs} epochs on {device} ...")
+            weights = train_candidate(arch, imgsz, train_data, device, args.epochs)
+        models.append((f"yolo{arch}_{imgsz}", weights, imgsz))
+
+    # ✅ Accuracy on the human-labelled val split + CPU latency / memory
+    val_images = resolve_split_dir(data, "val")
+    results = []
+    for name, weights, imgsz in models:
+        print(f"🧪 Evaluating {name} ...")
+        result = validate(weights, imgsz, data)
+        inputs = load_calibration_inputs(val_images, imgsz, benchmark_images)
+        result.update(measure_cpu({"backend": "torch", "weights": str(weights), "imgsz": imgsz}, inputs, latency_iterations))
+        recalls = hazard_recall(result)
+        results.append({
+            "name": name, "imgsz": imgsz, "weights": str(weights),
+            "file_mb": round(Path(weights).stat().st_size / 2 ** 20, 1),
+            "hazard_recall": recalls,
+            "meets_target": all(r >= args.min_recall for r in recalls.values()),
+            **result,
+        })
+
+    front = set(pareto_front(results))
+    for result in results:
+        result["pareto"] = result["name"] in front
+    meeting = [r for r in results if r["meets_target"]]
+    recommended = min(meeting, key=lambda r: r["median_ms"]) if meeting else None
+
+    report_dir = teacher.parent.parent  # the teacher's run folder, next to its results.csv
+    write_report({
+        "min_hazard_recall": args.min_recall,
+        "distilled": not args.no_distill,
+        "cpu": f"{psutil.cpu_count(logical=False)} cores",
+        "iterations": latency_iterations,
+        "recommended": recommended["name"] if recommended else None,
+        "candidates": results,
+    }, report_dir)
+
+    if recommended:
+        print(f"✅ Fastest model meeting the hazard recall target: {recommended['weights']} "
+              f"({recommended['median_ms']} ms @ {recommended['imgsz']})")
+    else:
+        print(f"⛔ No candidate reaches recall {args.min_recall} on every hazard class")
+    print(f"📄 Report: {report_dir / (REPORT_NAME + '.md')}")
+
+
+if __name__ == "__main__":
+    main()
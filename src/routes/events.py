@@ -0,0 +1,53 @@
+from fastapi import WebSocket
+import asyncio
+import json
+from services.event_bus import bus, ALL_ROBOTS
+
+
+async def _wait_for_disconnect(websocket: WebSocket, subscriber):
+    """
+    Dashboards don't send anything; this only notices when they go away.
+    """
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        subscriber.close()
+
+
+async def events_endpoint(websocket: WebSocket):
+    """
+    Streams scenario events and track summaries to a dashboard or caregiver app.
+
+    Query parameters:
+        robot: Only events of this robot id (default: all robots).
+
+    Every message is a JSON object:
+        - {"type": "scenario", "robot", "session", "ts", "scenario", "timestamp", "incident_id"}
+        - {"type": "tracks", "robot", "session", "ts", "prediction", "labels", "tracks": [[id, label, x1, y1, x2, y2], ...]}
+        - {"type": "profile", "robot", "session", "ts", "profile", "imgsz", "max_fps"}: inference profile changed
+        - {"type": "dropped", "count"}: events skipped because this subscriber fell behind
+
+    Args:
+        websocket (WebSocket): Connection of the subscriber.
+    """
+    await websocket.accept()
+    robot = websocket.query_params.get("robot") or ALL_ROBOTS
+    subscriber = bus.subscribe(robot)
+    watcher = asyncio.create_task(_wait_for_disconnect(websocket, subscriber))
+    print(f"📺 Event subscriber connected ({robot or 'all robots'})")
+
+    reported_drops = 0
+    try:
+        while (payload := await subscriber.get()) is not None:
+            if subscriber.dropped > reported_drops:
+                await websocket.send_text(json.dumps({"type": "dropped", "count": subscriber.dropped - reported_drops}))
+                reported_drops = subscriber.dropped
+            await websocket.send_text(payload)
+    except Exception as e:
+        print(f"❌ Event subscriber error: {e}")
+    finally:
+        bus.unsubscribe(subscriber)
+        print("📺 Event subscriber disconnected")
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
@@ -0,0 +1,75 @@
+from datetime import datetime
+from functools import partial
+import asyncio
+from fastapi.responses import JSONResponse
+from services.event_store import store, MAX_QUERY_LIMIT
+
+
+def _valid_day(day: str) -> bool:
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+def _store_unavailable():
+    if store is None or not store.running:
+        return JSONResponse({"error": "event store disabled"}, status_code=503)
+    return None
+
+
+async def _query(query, **filters):
+    """
+    Runs an event store query in the store's query threads (never on the event loop).
+    """
+    return await asyncio.get_running_loop().run_in_executor(store.query_executor, partial(query, **filters))
+
+
+async def event_history(robot: str = None, session: str = None, scenario: str = None, since: float = None,
+                        until: float = None, before_id: int = None, incidents_only: bool = False, limit: int = 100):
+    """
+    Stored scenario events (see services/event_store.py), newest first.
+
+    Query parameters:
+        robot, session, scenario: Exact filters.
+        since / until: Time range in seconds since epoch (until is exclusive).
+        until + before_id: Paging cursor – pass the returned `next` to get the next (older) page.
+        incidents_only: Only emergencies (events with an incident id).
+        limit: Events per page (at most 1000).
+
+    Returns:
+        {"events": [{"id", "ts", "robot", "session", "scenario", "incident_id"}, ...],
+         "next": {"until", "before_id"} of the last event, or None on the last page}
+    """
+    if (error := _store_unavailable()) is not None:
+        return error
+    events = await _query(
+        store.events, robot=robot, session=session, scenario=scenario,
+        since=since, until=until, before_id=before_id, incidents_only=incidents_only, limit=limit,
+    )
+    cursor = None
+    if events and len(events) >= max(1, min(limit, MAX_QUERY_LIMIT)):
+        cursor = {"until": events[-1]["ts"], "before_id": events[-1]["id"]}
+    return {"events": events, "next": cursor}
+
+
+async def daily_aggregates(robot: str = None, scenario: str = None, since: str = None, until: str = None):
+    """
+    Number of events and incidents per day and scenario, newest day first.
+
+    Query parameters:
+        robot: Only this robot (default: all robots together).
+        scenario: Only this scenario.
+        since / until: Inclusive day range, YYYY-MM-DD (server's local time).
+
+    Returns:
+        {"days": [{"day", "scenario", "events", "incidents"}, ...]}
+    """
+    if (error := _store_unavailable()) is not None:
+        return error
+    for day in (since, until):
+        if day is not None and not _valid_day(day):
+            return JSONResponse({"error": f"invalid day {day!r}, expected YYYY-MM-DD"}, status_code=400)
+    days = await _query(store.daily, robot=robot, scenario=scenario, since_day=since, until_day=until)
+    return {"days": days}
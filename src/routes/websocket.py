@@ -1,17 +1,40 @@
 from fastapi import WebSocket, WebSocketDisconnect
-import time, asyncio
-from services.yolo_service import process_frame_and_predict
-from services.moon_service import send_moondream_result
-from utils.scenario_handler import ScenarioHandler
+import os, time, asyncio, itertools
+import settings
+from datetime import datetime
+from services.inference_worker import InferencePipeline
+from services.inference_client import RemoteInferencePipeline
+from services.session_registry import connection_key
+from services.moon_service import send_moondream_result, close_moondream_session
+from services.event_bus import bus
+from services.event_store import store as event_store
+from utils.frame_protocol import parse_frame, encode_reply, FrameProtocolError
+from utils.frame_archive import FrameArchiveWriter
+from utils import metrics
+from utils.structured_log import get_logger, log_event, SampledLog
+import logging
 
-# List to keep track of connected clients
-connected_clients = []
+# Per-connection session keys (MoonDream queues are kept per session)
+session_ids = itertools.count(1)
 
-# Timestamp of the last time MoonDream was triggered
-last_moondream_sent = 0
+# If set, every session's raw frames are recorded there (replay with utils/replay_session.py)
+RECORDINGS_DIR = settings.RECORDINGS_DIR
 
-# Interval in seconds between MoonDream triggers
-MOONDREAM_INTERVAL = 3.0
+# Robot label for legacy text clients, which don't send a robot id
+UNKNOWN_ROBOT = "unknown"
+
+# Minimum time between two track summaries of a session on the event bus (scenarios are always published)
+TRACK_EVENT_INTERVAL = 1.0
+
+frames_received = metrics.counter_family("frames_received_total", "Frames received on /ws", ("robot",))
+frames_dropped = metrics.counter_family("frames_dropped_total", "Stale frames dropped before inference", ("robot",))
+frames_throttled = metrics.counter_family(
+    "frames_throttled_total", "Frames skipped by the frame budget of the session's inference profile", ("robot",)
+)
+send_histogram = metrics.histogram("reply_send_seconds", "Time to send the reply of one frame")
+
+log = get_logger("ws")
+frame_log = SampledLog(log, interval=1.0)
 
 async def websocket_endpoint(websocket: WebSocket):
     """
@@ -19,65 +42,141 @@ async def websocket_endpoint(websocket: WebSocket):
 
     Responsibilities:
     - Accept incoming WebSocket connections from the robot.
-    - Receive base64-encoded image frames continuously.
-    - Run object detection (YOLO) and object tracking (Deep SORT).
+    - Receive image frames continuously, either as binary v1 frames
+      (see utils/frame_protocol.py) or as legacy base64 text.
+    - Run object detection (YOLO) and object tracking (Deep SORT) in a background
+      pipeline, dropping stale frames when the robot sends faster than we can infer.
     - Update the scenario handler with label history and tracked objects.
-    - Detect high-level scenarios and send them back to the robot.
-    - Optionally trigger MoonDream analysis every few seconds.
+    - Detect high-level scenarios and send them back to the robot
+      (one msgpack reply per binary frame, plain text for legacy clients),
+      together with the inference profile they put the session in.
+    - Publish scenario events and track summaries for /events subscribers,
+      and store the scenario events (services/event_store.py).
+    - Optionally trigger MoonDream analysis every few seconds (throttled per robot,
+      see SessionState in services/inference_worker.py).
 
     Args:
         websocket (WebSocket): WebSocket connection with the TEMI robot client.
     """
-    global last_moondream_sent
-
     await websocket.accept()
-    connected_clients.append(websocket)
     print("📡 Client connected")
 
-    # Initialize the scenario handler for this session
-    scenario_handler = ScenarioHandler()
-    last_labels_sent_to_moondream = set()
+    # Tracker, scenario and MoonDream throttle state live in the session registry, keyed by robot id
+    # (with multi-process serving, on the inference server) – a reconnecting robot picks them up again
+    session_id = next(session_ids)
+    last_track_event = 0
+    last_profile = None
 
-    try:
-        while True:
-            # Step 1: Receive image frame (base64 string)
-            data = await websocket.receive_text()
-            print("🖼 Received new frame from client")
+    async def handle_result(image, prediction, normalized_labels, tracked_objects, scenario, profile, ask_moondream,
+                            header):
+        nonlocal last_track_event, last_profile
 
-            # Step 2: Process image via YOLO + Deep SORT
-            image, prediction, normalized_labels, tracked_objects = await process_frame_and_predict(data)
-            print(f"🔎 YOLO Prediction: {prediction}")
-            print(f"🏷️ Labels: {normalized_labels}")
-            print(f"🎯 Tracked Objects: {len(tracked_objects)}")
+        robot = header.robot_id if header is not None and header.robot_id else UNKNOWN_ROBOT
+        frame_log.info(
+            "frame", key=session_id, session=session_id, robot=robot,
+            seq=header.seq if header is not None else None,
+            prediction=prediction, labels=normalized_labels, tracks=len(tracked_objects),
+        )
 
-            # Step 3: Send back raw prediction if exists
-            if prediction:
-                await websocket.send_text(prediction)
+        # Step 3: The scenario was evaluated right after tracking
+        if scenario:
+            log_event(log, logging.INFO, "scenario", session=session_id, robot=robot, **scenario)
+            bus.publish(robot, {"type": "scenario", "robot": robot, "session": session_id, "ts": time.time(), **scenario})
+            if event_store is not None:
+                # Session ids repeat across web workers – store the process-unique connection key
+                event_store.record(robot, connection_key(session_id), scenario)
+
+        # The scenario layer moved the robot to another inference profile
+        if profile != last_profile:
+            last_profile = profile
+            log_event(log, logging.INFO, "profile", session=session_id, robot=robot,
+                      profile=profile.name, imgsz=profile.imgsz, max_fps=profile.max_fps)
+            bus.publish(robot, {
+                "type": "profile", "robot": robot, "session": session_id, "ts": time.time(),
+                "profile": profile.name, "imgsz": profile.imgsz, "max_fps": profile.max_fps,
+            })
 
-            # Step 4: Update scenario logic
-            scenario_handler.update(normalized_labels)
-            scenario_handler.update_tracking(tracked_objects)
-            scenario = scenario_handler.get_active_scenario()
+        # Dashboards get a summary of the tracks about once a second
+        now = time.time()
+        if now - last_track_event >= TRACK_EVENT_INTERVAL:
+            last_track_event = now
+            bus.publish(robot, {
+                "type": "tracks", "robot": robot, "session": session_id, "ts": now,
+                "prediction": prediction, "labels": sorted(normalized_labels),
+                "tracks": [[obj["id"], obj["label"], *obj["bbox"]] for obj in tracked_objects],
+            })
 
-            # Step 5: If scenario detected, send it to the robot
+        # Step 4: Binary clients get prediction, scenario, tracks and the inference profile in one reply
+        started = time.perf_counter()
+        if header is not None:
+            await websocket.send_bytes(encode_reply(header, prediction, scenario, tracked_objects, profile))
+
+        # Step 4 (legacy): Send back raw prediction and scenario name as separate text messages
+        else:
+            if prediction:
+                await websocket.send_text(prediction)
             if scenario:
-                scenario_name = scenario['scenario']
                 # incident_id = scenario['incident_id']
-                message = scenario_name  # or include incident if desired
-                print(f"⚠️ Scenario Detected: {message}")
-                await websocket.send_text(message)
-
-            # Step 6: Optional MoonDream analysis
-            if (
-                time.time() - last_moondream_sent >= MOONDREAM_INTERVAL and
-                normalized_labels and
-                normalized_labels != last_labels_sent_to_moondream
-            ):
-                last_moondream_sent = time.time()
-                last_labels_sent_to_moondream = normalized_labels
-                print("🧠 Sending to MoonDream")
-                asyncio.create_task(send_moondream_result(websocket, image, normalized_labels))
+                await websocket.send_text(scenario['scenario'])  # or include incident if desired
+        send_histogram.observe(time.perf_counter() - started)
+
+        # Step 5: Optional MoonDream analysis
+        if ask_moondream:
+            log_event(log, logging.INFO, "moondream_request", session=session_id, robot=robot, labels=normalized_labels)
+            await send_moondream_result(websocket, session_id, image, normalized_labels)
+
+    # Step 2: Decode + YOLO + Deep SORT + scenarios run off the event loop, one frame in flight per stage
+    if settings.INFERENCE_SERVERS:
+        pipeline = RemoteInferencePipeline(handle_result, session_id)
+    else:
+        pipeline = InferencePipeline(handle_result, session_id)
+
+    recorder = None
+    if RECORDINGS_DIR:
+        started = datetime.now().strftime("%Y%m%d_%H%M%S")
+        recorder = FrameArchiveWriter(os.path.join(RECORDINGS_DIR, f"session_{started}_{session_id}.frames"))
+        print(f"⏺️ Recording session to {recorder.path}")
+
+    reported_drops = 0
+    reported_throttled = 0
+    try:
+        while True:
+            # Step 1: Receive image frame (binary v1 frame or base64 string)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                try:
+                    header, data = parse_frame(message["bytes"])
+                except FrameProtocolError as e:
+                    frame_log.warning("invalid_frame", key=session_id, session=session_id, error=str(e))
+                    continue
+            else:
+                header, data = None, message.get("text")
+
+            robot = header.robot_id if header is not None and header.robot_id else UNKNOWN_ROBOT
+            frames_received.labels(robot).inc()
+
+            if recorder is not None:
+                recorder.append(data, time.time())
+
+            # Newer frames replace ones the pipeline has not picked up yet (either stage may drop)
+            pipeline.submit(data, header)
+            if pipeline.dropped > reported_drops:
+                frames_dropped.labels(robot).inc(pipeline.dropped - reported_drops)
+                reported_drops = pipeline.dropped
+                frame_log.info("frame_dropped", key=session_id, session=session_id, robot=robot, total=reported_drops)
+            if pipeline.throttled > reported_throttled:
+                frames_throttled.labels(robot).inc(pipeline.throttled - reported_throttled)
+                reported_throttled = pipeline.throttled
 
     except WebSocketDisconnect:
-        connected_clients.remove(websocket)
         print("❌ Client disconnected")
+
+    finally:
+        close_moondream_session(session_id)
+        frame_log.forget(session_id)
+        await pipeline.close()
+        if recorder is not None:
+            await asyncio.get_running_loop().run_in_executor(None, recorder.close)
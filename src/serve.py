@@ -0,0 +1,59 @@
+"""
+serve.py – Multi-process serving
+
+Starts the model-owning inference server process(es) and N uvicorn worker
+processes that only do WebSocket I/O, decoding and replies:
+
+    python serve.py --workers 4 --inference-servers 1 --port 8000
+
+Web workers decode frames into shared memory and get prediction, tracks and
+scenario back from the inference server that owns the robot (see
+services/inference_server.py and services/inference_client.py). The first
+inference server also hosts MoonDream. Everything else (settings, /readyz,
+/metrics per worker) behaves as with `uvicorn main:app`.
+"""
+
+import argparse
+import os
+import secrets
+from multiprocessing import get_context
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the server with several web workers and shared inference servers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="uvicorn web worker processes")
+    parser.add_argument("--inference-servers", type=int, default=1, help="Model-owning inference processes")
+    parser.add_argument("--inference-port", type=int, default=7301, help="Port of the first inference server (localhost)")
+    args = parser.parse_args()
+
+    # The web workers and inference servers are spawned after this and inherit the environment
+    addresses = [("127.0.0.1", args.inference_port + i) for i in range(args.inference_servers)]
+    os.environ["INFERENCE_SERVERS"] = ",".join(f"{host}:{port}" for host, port in addresses)
+    os.environ["INFERENCE_AUTHKEY"] = secrets.token_hex(16)
+
+    from services.inference_server import run_inference_server
+
+    ctx = get_context("spawn")
+    servers = [
+        # Not daemonic: the first one starts the MoonDream worker process
+        ctx.Process(target=run_inference_server, args=(address, i == 0), name=f"inference-server-{i}")
+        for i, address in enumerate(addresses)
+    ]
+    for server in servers:
+        server.start()
+    print(f"🚀 {len(servers)} inference server(s), {args.workers} web worker(s) on port {args.port}")
+
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+from utils import metrics
+
+# Thumbnail used for the change check (width, height)
+THUMBNAIL_SIZE = (64, 48)
+
+# Mean absolute grey-level difference (0..255) that counts as a scene change
+CHANGE_THRESHOLD = 6.0
+
+# A full detection is forced at least every N frames or T seconds
+FORCE_EVERY_N_FRAMES = 15
+FORCE_EVERY_SECONDS = 2.0
+
+# Labels that can precede an emergency. While any of them is in view, the detector
+# runs at least every EMERGENCY_CHECK_INTERVAL seconds; while the emergency class
+# itself is in view, it runs on every frame.
+EMERGENCY_LABELS = {"metal pot in a microwave", "metal_pot_in_microwave"}
+EMERGENCY_CONTEXT_LABELS = {"pot", "open microwave", "closed microwave"}
+EMERGENCY_CHECK_INTERVAL = 0.5
+
+frames_detected = metrics.counter("gate_frames_detected_total", "Frames that ran full YOLO detection")
+frames_skipped = metrics.counter("gate_frames_skipped_total", "Static frames that reused the last detections")
+skip_ratio = metrics.gauge("gate_skip_ratio", "Share of frames that skipped detection")
+
+
+def scene_thumbnail(image: np.ndarray) -> np.ndarray:
+    """
+    Tiny greyscale version of a frame for cheap frame differencing.
+    """
+    small = cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+class SceneChangeGate:
+    """
+    Per-session keyframe scheduler.
+
+    Decides for every frame whether YOLO has to run or whether the previous
+    detections can be reused because the scene has not changed since the last
+    keyframe. Full detections are still forced periodically, and more often
+    when emergency-related objects are in view.
+    """
+
+    def __init__(self):
+        self.last_thumbnail = None
+        self.last_keyframe_time = 0.0
+        self.frames_since_keyframe = 0
+        self.last_labels = set()
+
+    def should_detect(self, thumbnail: np.ndarray, now: float) -> bool:
+        """
+        Args:
+            thumbnail (np.ndarray): Output of `scene_thumbnail` for the new frame.
+            now (float): Frame time in seconds.
+
+        Returns:
+            bool: True if the frame needs a full detection.
+        """
+        since_keyframe = now - self.last_keyframe_time
+        if (
+            self.last_thumbnail is None
+            or self.last_labels & EMERGENCY_LABELS
+            or self.frames_since_keyframe + 1 >= FORCE_EVERY_N_FRAMES
+            or since_keyframe >= FORCE_EVERY_SECONDS
+            or (self.last_labels & EMERGENCY_CONTEXT_LABELS and since_keyframe >= EMERGENCY_CHECK_INTERVAL)
+        ):
+            return True
+
+        difference = cv2.absdiff(thumbnail, self.last_thumbnail).mean()
+        return bool(difference > CHANGE_THRESHOLD)
+
+    def mark_keyframe(self, thumbnail: np.ndarray, labels: set, now: float):
+        """
+        Remember the frame that just went through full detection.
+        """
+        self.last_thumbnail = thumbnail
+        self.last_keyframe_time = now
+        self.frames_since_keyframe = 0
+        self.last_labels = set(labels)
+        frames_detected.inc()
+        self._update_ratio()
+
+    def invalidate(self):
+        """
+        Forces a full detection on the next frame (e.g. after the inference profile changed).
+        """
+        self.last_thumbnail = None
+
+    def mark_skipped(self):
+        self.frames_since_keyframe += 1
+        frames_skipped.inc()
+        self._update_ratio()
+
+    @staticmethod
+    def _update_ratio():
+        total = frames_detected.value + frames_skipped.value
+        skip_ratio.set(frames_skipped.value / total if total else 0.0)
@@ -0,0 +1,149 @@
+"""
+event_bus.py – Scenario events for dashboards and caregiver apps
+
+/ws sessions publish their scenario events and periodic track summaries here;
+/events subscribers (see routes/events.py) receive them as JSON text, either for
+one robot (`/events?robot=temi-1`) or for all robots (`/events`).
+
+- An event is serialized once, and only if somebody listens; the same string is
+  handed to every subscriber.
+- Every subscriber has a bounded queue that drops its oldest event when full,
+  so a stalled dashboard never slows down the frame pipeline.
+
+With multi-process serving the web workers relay events through the first
+inference server, so a dashboard sees every robot whichever worker it landed on.
+The workers also report their subscriber counts there, and an event is only
+relayed while a subscriber in another worker wants it.
+"""
+
+import asyncio
+import json
+from collections import deque
+from utils import metrics
+
+SUBSCRIBER_QUEUE_SIZE = 64
+
+# Subscribers of every robot are kept under this key
+ALL_ROBOTS = None
+
+subscribers_gauge = metrics.gauge("event_subscribers", "Connected /events subscribers")
+published_counter = metrics.counter("events_published_total", "Events serialized and fanned out to subscribers")
+dropped_counter = metrics.counter("event_subscriber_drops_total", "Events dropped because a subscriber fell behind")
+
+
+class Subscriber:
+    """
+    Drop-oldest queue of serialized events for one subscriber.
+
+    Args:
+        robot (str): Robot id to follow, or ALL_ROBOTS.
+        queue_size (int): Events kept before the oldest is dropped.
+    """
+
+    def __init__(self, robot=ALL_ROBOTS, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.robot = robot
+        self.dropped = 0
+        self.closed = False
+        self._queue = deque(maxlen=queue_size)
+        self._event = asyncio.Event()
+
+    def put(self, payload: str):
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+            dropped_counter.inc()
+        self._queue.append(payload)
+        self._event.set()
+
+    async def get(self):
+        """
+        Waits for the next event.
+
+        Returns:
+            str: Serialized event, or None once the subscriber is closed.
+        """
+        while not self._queue:
+            if self.closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        return self._queue.popleft()
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+
+class EventBus:
+    def __init__(self):
+        self.subscribers = {}  # robot id (or ALL_ROBOTS) -> set of Subscriber
+        # Called with (robot, payload) for every event a subscriber of another process wants
+        self.forward = None
+        # robot id (or ALL_ROBOTS) -> number of subscribers in other processes
+        self.remote_subscribers = {}
+        # Called with subscriber_counts() whenever a subscriber comes or goes, e.g. to report it to other processes
+        self.on_subscribers_changed = None
+
+    def subscribe(self, robot=ALL_ROBOTS, queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> Subscriber:
+        subscriber = Subscriber(robot, queue_size)
+        self.subscribers.setdefault(robot, set()).add(subscriber)
+        self._subscribers_changed()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        group = self.subscribers.get(subscriber.robot)
+        if group is not None:
+            group.discard(subscriber)
+            if not group:
+                del self.subscribers[subscriber.robot]
+        self._subscribers_changed()
+
+    def subscriber_counts(self) -> dict:
+        """
+        Number of subscribers of this process per robot id (or ALL_ROBOTS).
+        """
+        return {robot: len(group) for robot, group in self.subscribers.items()}
+
+    def _subscribers_changed(self):
+        subscribers_gauge.set(sum(len(group) for group in self.subscribers.values()))
+        if self.on_subscribers_changed is not None:
+            self.on_subscribers_changed(self.subscriber_counts())
+
+    def has_subscribers(self, robot) -> bool:
+        return robot in self.subscribers or ALL_ROBOTS in self.subscribers
+
+    def has_remote_subscribers(self, robot) -> bool:
+        return robot in self.remote_subscribers or ALL_ROBOTS in self.remote_subscribers
+
+    def publish(self, robot: str, event: dict):
+        """
+        Serializes an event once and hands it to every subscriber of the robot (never blocks).
+
+        Args:
+            robot (str): Robot id the event belongs to.
+            event (dict): JSON-serializable event.
+        """
+        local = self.has_subscribers(robot)
+        remote = self.forward is not None and self.has_remote_subscribers(robot)
+        if not local and not remote:
+            return
+        payload = json.dumps(event)
+        if local:
+            self.fan_out(robot, payload)
+        if remote:
+            self.forward(robot, payload)
+
+    def fan_out(self, robot: str, payload: str):
+        """
+        Queues an already serialized event for the robot's subscribers.
+        """
+        published_counter.inc()
+        for subscriber in self.subscribers.get(robot, ()):
+            subscriber.put(payload)
+        if robot != ALL_ROBOTS:
+            for subscriber in self.subscribers.get(ALL_ROBOTS, ()):
+                subscriber.put(payload)
+
+
+# Shared by every /ws session and /events subscriber of this process
+bus = EventBus()
@@ -0,0 +1,301 @@
+"""
+event_store.py – Persistent scenario event history
+
+Every scenario a /ws session emits (see routes/websocket.py) is appended to a
+SQLite database in WAL mode, so incidents can be looked up long after the robot
+was told about them (routes/history.py serves them over HTTP).
+
+- `record()` only puts the event on an in-memory queue and never blocks the
+  frame loop; a writer thread commits whatever is queued in one transaction,
+  at most every FLUSH_INTERVAL seconds. If the disk can't keep up the queue
+  drops new events instead of growing (counted in `event_store_dropped_total`).
+- Events are indexed by robot, session, scenario and time; emergencies (events
+  with an incident id) have their own partial index.
+- `daily_counts` is kept up to date in the same transaction, so per-day
+  aggregates read a few rows per day instead of scanning months of events.
+- Queries run in their own threads on read-only connections; WAL lets them
+  read while the writer commits, also from other web worker processes.
+
+The database file is settings.EVENT_STORE (EVENT_STORE= disables the store).
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import settings
+from utils import metrics
+
+# Events buffered for the writer before new ones are dropped
+WRITE_QUEUE_SIZE = 10000
+
+# The writer commits at most this often, or as soon as MAX_BATCH_SIZE events are queued
+FLUSH_INTERVAL = 0.5  # seconds
+MAX_BATCH_SIZE = 500
+
+# Another process holding the write lock is waited for this long
+BUSY_TIMEOUT_MS = 5000
+
+MAX_QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenario_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,          -- server time the scenario was emitted (seconds since epoch)
+    day TEXT NOT NULL,         -- local date of ts, YYYY-MM-DD
+    robot TEXT NOT NULL,
+    session TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    incident_id TEXT           -- set for emergencies only
+);
+CREATE INDEX IF NOT EXISTS scenario_events_robot_ts ON scenario_events (robot, ts);
+CREATE INDEX IF NOT EXISTS scenario_events_session_ts ON scenario_events (session, ts);
+CREATE INDEX IF NOT EXISTS scenario_events_scenario_ts ON scenario_events (scenario, ts);
+CREATE INDEX IF NOT EXISTS scenario_events_ts ON scenario_events (ts);
+CREATE INDEX IF NOT EXISTS scenario_events_incidents ON scenario_events (robot, ts) WHERE incident_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS daily_counts (
+    day TEXT NOT NULL,
+    robot TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    events INTEGER NOT NULL,
+    incidents INTEGER NOT NULL,
+    PRIMARY KEY (day, robot, scenario)
+) WITHOUT ROWID;
+"""
+
+_INSERT_EVENT = (
+    "INSERT INTO scenario_events (ts, day, robot, session, scenario, incident_id) VALUES (?, ?, ?, ?, ?, ?)"
+)
+_UPSERT_DAILY = """
+INSERT INTO daily_counts (day, robot, scenario, events, incidents) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (day, robot, scenario) DO UPDATE SET
+    events = events + excluded.events,
+    incidents = incidents + excluded.incidents
+"""
+
+written_counter = metrics.counter("event_store_written_total", "Scenario events committed to the event store")
+dropped_counter = metrics.counter("event_store_dropped_total", "Scenario events dropped because the store writer fell behind")
+flush_histogram = metrics.histogram("event_store_flush_seconds", "Duration of one event store commit")
+
+
+def day_of(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+
+class EventStore:
+    """
+    SQLite scenario event store with a batched background writer.
+
+    Nothing is opened before `start()`; until then (and after `close()`) `record`
+    ignores events.
+
+    Args:
+        path (str | Path): Database file.
+        queue_size (int): Events buffered before `record` starts dropping.
+        flush_interval (float): Maximum time (seconds) between two commits.
+    """
+
+    def __init__(self, path, queue_size: int = WRITE_QUEUE_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.events_written = 0
+        self.events_dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._local = threading.local()
+        self.query_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="event-query")
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        if read_only:
+            conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        return conn
+
+    def start(self):
+        """
+        Creates the database (if needed) and starts the writer thread.
+        """
+        if self.running:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")  # durable enough with WAL, no fsync per commit
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._thread = threading.Thread(target=self._write_loop, args=(conn,), name="event-store", daemon=True)
+        self._thread.start()
+        print(f"🗄️ Scenario events are stored in {self.path}")
+
+    def record(self, robot: str, session: str, scenario: dict, ts: float = None) -> bool:
+        """
+        Queues a scenario event for writing (never blocks).
+
+        Args:
+            robot (str): Robot id.
+            session (str): Connection the scenario was emitted on.
+            scenario (dict): Result of `ScenarioHandler.get_active_scenario()`.
+            ts (float): Event time (default: now).
+
+        Returns:
+            bool: False if the store is not running or the event was dropped.
+        """
+        if not self.running:
+            return False
+        ts = time.time() if ts is None else ts
+        try:
+            self._queue.put_nowait((ts, day_of(ts), robot, str(session), scenario["scenario"], scenario.get("incident_id")))
+            return True
+        except queue.Full:
+            self.events_dropped += 1
+            dropped_counter.inc()
+            return False
+
+    def close(self):
+        """
+        Commits pending events and stops the writer thread.
+        """
+        if not self.running:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.query_executor.shutdown(wait=True)
+
+    def _next_batch(self) -> list:
+        """
+        Waits for the first event, then collects more for up to `flush_interval` seconds.
+        """
+        batch = [self._queue.get()]
+        flush_at = time.monotonic() + self.flush_interval
+        while batch[-1] is not None and len(batch) < MAX_BATCH_SIZE:
+            timeout = flush_at - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self, conn: sqlite3.Connection):
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is None
+                events = [event for event in batch if event is not None]
+                if events:
+                    try:
+                        self._write(conn, events)
+                    except sqlite3.Error as e:
+                        print(f"❌ Could not store {len(events)} scenario event(s): {e}")
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, events: list):
+        started = time.perf_counter()
+        daily = {}
+        for _, day, robot, _, scenario, incident_id in events:
+            counts = daily.setdefault((day, robot, scenario), [0, 0])
+            counts[0] += 1
+            counts[1] += incident_id is not None
+        with conn:
+            conn.executemany(_INSERT_EVENT, events)
+            conn.executemany(_UPSERT_DAILY, [(*key, *counts) for key, counts in daily.items()])
+        self.events_written += len(events)
+        written_counter.inc(len(events))
+        flush_histogram.observe(time.perf_counter() - started)
+
+    # ---------- queries (run them in `query_executor`) ----------
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect(read_only=True)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def events(self, robot: str = None, session: str = None, scenario: str = None, since: float = None,
+               until: float = None, before_id: int = None, incidents_only: bool = False, limit: int = 100) -> list:
+        """
+        Stored events, newest first (ties on `ts` newest id first).
+
+        Pass the `ts` and `id` of the last event as `until` and `before_id` to get the
+        next (older) page – events that share the boundary `ts` are not skipped.
+
+        Args:
+            robot, session, scenario (str): Optional exact filters.
+            since (float): Only events at or after this time.
+            until (float): Only events before this time.
+            before_id (int): With `until`, also events at exactly `until` with a smaller id.
+            incidents_only (bool): Only events with an incident id (emergencies).
+            limit (int): Maximum number of events (capped at MAX_QUERY_LIMIT).
+
+        Returns:
+            list: Dicts with id, ts, robot, session, scenario and incident_id.
+        """
+        conditions, params = [], []
+        for column, value in (("robot", robot), ("session", session), ("scenario", scenario)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None and before_id is not None:
+            conditions.append("(ts < ? OR (ts = ? AND id < ?))")
+            params.extend((until, until, before_id))
+        elif until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+        if incidents_only:
+            conditions.append("incident_id IS NOT NULL")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(max(1, min(limit, MAX_QUERY_LIMIT)))
+        rows = self._reader().execute(
+            f"SELECT id, ts, robot, session, scenario, incident_id FROM scenario_events {where} "
+            f"ORDER BY ts DESC, id DESC LIMIT ?",
+            params,
+        )
+        return [dict(row) for row in rows]
+
+    def daily(self, robot: str = None, scenario: str = None, since_day: str = None, until_day: str = None) -> list:
+        """
+        Per-day event and incident counts, newest day first.
+
+        Args:
+            robot (str): Only this robot (default: summed over all robots).
+            scenario (str): Only this scenario.
+            since_day, until_day (str): Inclusive YYYY-MM-DD bounds.
+
+        Returns:
+            list: Dicts with day, scenario, events and incidents.
+        """
+        conditions, params = [], []
+        for clause, value in (("robot = ?", robot), ("scenario = ?", scenario),
+                              ("day >= ?", since_day), ("day <= ?", until_day)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._reader().execute(
+            f"SELECT day, scenario, SUM(events) AS events, SUM(incidents) AS incidents FROM daily_counts {where} "
+            f"GROUP BY day, scenario ORDER BY day DESC, events DESC",
+            params,
+        )
+        return [dict(row) for row in rows]
+
+
+# Shared by every /ws session of this process (started in main.py's lifespan)
+store = EventStore(settings.EVENT_STORE) if settings.EVENT_STORE else None
@@ -0,0 +1,71 @@
+"""
+frame_ring.py – Letterboxed frames in shared memory
+
+With multi-process serving (see serve.py) every /ws session of a web worker owns
+a FrameRing: its LetterboxPool decodes frames straight into the shared buffers,
+and the inference server reads the model input from the same memory. Only the
+slot number and the letterbox geometry travel over the socket, never the pixels.
+
+The creating process owns the segment and unlinks it in `close()`; other
+processes attach by name.
+"""
+
+import sys
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Maps an existing segment without handing it to this process's resource tracker.
+
+    Only the owner may unlink a segment. Before Python 3.13 attaching registers the
+    segment as well, so the attaching process would remove it when it exits (or,
+    sharing the owner's tracker, unregister it twice).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class FrameRing:
+    """
+    `slots` imgsz x imgsz x 3 uint8 buffers in one shared memory segment.
+
+    Args:
+        imgsz (int): Side of the square model input.
+        slots (int): Number of buffers.
+        name (str): Name of an existing segment to attach to; None creates a new one.
+    """
+
+    def __init__(self, imgsz: int, slots: int, name: str = None):
+        self.imgsz = imgsz
+        self.slots = slots
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * imgsz * imgsz * 3)
+        else:
+            self.shm = _attach(name)
+        self.buffers = np.ndarray((slots, imgsz, imgsz, 3), dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        """
+        Unmaps the buffers (and removes the segment if this process created it).
+        """
+        self.buffers = None
+        if self.owner:
+            self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # A frame still references the memory; the mapping goes away with it
+            pass
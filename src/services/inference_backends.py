@@ -0,0 +1,321 @@
+"""
+inference_backends.py – Interchangeable YOLO inference backends
+
+All backends take letterboxed BGR model inputs (see services/preprocess.py)
+and return raw detections in model-input pixels, so the rest of the pipeline
+does not care whether the detector runs on PyTorch, ONNX Runtime or OpenVINO.
+
+Backends:
+- torch     : ultralytics YOLO on the original `best.pt` (uses CUDA if available)
+- onnx      : ONNX Runtime on an exported `best.onnx` (CPU)
+- openvino  : OpenVINO on an exported `best_openvino_model/` (CPU)
+
+The server loads whatever `utils/autotune_backends.py` saved to
+settings.INFERENCE_CONFIG_PATH, falling back to PyTorch at 640.
+"""
+
+import ast
+import json
+from pathlib import Path
+import cv2
+import numpy as np
+import settings
+from services.preprocess import PAD_VALUE
+
+WEIGHTS_DIR = settings.WEIGHTS_DIR
+DEFAULT_WEIGHTS = WEIGHTS_DIR / "best.pt"
+
+# Written by the autotuner, read by the server at startup
+INFERENCE_CONFIG_PATH = settings.INFERENCE_CONFIG_PATH
+
+DEFAULT_CONFIG = {"backend": "torch", "weights": str(DEFAULT_WEIGHTS), "imgsz": 640, "threads": None}
+
+# Same post-processing defaults as ultralytics
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+
+
+class InferenceBackend:
+    """
+    Common interface of all detector backends.
+
+    Attributes:
+        name (str): Backend identifier ("torch", "onnx", "openvino").
+        imgsz (int): Side of the square model input.
+        names (dict): Class id -> class name.
+    """
+
+    name = None
+
+    def __init__(self, imgsz: int):
+        self.imgsz = imgsz
+        self.names = {}
+
+    def predict(self, images: list, conf: float = 0.3, classes: list = None) -> list:
+        """
+        Runs the detector on letterboxed model inputs.
+
+        Args:
+            images (list): Square BGR uint8 images of one size, at most imgsz
+                (smaller inputs are letterboxed into their top-left corner).
+            conf (float): Minimum confidence.
+            classes (list): Class ids to report, None = all.
+
+        Returns:
+            list: One (xyxy, confidences, class_ids) tuple of NumPy arrays per image,
+                  boxes in model-input pixels.
+        """
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """
+    ultralytics YOLO on PyTorch weights (the original `best.pt` path).
+    """
+
+    name = "torch"
+
+    def __init__(self, weights: str, imgsz: int = 640, threads: int = None):
+        super().__init__(imgsz)
+        import torch
+        from ultralytics import YOLO
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(str(weights))
+        if torch.cuda.is_available():
+            self.model.to("cuda")
+        self.names = self.model.names
+
+    def predict(self, images: list, conf: float = 0.3, classes: list = None) -> list:
+        # PyTorch YOLO runs at any multiple of the stride – use the size the frames were letterboxed to
+        results = self.model.predict(images, imgsz=images[0].shape[0], conf=conf, classes=classes, verbose=False)
+        outputs = []
+        for result in results:
+            boxes = result.boxes
+            if not boxes or boxes.cls is None:
+                outputs.append(_empty_detections())
+                continue
+            outputs.append((
+                boxes.xyxy.cpu().numpy(),
+                boxes.conf.cpu().numpy(),
+                boxes.cls.cpu().numpy().astype(int),
+            ))
+        return outputs
+
+
+class _ExportedBackend(InferenceBackend):
+    """
+    Shared pre/post-processing for exported (raw-tensor) models.
+
+    Subclasses implement `_run(batch)` returning the raw (B, 4 + num_classes, anchors) output.
+    """
+
+    dynamic_batch = True
+    dynamic_imgsz = True
+
+    def predict(self, images: list, conf: float = 0.3, classes: list = None) -> list:
+        if not self.dynamic_imgsz and images[0].shape[0] != self.imgsz:
+            # Fixed input shape: pad right/bottom, which leaves box coordinates unchanged
+            images = [_pad_to(image, self.imgsz) for image in images]
+        batch = _to_tensor(images)
+        if self.dynamic_batch:
+            raw = self._run(batch)
+        else:
+            raw = np.concatenate([self._run(batch[i:i + 1]) for i in range(len(batch))])
+        return [_postprocess(prediction, conf, classes) for prediction in raw]
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OnnxBackend(_ExportedBackend):
+    """
+    ONNX Runtime on an exported YOLO model.
+    """
+
+    name = "onnx"
+
+    def __init__(self, weights: str, imgsz: int = 640, threads: int = None):
+        super().__init__(imgsz)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(weights), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        input_shape = self.session.get_inputs()[0].shape
+        self.dynamic_batch = not isinstance(input_shape[0], int)
+        self.dynamic_imgsz = not isinstance(input_shape[2], int)
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "names" in metadata:
+            self.names = ast.literal_eval(metadata["names"])
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoBackend(_ExportedBackend):
+    """
+    OpenVINO on an exported `*_openvino_model/` directory.
+    """
+
+    name = "openvino"
+
+    def __init__(self, weights: str, imgsz: int = 640, threads: int = None):
+        super().__init__(imgsz)
+        import openvino as ov
+        import yaml
+
+        weights = Path(weights)
+        xml_path = next(weights.glob("*.xml")) if weights.is_dir() else weights
+        core = ov.Core()
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        model = core.read_model(str(xml_path))
+        input_shape = model.inputs[0].get_partial_shape()
+        self.dynamic_batch = input_shape[0].is_dynamic
+        self.dynamic_imgsz = input_shape[2].is_dynamic
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.output = self.compiled.output(0)
+
+        metadata_path = xml_path.parent / "metadata.yaml"
+        if metadata_path.exists():
+            with open(metadata_path) as f:
+                self.names = yaml.safe_load(f).get("names", {})
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        return self.compiled([batch])[self.output]
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxBackend.name: OnnxBackend,
+    OpenVinoBackend.name: OpenVinoBackend,
+}
+
+
+def _empty_detections():
+    return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=int)
+
+
+def _pad_to(image: np.ndarray, imgsz: int) -> np.ndarray:
+    padded = np.full((imgsz, imgsz, 3), PAD_VALUE, dtype=np.uint8)
+    padded[:image.shape[0], :image.shape[1]] = image
+    return padded
+
+
+def _to_tensor(images: list) -> np.ndarray:
+    """
+    Stacks BGR HWC uint8 images into an RGB NCHW float32 tensor in [0, 1].
+    """
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def _postprocess(prediction: np.ndarray, conf: float, classes: list = None):
+    """
+    Confidence filtering + class-aware NMS for one raw YOLOv8 output.
+
+    Args:
+        prediction (np.ndarray): (4 + num_classes, anchors) with cx, cy, w, h then class scores.
+        conf (float): Minimum confidence.
+        classes (list): Class ids to keep, None = all.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: xyxy boxes, confidences, class ids.
+    """
+    scores = prediction[4:]
+    if classes is not None:
+        # Same as ultralytics' classes=: only the listed classes compete for each anchor
+        classes = np.asarray(classes, dtype=int)
+        scores = scores[classes]
+    class_ids = scores.argmax(axis=0)
+    confidences = scores[class_ids, np.arange(scores.shape[1])]
+    keep = confidences > conf
+    if not keep.any():
+        return _empty_detections()
+
+    cx, cy, w, h = prediction[:4, keep]
+    confidences = confidences[keep]
+    class_ids = class_ids[keep] if classes is None else classes[class_ids[keep]]
+    xywh = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+
+    indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidences.tolist(), class_ids.tolist(), conf, NMS_IOU)
+    indices = np.asarray(indices, dtype=int).reshape(-1)[:MAX_DETECTIONS]
+
+    xywh = xywh[indices]
+    xyxy = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+    return xyxy.astype(np.float32), confidences[indices].astype(np.float32), class_ids[indices]
+
+
+def load_backend(config: dict) -> InferenceBackend:
+    """
+    Instantiates the backend described by an inference config.
+
+    Args:
+        config (dict): {"backend", "weights", "imgsz", "threads"}.
+
+    Returns:
+        InferenceBackend: Ready-to-use backend.
+    """
+    backend_cls = BACKENDS.get(config["backend"])
+    if backend_cls is None:
+        raise ValueError(f"Unknown inference backend: {config['backend']}")
+    return backend_cls(config["weights"], imgsz=int(config["imgsz"]), threads=config.get("threads"))
+
+
+def load_inference_config(path: Path = INFERENCE_CONFIG_PATH) -> dict:
+    """
+    Reads the autotuned inference config, or returns the PyTorch default if none was saved.
+    """
+    path = Path(path)
+    if not path.exists():
+        return dict(DEFAULT_CONFIG)
+    with open(path) as f:
+        saved = json.load(f)
+    return {**DEFAULT_CONFIG, **saved.get("selected", saved)}
+
+
+def save_inference_config(selected: dict, results: list = None, path: Path = INFERENCE_CONFIG_PATH):
+    """
+    Stores the selected config (plus the full benchmark table, for reference).
+    """
+    with open(path, "w") as f:
+        json.dump({"selected": selected, "results": results or []}, f, indent=2)
+
+
+def export_model(weights: str, backend: str, imgsz: int) -> str:
+    """
+    Exports PyTorch weights for the given backend (no-op for "torch").
+
+    Exports are dynamic in batch size so the batch scheduler can use them;
+    the file is named after the input size, so several sizes can coexist.
+
+    Returns:
+        str: Path of the exported model file/directory.
+    """
+    if backend == TorchBackend.name:
+        return str(weights)
+
+    from ultralytics import YOLO
+
+    weights = Path(weights)
+    suffix = {OnnxBackend.name: ".onnx", OpenVinoBackend.name: "_openvino_model"}[backend]
+    target = weights.with_name(f"{weights.stem}_{imgsz}{suffix}")
+    if target.exists():
+        return str(target)
+
+    exported = YOLO(str(weights)).export(
+        format="onnx" if backend == OnnxBackend.name else "openvino",
+        imgsz=imgsz,
+        dynamic=True,
+        simplify=backend == OnnxBackend.name,
+    )
+    Path(exported).rename(target)
+    return str(target)
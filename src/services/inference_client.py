@@ -0,0 +1,326 @@
+"""
+inference_client.py – Web worker side of multi-process serving
+
+With settings.INFERENCE_SERVERS set (serve.py does that), a web worker loads no
+model. Its /ws sessions use a RemoteInferencePipeline instead:
+
+- frames are decoded and letterboxed in this process, straight into the
+  session's shared memory FrameRing,
+- the inference server gets (ring, slot) plus the letterbox geometry and the
+  change-gate thumbnail, and replies with prediction, labels, tracks, scenario,
+  the robot's inference profile and whether to ask MoonDream,
+- a robot always goes to the same server (CRC32 of its id), whose session
+  registry keeps its tracker and scenario state – also across reconnects to
+  another web worker, for the registry's grace period.
+
+Legacy text clients have no robot id; they are keyed per connection and their
+server-side state is released when the connection closes.
+
+MoonDream requests go to the first server, which hosts the MoonDream worker.
+Dashboard events (services/event_bus.py) are relayed through the first server
+to the other web workers – only while one of them has a subscriber for the
+robot; the workers report their subscriber counts to that server.
+"""
+
+import asyncio
+import itertools
+import threading
+import zlib
+from functools import partial
+from multiprocessing.connection import Client
+import cv2
+import settings
+from services.event_bus import bus
+from services.frame_ring import FrameRing
+from services.inference_worker import FramePipeline
+from services.moondream_worker import MOONDREAM_IMAGE_SIZE
+from services.preprocess import LetterboxPool
+from services.session_registry import connection_key
+from services.yolo_service import MODEL_IMGSZ
+from utils.structured_log import get_logger, SampledLog
+
+# Seconds between connection attempts while an inference server is (re)starting
+CONNECT_RETRY_INTERVAL = 0.5
+
+# Shared letterbox buffers per session: one being decoded, one waiting, one being inferred
+PIPELINE_SLOTS = 3
+
+log = get_logger("inference_client")
+error_log = SampledLog(log, interval=5.0)
+
+
+class InferenceClient:
+    """
+    Connection of this web worker to one inference server.
+
+    Requests are sent from the event loop; a reader thread receives the replies
+    and resolves the matching futures. A lost connection fails the pending
+    requests and is re-established in the background.
+
+    Args:
+        address (Tuple[str, int]): (host, port) of the server.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.conn = None
+        self.loop = None
+        self.error = None
+        self.pending = {}              # request id -> future
+        self.moondream_callbacks = {}  # session key -> on_answer of its pending request
+        self.attached = set()          # names of the rings the server has mapped
+        self._ids = itertools.count(1)
+        self._connecting = None
+        self._closing = False
+        # Relays dashboard events (the first server): reports subscriber counts on every (re)connect
+        self.relays_events = False
+
+    @property
+    def connected(self) -> bool:
+        return self.conn is not None
+
+    async def connect(self):
+        """
+        Connects, retrying until the server is up (it only listens once its models are warm).
+        Concurrent callers share one attempt.
+        """
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.create_task(self._connect())
+        await asyncio.shield(self._connecting)
+
+    async def _connect(self):
+        self.loop = asyncio.get_running_loop()
+        while not self._closing:
+            try:
+                conn = await self.loop.run_in_executor(
+                    None, partial(Client, self.address, authkey=settings.INFERENCE_AUTHKEY)
+                )
+                break
+            except OSError as e:
+                self.error = f"{type(e).__name__}: {e}"
+                await asyncio.sleep(CONNECT_RETRY_INTERVAL)
+        else:
+            return
+        self.conn, self.error = conn, None
+        self.attached.clear()
+        threading.Thread(target=self._read, args=(conn,), name="inference-client", daemon=True).start()
+        if self.relays_events:
+            self._send_quietly(("subscribers", bus.subscriber_counts()))
+        print(f"🔗 Connected to inference server {self.address[0]}:{self.address[1]}")
+
+    def close(self):
+        self._closing = True
+        if self._connecting is not None:
+            self._connecting.cancel()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # ---------- replies (reader thread -> event loop) ----------
+
+    def _read(self, conn):
+        try:
+            while True:
+                message = conn.recv()
+                self.loop.call_soon_threadsafe(self._on_message, message)
+        except Exception as e:  # EOFError / OSError, or the connection was closed under recv()
+            if not self._closing:
+                self.loop.call_soon_threadsafe(self._on_disconnect, conn, e)
+
+    def _on_message(self, message):
+        kind = message[0]
+        if kind == "event":
+            # Published by a session of another web worker, already serialized
+            bus.fan_out(message[1], message[2])
+            return
+        if kind == "subscribers":
+            # /events subscribers of the other web workers
+            bus.remote_subscribers = message[1]
+            return
+        if kind == "moondream":
+            _, session_key, question, answer = message
+            on_answer = self.moondream_callbacks.pop(session_key, None)
+            if on_answer is not None:
+                asyncio.create_task(on_answer(question, answer))
+            return
+        future = self.pending.pop(message[1], None)
+        if future is None or future.done():
+            return
+        if kind == "result":
+            future.set_result(message[2])
+        else:
+            future.set_exception(RuntimeError(f"inference server: {message[2]}"))
+
+    def _on_disconnect(self, conn, error):
+        if conn is not self.conn:
+            return
+        self.conn = None
+        self.error = f"{type(error).__name__}: {error}"
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"inference server {self.address} disconnected"))
+        self.pending.clear()
+        self.moondream_callbacks.clear()
+        if self.relays_events:
+            bus.remote_subscribers = {}
+        if not self._closing:
+            error_log.error("server_disconnected", key=self.address, server=f"{self.address[0]}:{self.address[1]}")
+            asyncio.create_task(self.connect())
+
+    # ---------- requests ----------
+
+    def _send(self, message):
+        if self.conn is None:
+            raise ConnectionError(f"inference server {self.address} is not connected")
+        self.conn.send(message)
+
+    async def _request(self, kind: str, *args):
+        """
+        Sends (kind, request_id, *args) and waits for the server's result.
+        """
+        request_id = next(self._ids)
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        try:
+            self._send((kind, request_id, *args))
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def infer(self, robot_key: str, new_connection: bool, ring: FrameRing, frame, thumbnail):
+        """
+        Runs a frame that sits in `ring` through the server's gate, YOLO, Deep SORT and scenario handler.
+
+        Args:
+            new_connection (bool): First frame of this robot on the calling connection.
+
+        Returns:
+            Tuple: (prediction, normalized_labels, tracked_objects, scenario, profile, ask_moondream).
+        """
+        if ring.name not in self.attached:
+            self._send(("attach", ring.name, ring.slots, ring.imgsz))
+            self.attached.add(ring.name)
+        return await self._request(
+            "frame", robot_key, new_connection, ring.name, frame.slot, frame.model_input.shape[0],
+            frame.gain, frame.pad, frame.original_size, thumbnail.tobytes(),
+        )
+
+    async def session_stats(self) -> dict:
+        """
+        The server's session registry stats (see SessionRegistry.stats).
+        """
+        return await self._request("stats")
+
+    def detach(self, ring: FrameRing):
+        if ring.name in self.attached:
+            self.attached.discard(ring.name)
+            self._send_quietly(("detach", ring.name))
+
+    def release(self, robot_key: str):
+        """
+        Drops the server-side state of a robot key right away (instead of after its grace period).
+        """
+        self._send_quietly(("release", robot_key))
+
+    def submit_moondream(self, session_key: str, image, labels: set, on_answer):
+        """
+        Queues a MoonDream request on the server; a newer request of the same session replaces the pending one.
+        """
+        self.moondream_callbacks[session_key] = on_answer
+        self._send(("moondream", session_key, cv2.resize(image, MOONDREAM_IMAGE_SIZE), labels))
+
+    def drop_moondream_session(self, session_key: str):
+        if self.moondream_callbacks.pop(session_key, None) is not None:
+            self._send_quietly(("moondream_drop", session_key))
+
+    def _send_quietly(self, message):
+        try:
+            self._send(message)
+        except (ConnectionError, OSError):
+            pass  # the server forgets everything of a dropped connection anyway
+
+
+if settings.INFERENCE_SERVERS and not settings.INFERENCE_AUTHKEY:
+    raise SystemExit("❌ INFERENCE_SERVERS is set but INFERENCE_AUTHKEY is not – use the inference servers' secret")
+
+clients = [InferenceClient(address) for address in settings.INFERENCE_SERVERS]
+
+
+def client_for(robot_key: str) -> InferenceClient:
+    """
+    The server that owns a robot's state – stable across processes and restarts.
+    """
+    return clients[zlib.crc32(robot_key.encode()) % len(clients)]
+
+
+def forward_event(robot: str, payload: str):
+    clients[0]._send_quietly(("event", robot, payload))
+
+
+def report_subscribers(counts: dict):
+    clients[0]._send_quietly(("subscribers", counts))
+
+
+if clients:
+    clients[0].relays_events = True
+    bus.forward = forward_event
+    bus.on_subscribers_changed = report_subscribers
+
+
+async def session_stats() -> dict:
+    """
+    Session registry stats of all inference servers, summed (robots listed per server).
+    """
+    results = await asyncio.gather(*(client.session_stats() for client in clients), return_exceptions=True)
+    total = {"sessions": 0, "streaming": 0, "bytes": 0, "memory_budget": 0, "resumed": 0, "servers": []}
+    for client, stats in zip(clients, results):
+        server = f"{client.address[0]}:{client.address[1]}"
+        if isinstance(stats, Exception):
+            total["servers"].append({"server": server, "error": str(stats)})
+            continue
+        for key in ("sessions", "streaming", "bytes", "memory_budget", "resumed"):
+            total[key] += stats[key]
+        total["servers"].append({"server": server, **stats})
+    return total
+
+
+async def connect_all():
+    await asyncio.gather(*(client.connect() for client in clients))
+
+
+def close_all():
+    for client in clients:
+        client.close()
+
+
+class RemoteInferencePipeline(FramePipeline):
+    """
+    Decode here, infer on the inference server that owns the robot.
+
+    Args:
+        on_result (coroutine function): See FramePipeline.
+        session_id: Per-process id of the connection.
+    """
+
+    def __init__(self, on_result, session_id):
+        self.ring = FrameRing(MODEL_IMGSZ, PIPELINE_SLOTS)
+        self.connection_key = connection_key(session_id)
+        self.robot_keys = set()
+        super().__init__(on_result, LetterboxPool(MODEL_IMGSZ, PIPELINE_SLOTS, buffers=self.ring.buffers))
+
+    async def _infer(self, frame, thumbnail, header):
+        robot_key = header.robot_id if header is not None and header.robot_id else self.connection_key
+        new_connection = robot_key not in self.robot_keys
+        self.robot_keys.add(robot_key)
+        try:
+            return await client_for(robot_key).infer(robot_key, new_connection, self.ring, frame, thumbnail)
+        finally:
+            self.letterbox_pool.release(frame.slot)
+
+    async def _close_session(self):
+        for client in clients:
+            client.detach(self.ring)
+        if self.connection_key in self.robot_keys:
+            client_for(self.connection_key).release(self.connection_key)
+        self.letterbox_pool = None
+        self.ring.close()
@@ -0,0 +1,107 @@
+"""
+inference_profiles.py – Scenario-driven inference profiles
+
+Most of the time the kitchen is empty or nothing happens in it, and running the
+detector at full resolution and full frame rate buys nothing. Every session
+therefore runs in one of two profiles:
+
+- IDLE: small model input, a low frame budget and only the classes that can
+  start something (plus the emergency ones),
+- ACTIVE: full resolution, every frame the pipeline can keep up with, all classes.
+
+A ProfileController per session switches to ACTIVE as soon as a trigger label
+(`open microwave`, `pot`, `person`) is detected or tracked, and only falls back to
+IDLE after IDLE_AFTER seconds without any – a short gap in the detections never
+makes the profile flap.
+
+The active profile is sent back with every binary reply (see
+utils/frame_protocol.py), so the robot can lower its own capture rate to match.
+"""
+
+from typing import NamedTuple
+import settings
+from services.yolo_service import MODEL_IMGSZ
+from services.change_gate import EMERGENCY_LABELS
+
+
+class InferenceProfile(NamedTuple):
+    """
+    Attributes:
+        name (str): "idle" or "active".
+        imgsz (int): Side of the letterboxed model input (at most MODEL_IMGSZ, multiple of 32).
+        max_fps (float): Frames per second sent to the detector, None = as many as it keeps up with.
+        classes (frozenset): Class names the detector reports, None = all.
+    """
+    name: str
+    imgsz: int
+    max_fps: float
+    classes: frozenset
+
+    def admits(self, last_admitted: float, now: float) -> bool:
+        """
+        Whether a frame at `now` fits the frame budget, given the time the last admitted frame arrived.
+        """
+        return self.max_fps is None or last_admitted is None or now - last_admitted >= 1.0 / self.max_fps
+
+
+# Labels that switch a session to the ACTIVE profile
+TRIGGER_LABELS = frozenset({"open microwave", "pot", "person"})
+
+# Still detected while idle (the gate's EMERGENCY_LABELS): an emergency must never wait for a trigger
+IDLE = InferenceProfile("idle", imgsz=min(320, MODEL_IMGSZ), max_fps=2.0,
+                        classes=TRIGGER_LABELS | frozenset(EMERGENCY_LABELS))
+ACTIVE = InferenceProfile("active", imgsz=MODEL_IMGSZ, max_fps=None, classes=None)
+
+# Input sizes the detector is warmed up for
+PROFILE_SIZES = tuple(sorted({ACTIVE.imgsz, IDLE.imgsz} if settings.ADAPTIVE_PROFILES else {ACTIVE.imgsz}))
+
+# Seconds without a trigger label before an ACTIVE session goes back to IDLE
+IDLE_AFTER = 10.0
+
+
+class ProfileController:
+    """
+    Picks the inference profile of one session from what its frames show.
+
+    Sessions start ACTIVE, so the first seconds of a connection get a full look
+    at the scene before the controller settles.
+
+    Args:
+        idle_after (float): Seconds without a trigger label before dropping back to IDLE.
+        enabled (bool): False keeps the session ACTIVE for good.
+    """
+
+    def __init__(self, idle_after: float = IDLE_AFTER, enabled: bool = settings.ADAPTIVE_PROFILES):
+        self.idle_after = idle_after
+        self.enabled = enabled
+        self.profile = ACTIVE
+        self.last_trigger = None
+
+    def update(self, labels: set, tracked_objects: list, now: float) -> bool:
+        """
+        Registers one processed frame.
+
+        Args:
+            labels (set): Labels detected in the frame.
+            tracked_objects (list): Current tracks (a coasting track still counts as present).
+            now (float): Frame time in seconds.
+
+        Returns:
+            bool: True if the profile changed.
+        """
+        if not self.enabled:
+            return False
+        if self.last_trigger is None:
+            self.last_trigger = now
+
+        triggered = bool(labels & TRIGGER_LABELS) or any(obj["label"] in TRIGGER_LABELS for obj in tracked_objects)
+        if triggered:
+            self.last_trigger = now
+
+        if triggered and self.profile != ACTIVE:
+            self.profile = ACTIVE
+            return True
+        if not triggered and self.profile != IDLE and now - self.last_trigger >= self.idle_after:
+            self.profile = IDLE
+            return True
+        return False
@@ -0,0 +1,303 @@
+"""
+inference_server.py – Model-owning inference process for multi-process serving
+
+serve.py starts one or a few of these next to N uvicorn web workers. Each
+inference server loads YOLO + the Deep SORT embedder once and serves every web
+worker that connects to it:
+
+- frames arrive as (shared memory ring, slot) references – the web worker has
+  already decoded and letterboxed them into a FrameRing (services/frame_ring.py),
+- frames of all robots go through the same BatchScheduler as in-process serving,
+- per-robot state (tracks, scene-change gate, scenario handler, inference profile,
+  MoonDream throttle) is kept here in a session registry (services/session_registry.py),
+  keyed by robot id. Web workers route a robot by a stable hash of its id, so
+  its state survives reconnects that land on another web worker,
+- the first server also hosts the MoonDream worker, so the VLM is loaded once,
+  and relays dashboard events between the web workers.
+
+The channel to the web workers is a multiprocessing.connection socket carrying
+small tuples:
+
+    web worker -> server                                  server -> web worker
+    ("attach", ring_name, slots, imgsz)                   ("result", request_id, (prediction, labels, tracks,
+    ("frame", request_id, robot_key, new_connection,          scenario, profile, ask_moondream))
+        ring_name, slot, imgsz, gain, pad,                ("error", request_id, message)
+        original_size, thumbnail_bytes)                   ("moondream", session_key, question, answer)
+    ("stats", request_id)                                 ("result", request_id, SessionRegistry.stats())
+    ("release", robot_key)
+    ("detach", ring_name)
+    ("moondream", session_key, image, labels)
+    ("moondream_drop", session_key)
+    ("event", robot, payload)                             ("event", robot, payload)  – relayed from another worker
+    ("subscribers", {robot: count})                       ("subscribers", {robot: count})  – of all other workers
+
+Run one by hand (e.g. next to `uvicorn main:app --workers 4` with INFERENCE_SERVERS set),
+with the same secret INFERENCE_AUTHKEY in both environments:
+    INFERENCE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")
+    python -m services.inference_server --port 7301
+"""
+
+import argparse
+import asyncio
+import signal
+import threading
+import time
+import traceback
+from functools import partial
+from multiprocessing.connection import Listener
+from multiprocessing import AuthenticationError
+import numpy as np
+import settings
+from services import yolo_service, inference_profiles
+from services.change_gate import THUMBNAIL_SIZE
+from services.frame_ring import FrameRing
+from services.inference_worker import sessions
+from services.preprocess import PreparedFrame
+from utils.structured_log import configure_logging, get_logger, log_event, SampledLog
+import logging
+
+DEFAULT_PORT = 7301
+
+log = get_logger("inference_server")
+error_log = SampledLog(log, interval=5.0)
+
+
+class _Peer:
+    """
+    One connected web worker: its socket and the frame rings it attached.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rings = {}  # ring name -> FrameRing
+        self.moondream_sessions = set()
+        self.subscribers = {}  # robot id (or None for all robots) -> /events subscribers of this worker
+
+    def wants_event(self, robot) -> bool:
+        return robot in self.subscribers or None in self.subscribers
+
+    def send(self, message):
+        try:
+            self.conn.send(message)
+        except (OSError, ValueError):
+            # The web worker went away; its reader thread reports the disconnect
+            pass
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+        self.conn.close()
+
+
+class InferenceServer:
+    """
+    Args:
+        address (Tuple[str, int]): (host, port) to listen on.
+        host_moondream (bool): Also run the MoonDream worker (only one server should).
+    """
+
+    def __init__(self, address, host_moondream: bool = False):
+        self.address = address
+        self.host_moondream = host_moondream and settings.MOONDREAM_ENABLED
+        self.sessions = sessions  # robot key -> SessionState, evicted after the grace period or for memory
+        self.peers = set()
+        self.loop = None
+        self.dispatcher = None
+
+    # ---------- lifecycle ----------
+
+    async def serve(self):
+        """
+        Loads the models, then accepts web workers until SIGTERM / SIGINT.
+        """
+        self.loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(sig, stop.set)
+
+        tasks = []
+        if self.host_moondream:
+            from services.moondream_worker import dispatcher
+            self.dispatcher = dispatcher
+            tasks.append(asyncio.create_task(self._start_moondream()))
+
+        # Web workers can only connect once YOLO is warm – their readiness follows ours
+        started = time.perf_counter()
+        await self.loop.run_in_executor(
+            yolo_service.inference_executor,
+            partial(yolo_service.warmup, settings.WARMUP_ITERATIONS, sizes=inference_profiles.PROFILE_SIZES)
+        )
+        print(f"✅ YOLO warmed up in {time.perf_counter() - started:.2f}s")
+
+        listener = Listener(self.address, authkey=settings.INFERENCE_AUTHKEY)
+        threading.Thread(target=self._accept, args=(listener,), name="inference-accept", daemon=True).start()
+        print(f"🚀 Inference server listening on {self.address[0]}:{self.address[1]}")
+
+        try:
+            await stop.wait()
+        finally:
+            listener.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for peer in list(self.peers):
+                peer.close()
+            await self.sessions.close()
+            if self.dispatcher is not None:
+                await self.dispatcher.close()
+            print("🛑 Inference server stopped")
+
+    async def _start_moondream(self):
+        try:
+            await self.dispatcher.start()
+        except RuntimeError as e:
+            print(f"❌ {e} – continuing without MoonDream")
+
+    # ---------- connections (background threads) ----------
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError as e:
+                error_log.warning("auth_failed", error=str(e))
+                continue
+            except OSError:
+                return  # listener closed
+            peer = _Peer(conn)
+            self.loop.call_soon_threadsafe(self._on_connect, peer)
+            threading.Thread(target=self._read, args=(peer,), name="inference-peer", daemon=True).start()
+
+    def _read(self, peer):
+        try:
+            while True:
+                message = peer.conn.recv()
+                self.loop.call_soon_threadsafe(self._on_message, peer, message)
+        except Exception:  # EOFError / OSError, or the connection was closed under recv()
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._on_disconnect, peer)
+
+    # ---------- messages (event loop) ----------
+
+    def _on_connect(self, peer):
+        self.peers.add(peer)
+        self._send_subscribers()
+
+    def _on_message(self, peer, message):
+        kind = message[0]
+        try:
+            if kind == "frame":
+                self._on_frame(peer, *message[1:])
+            elif kind == "attach":
+                _, name, slots, imgsz = message
+                peer.rings[name] = FrameRing(imgsz, slots, name=name)
+            elif kind == "detach":
+                ring = peer.rings.pop(message[1], None)
+                if ring is not None:
+                    ring.close()
+            elif kind == "release":
+                self.sessions.release(message[1])
+            elif kind == "stats":
+                peer.send(("result", message[1], self.sessions.stats()))
+            elif kind == "moondream":
+                self._on_moondream(peer, *message[1:])
+            elif kind == "event":
+                for other in self.peers:
+                    if other is not peer and other.wants_event(message[1]):
+                        other.send(message)
+            elif kind == "subscribers":
+                peer.subscribers = message[1]
+                self._send_subscribers()
+            elif kind == "moondream_drop":
+                peer.moondream_sessions.discard(message[1])
+                if self.dispatcher is not None:
+                    self.dispatcher.drop_session(message[1])
+            else:
+                error_log.warning("unknown_message", key=kind, kind=kind)
+        except Exception as e:
+            error_log.error("message_error", key=kind, kind=kind, error=str(e), exc_info=True)
+            if kind == "frame":
+                peer.send(("error", message[1], str(e)))
+
+    def _send_subscribers(self):
+        """
+        Tells every web worker how many /events subscribers the other workers have per robot,
+        so it only relays the events somebody wants.
+        """
+        for peer in self.peers:
+            counts = {}
+            for other in self.peers:
+                if other is not peer:
+                    for robot, count in other.subscribers.items():
+                        counts[robot] = counts.get(robot, 0) + count
+            peer.send(("subscribers", counts))
+
+    def _on_frame(self, peer, request_id, robot_key, new_connection, ring_name, slot, imgsz, gain, pad, original_size,
+                  thumbnail):
+        ring = peer.rings[ring_name]
+        frame = PreparedFrame(
+            image=None, model_input=ring.buffers[slot, :imgsz, :imgsz], slot=slot,
+            gain=gain, pad=pad, original_size=original_size,
+        )
+        thumbnail = np.frombuffer(thumbnail, dtype=np.uint8).reshape(THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0])
+        state = self.sessions.get(robot_key, new_connection)
+        asyncio.create_task(self._process(peer, request_id, robot_key, state, frame, thumbnail))
+
+    async def _process(self, peer, request_id, robot_key, state, frame, thumbnail):
+        try:
+            result = await state.process(frame, thumbnail)
+        except Exception as e:
+            error_log.error("inference_error", key=robot_key, robot=robot_key, error=str(e), exc_info=True)
+            peer.send(("error", request_id, str(e)))
+            return
+        peer.send(("result", request_id, result))
+
+    def _on_moondream(self, peer, session_key, image, labels):
+        if self.dispatcher is None:
+            return
+
+        async def send_answer(question, answer):
+            peer.send(("moondream", session_key, question, answer))
+
+        peer.moondream_sessions.add(session_key)
+        self.dispatcher.submit(session_key, image, labels, send_answer)
+
+    def _on_disconnect(self, peer):
+        self.peers.discard(peer)
+        if self.dispatcher is not None:
+            for session_key in peer.moondream_sessions:
+                self.dispatcher.drop_session(session_key)
+        if peer.subscribers:
+            self._send_subscribers()
+        peer.close()
+        log_event(log, logging.INFO, "web_worker_disconnected", peers=len(self.peers))
+
+
+def run_inference_server(address, host_moondream: bool = False):
+    """
+    Process entry point (see serve.py).
+    """
+    configure_logging(settings.LOG_LEVEL)
+    try:
+        asyncio.run(InferenceServer(tuple(address), host_moondream).serve())
+    except Exception as e:
+        print(f"❌ Inference server {address[0]}:{address[1]} failed: {e}")
+        traceback.print_exc()
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a model-owning inference server for multi-process serving.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--moondream", action="store_true", help="Also host the MoonDream worker")
+    args = parser.parse_args()
+    if not settings.INFERENCE_AUTHKEY:
+        # Whoever knows the key can run code in this process – never fall back to a known one
+        raise SystemExit("❌ Set INFERENCE_AUTHKEY to a secret shared with the web workers")
+    run_inference_server((args.host, args.port), args.moondream)
+
+
+if __name__ == "__main__":
+    main()
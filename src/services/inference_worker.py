@@ -0,0 +1,378 @@
+import asyncio
+import time
+from services.yolo_service import (
+    track_objects, create_tracker, batch_scheduler, decode_executor, tracking_executor, MODEL_IMGSZ,
+    decode_histogram, inference_histogram, tracking_histogram,
+)
+from services.preprocess import prepare_frame, LetterboxPool
+from services.change_gate import SceneChangeGate, scene_thumbnail
+from services.inference_profiles import ProfileController, ACTIVE
+from services.session_registry import SessionRegistry, connection_key
+from utils.scenario_handler import ScenarioHandler
+from utils import metrics
+from utils.structured_log import get_logger, SampledLog
+
+scenario_histogram = metrics.histogram("scenario_evaluation_seconds", "Scenario handler update + evaluation per frame")
+
+profile_switches = metrics.counter("inference_profile_switches_total", "Changes of a session's inference profile")
+
+# Interval in seconds between MoonDream triggers of a robot
+MOONDREAM_INTERVAL = 3.0
+
+# Rough per-session memory besides tracks and thumbnails (handler, gate, label histories, Python objects)
+SESSION_OVERHEAD_BYTES = 64 * 1024
+
+error_log = SampledLog(get_logger("pipeline"), interval=5.0)
+
+
+def prepare_and_thumbnail(data, pool: LetterboxPool, imgsz: int):
+    """
+    Decode + letterbox a frame and compute its change-gate thumbnail (runs in the decode executor).
+    """
+    frame = prepare_frame(data, pool, imgsz)
+    if frame is None:
+        return None, None
+    return frame, scene_thumbnail(frame.image)
+
+
+class LatestFrameMailbox:
+    """
+    A one-slot mailbox with "latest frame wins" semantics.
+
+    Putting a new item while the previous one has not been consumed yet replaces it,
+    so a consumer that falls behind always picks up the newest frame instead of
+    working through a backlog of stale ones.
+
+    Args:
+        on_drop (callable): Optional callback invoked with every item that gets replaced.
+    """
+
+    def __init__(self, on_drop=None):
+        self.on_drop = on_drop
+        self._item = None
+        self._has_item = False
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        """
+        Store an item, replacing any unconsumed one.
+
+        Returns:
+            bool: True if a previous (stale) item was dropped.
+        """
+        dropped = self._has_item
+        if dropped:
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(self._item)
+        self._item = item
+        self._has_item = True
+        self._event.set()
+        return dropped
+
+    async def get(self):
+        """
+        Wait until an item is available and take it out of the mailbox.
+        """
+        while not self._has_item:
+            self._event.clear()
+            await self._event.wait()
+        item = self._item
+        self._item = None
+        self._has_item = False
+        return item
+
+
+class SessionState:
+    """
+    Everything remembered about one robot between two frames: its tracks,
+    the scene-change gate, the last detections, the scenario handler, the
+    inference profile it drives (see services/inference_profiles.py) and when
+    MoonDream was last asked about it.
+
+    States are kept per robot id in a SessionRegistry (`sessions` below, or the
+    inference server's in multi-process serving), so a robot that reconnects
+    within the grace period picks up its tracks, cooldowns and profile again.
+    utils/replay_session.py runs recordings through the same `process`.
+
+    Args:
+        tracker_kind (str): Tracker backend, a key of yolo_service.TRACKERS (default: settings.TRACKER).
+        use_gate (bool): False runs the detector on every frame.
+    """
+
+    def __init__(self, tracker_kind: str = None, use_gate: bool = True):
+        self.tracker = create_tracker(tracker_kind)
+        self.use_gate = use_gate
+        self.gate = SceneChangeGate()
+        self.scenario_handler = ScenarioHandler()
+        self.profiles = ProfileController()
+        self.last_detection = ("no_objects", set(), False)  # prediction, labels, had detections
+        self.last_moondream = 0.0
+        self.moondream_labels = set()
+        # Frames of one robot are processed strictly one after the other
+        self.lock = asyncio.Lock()
+
+    async def process(self, frame, thumbnail, release=None, now: float = None, timings: dict = None):
+        """
+        Runs one decoded frame through gate -> YOLO + tracker update (or a tracker coast) -> scenarios
+        -> inference profile.
+
+        A scene-change gate sits in front of the detector: frames that look the same
+        as the last keyframe reuse its detections and only advance the tracker's
+        Kalman prediction (see services/change_gate.py). The detector only reports
+        the classes of the session's current profile.
+
+        Args:
+            frame (PreparedFrame): Decoded and letterboxed frame.
+            thumbnail (np.ndarray): Change-gate thumbnail of the frame.
+            release (callable): Called with `frame.slot` once, as soon as the letterbox buffer is no longer
+                needed – also if processing fails or is cancelled.
+            now (float): Frame time in seconds (default: the current time; replays pass the recorded one).
+            timings (dict): If given, filled with the seconds spent per stage
+                ("gate", "detect" – only if the detector ran –, "track", "scenario").
+
+        Returns:
+            Tuple: (prediction, normalized_labels, tracked_objects, scenario, profile, ask_moondream) –
+                `profile` is the InferenceProfile the next frames should be prepared for,
+                `ask_moondream` whether this frame should go to MoonDream.
+        """
+        loop = asyncio.get_running_loop()
+        timings = {} if timings is None else timings
+        released = False
+
+        def free_slot():
+            # Hands the letterbox buffer back exactly once – early if possible, at the latest on exit
+            nonlocal released
+            if release is not None and not released:
+                released = True
+                release(frame.slot)
+
+        try:
+            async with self.lock:
+                now = time.time() if now is None else now
+                started = time.perf_counter()
+                detect = not self.use_gate or self.gate.should_detect(thumbnail, now)
+                gated = time.perf_counter()
+                timings["gate"] = gated - started
+                if detect:
+                    prediction, normalized, detections, embeds = await batch_scheduler.submit(
+                        frame, self.profiles.profile.classes, type(self.tracker)
+                    )
+                    # Detection and embedding are done with the letterboxed buffer
+                    free_slot()
+                    detected = time.perf_counter()
+                    timings["detect"] = detected - gated
+                    inference_histogram.observe(timings["detect"])
+                    self.gate.mark_keyframe(thumbnail, normalized, now)
+                    self.last_detection = (prediction, normalized, bool(detections))
+                    tracked_objects = []
+                    if detections:
+                        tracked_objects = await loop.run_in_executor(
+                            tracking_executor, track_objects, self.tracker, detections, embeds
+                        )
+                        tracking_histogram.observe(time.perf_counter() - detected)
+                else:
+                    # Static scene: coast on the tracker instead of running YOLO
+                    free_slot()
+                    self.gate.mark_skipped()
+                    prediction, normalized, had_detections = self.last_detection
+                    detected = time.perf_counter()
+                    tracked_objects = []
+                    if had_detections:
+                        tracked_objects = await loop.run_in_executor(tracking_executor, self.tracker.predict)
+                        tracking_histogram.observe(time.perf_counter() - detected)
+                tracked = time.perf_counter()
+                timings["track"] = tracked - detected
+
+                self.scenario_handler.update(normalized, now)
+                self.scenario_handler.update_tracking(tracked_objects)
+                scenario = self.scenario_handler.get_active_scenario(now)
+                timings["scenario"] = time.perf_counter() - tracked
+                scenario_histogram.observe(timings["scenario"])
+
+                if self.profiles.update(normalized, tracked_objects, now):
+                    # Labels and keyframe were detected with the old profile's classes
+                    self.gate.invalidate()
+                    profile_switches.inc()
+
+                # MoonDream at most every MOONDREAM_INTERVAL seconds, and only when the labels changed
+                ask_moondream = (
+                    now - self.last_moondream >= MOONDREAM_INTERVAL and
+                    bool(normalized) and normalized != self.moondream_labels
+                )
+                if ask_moondream:
+                    self.last_moondream = now
+                    self.moondream_labels = normalized
+        finally:
+            free_slot()
+        return prediction, normalized, tracked_objects, scenario, self.profiles.profile, ask_moondream
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory of this state (read it in the tracking thread, which updates the tracker).
+        """
+        thumbnail = self.gate.last_thumbnail
+        return (
+            SESSION_OVERHEAD_BYTES + self.tracker.nbytes + self.scenario_handler.tracks.nbytes
+            + (thumbnail.nbytes if thumbnail is not None else 0)
+        )
+
+    async def close(self):
+        """
+        Frees the tracker state (in the tracking thread, after any update still running there).
+        """
+        await asyncio.get_running_loop().run_in_executor(tracking_executor, self.tracker.close)
+
+
+# Robot states of in-process serving (see services/session_registry.py)
+sessions = SessionRegistry(SessionState, measure_executor=tracking_executor)
+
+
+class FramePipeline:
+    """
+    Per-connection two-stage pipeline: decode -> inference.
+
+    Each stage runs off the event loop and is fed through a one-slot mailbox,
+    so decoding of frame N+1 overlaps inference of frame N, and frames that
+    arrive faster than we can infer are dropped instead of queued. Subclasses
+    decide where the inference step runs (`_infer`).
+
+    Frames are decoded at the input size of the session's inference profile, and
+    frames beyond its frame budget are skipped on arrival (`throttled`).
+
+    Args:
+        on_result (coroutine function): Called with
+            (image, prediction, normalized_labels, tracked_objects, scenario, profile, ask_moondream, header)
+            for every processed frame.
+        letterbox_pool (LetterboxPool): Buffers the frames are decoded into.
+    """
+
+    def __init__(self, on_result, letterbox_pool: LetterboxPool):
+        self.on_result = on_result
+        self.letterbox_pool = letterbox_pool
+        self.profile = ACTIVE
+        self.throttled = 0
+        self._last_admitted = None
+        self.raw_frames = LatestFrameMailbox()
+        self.decoded_frames = LatestFrameMailbox(
+            on_drop=lambda item: self.letterbox_pool.release(item[0].slot)
+        )
+        self._tasks = [
+            asyncio.create_task(self._decode_stage()),
+            asyncio.create_task(self._inference_stage()),
+        ]
+
+    @property
+    def dropped(self) -> int:
+        """
+        Total number of frames dropped by either stage.
+        """
+        return self.raw_frames.dropped + self.decoded_frames.dropped
+
+    def submit(self, data, header=None) -> bool:
+        """
+        Hand a received (still encoded) frame to the pipeline.
+
+        Args:
+            data (str | np.ndarray): Base64 string or uint8 view of the JPEG bytes.
+            header (FrameHeader): Binary protocol header, None for legacy text frames.
+
+        Returns:
+            bool: True if an older pending frame was dropped.
+        """
+        now = time.monotonic()
+        if not self.profile.admits(self._last_admitted, now):
+            self.throttled += 1
+            return False
+        self._last_admitted = now
+        return self.raw_frames.put((data, header))
+
+    async def _decode_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data, header = await self.raw_frames.get()
+            started = time.perf_counter()
+            try:
+                frame, thumbnail = await loop.run_in_executor(
+                    decode_executor, prepare_and_thumbnail, data, self.letterbox_pool, self.profile.imgsz
+                )
+            except Exception as e:
+                error_log.error("decode_error", error=str(e))
+                continue
+            decode_histogram.observe(time.perf_counter() - started)
+            if frame is None:
+                error_log.error("decode_error", error="could not decode frame")
+                continue
+            self.decoded_frames.put((frame, thumbnail, header))
+
+    async def _inference_stage(self):
+        while True:
+            frame, thumbnail, header = await self.decoded_frames.get()
+            try:
+                prediction, normalized, tracked_objects, scenario, profile, ask_moondream = await self._infer(
+                    frame, thumbnail, header
+                )
+            except Exception as e:
+                error_log.error("inference_error", error=str(e), exc_info=True)
+                continue
+            self.profile = profile
+            try:
+                await self.on_result(
+                    frame.image, prediction, normalized, tracked_objects, scenario, profile, ask_moondream, header
+                )
+            except Exception as e:
+                error_log.error("result_error", error=str(e))
+
+    async def _infer(self, frame, thumbnail, header):
+        """
+        Returns:
+            Tuple: (prediction, normalized_labels, tracked_objects, scenario, profile, ask_moondream) for the frame.
+        """
+        raise NotImplementedError
+
+    async def _close_session(self):
+        pass
+
+    async def close(self):
+        """
+        Stop both stages and free the session's state.
+        Work already running in an executor finishes in the background.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._close_session()
+
+
+class InferencePipeline(FramePipeline):
+    """
+    In-process pipeline: detection goes through the shared batch scheduler, so
+    frames of all sessions are predicted together. Tracker and scenario state
+    come from the registry, keyed by robot id, and outlive the connection for
+    the registry's grace period. The letterbox buffers are the connection's own
+    and are freed in `close()`.
+
+    Legacy text clients have no robot id; their state is keyed per connection
+    and released when the connection closes.
+
+    Args:
+        on_result (coroutine function): See FramePipeline.
+        session_id: Per-process id of the connection.
+    """
+
+    def __init__(self, on_result, session_id):
+        self.connection_key = connection_key(session_id)
+        self.robot_keys = set()
+        super().__init__(on_result, LetterboxPool(MODEL_IMGSZ))
+
+    async def _infer(self, frame, thumbnail, header):
+        robot_key = header.robot_id if header is not None and header.robot_id else self.connection_key
+        state = sessions.get(robot_key, new_connection=robot_key not in self.robot_keys)
+        self.robot_keys.add(robot_key)
+        return await state.process(frame, thumbnail, self.letterbox_pool.release)
+
+    async def _close_session(self):
+        if self.connection_key in self.robot_keys:
+            sessions.release(self.connection_key)
@@ -0,0 +1,226 @@
+"""
+iou_tracker.py – Lightweight motion/IoU tracker (ByteTrack-style)
+
+Deep SORT runs an appearance CNN on every detection crop, which on CPU can cost
+more than YOLO itself. The ScenarioHandler only needs stable track ids and box
+centres, so this tracker associates boxes with constant-velocity Kalman
+predictions by IoU alone (pure NumPy), in two rounds as in ByteTrack:
+
+1. all tracks vs. confident detections (conf >= HIGH_CONFIDENCE),
+2. tracks still unmatched vs. low-confidence detections – an occluded or blurred
+   object keeps its id instead of dropping out and coming back as a new track.
+
+Select it with TRACKER=bytetrack (see settings.py and services/yolo_service.py).
+It has the same interface as tracking_service.SessionTracker.
+"""
+
+import itertools
+import numpy as np
+
+# Detections at or above this confidence are matched first and may start tracks
+HIGH_CONFIDENCE = 0.5
+# Lowest confidence the detector reports when this tracker is in use
+LOW_CONFIDENCE = 0.1
+
+FIRST_MATCH_IOU = 0.2
+SECOND_MATCH_IOU = 0.5
+
+# Consecutive matches before a track is reported, and missed frames before it is dropped
+MIN_HITS = 2
+MAX_AGE = 30  # keep equal to tracking_service.TRACKER_MAX_AGE
+
+# Kalman noise, relative to the box size (as in Deep SORT)
+POSITION_NOISE = 1 / 20
+VELOCITY_NOISE = 1 / 160
+
+_F = np.eye(8)
+_F[:4, 4:] = np.eye(4)  # constant velocity: (cx, cy, w, h) += (vx, vy, vw, vh)
+_H = np.eye(4, 8)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU of two sets of boxes.
+
+    Args:
+        a (np.ndarray): (N, 4) xyxy boxes.
+        b (np.ndarray): (M, 4) xyxy boxes.
+
+    Returns:
+        np.ndarray: (N, M) IoU values.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    left_top = np.maximum(a[:, None, :2], b[None, :, :2])
+    right_bottom = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(right_bottom - left_top, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def greedy_match(iou: np.ndarray, threshold: float):
+    """
+    Pairs rows and columns by descending IoU (each at most once).
+
+    Returns:
+        Tuple[list, list, list]: (row, col) matches, unmatched rows, unmatched cols.
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    matches = []
+    used_rows, used_cols = set(), set()
+    for k in np.argsort(-iou[rows, cols], kind="stable"):
+        row, col = int(rows[k]), int(cols[k])
+        if row not in used_rows and col not in used_cols:
+            matches.append((row, col))
+            used_rows.add(row)
+            used_cols.add(col)
+    unmatched_rows = [r for r in range(iou.shape[0]) if r not in used_rows]
+    unmatched_cols = [c for c in range(iou.shape[1]) if c not in used_cols]
+    return matches, unmatched_rows, unmatched_cols
+
+
+def _box_noise(w: float, h: float, weight: float) -> np.ndarray:
+    return weight * np.array([w, h, w, h])
+
+
+class _Track:
+    __slots__ = ("track_id", "label", "mean", "covariance", "hits", "time_since_update")
+
+    def __init__(self, track_id: str, box: np.ndarray, label: str):
+        cx, cy = (box[:2] + box[2:]) / 2
+        w, h = box[2:] - box[:2]
+        self.track_id = track_id
+        self.label = label
+        self.mean = np.array([cx, cy, w, h, 0, 0, 0, 0], dtype=float)
+        std = np.r_[_box_noise(w, h, 2 * POSITION_NOISE), _box_noise(w, h, 10 * VELOCITY_NOISE)]
+        self.covariance = np.diag(np.square(std))
+        self.hits = 1
+        self.time_since_update = 0
+
+    @property
+    def confirmed(self) -> bool:
+        return self.hits >= MIN_HITS
+
+    def xyxy(self) -> np.ndarray:
+        cx, cy, w, h = self.mean[:4]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self):
+        w, h = self.mean[2:4]
+        q = np.diag(np.square(np.r_[_box_noise(w, h, POSITION_NOISE), _box_noise(w, h, VELOCITY_NOISE)]))
+        self.mean = _F @ self.mean
+        self.covariance = _F @ self.covariance @ _F.T + q
+        self.time_since_update += 1
+
+    def update(self, box: np.ndarray, label: str = None):
+        w, h = box[2:] - box[:2]
+        measurement = np.r_[(box[:2] + box[2:]) / 2, w, h]
+        innovation_cov = _H @ self.covariance @ _H.T + np.diag(np.square(_box_noise(w, h, POSITION_NOISE)))
+        gain = self.covariance @ _H.T @ np.linalg.inv(innovation_cov)
+        self.mean = self.mean + gain @ (measurement - _H @ self.mean)
+        self.covariance = (np.eye(8) - gain @ _H) @ self.covariance
+        self.hits += 1
+        self.time_since_update = 0
+        if label is not None:
+            self.label = label
+
+
+class IouTracker:
+    """
+    Motion + IoU association state for a single robot session.
+
+    Args:
+        max_age (int): Frames a track survives without a matching detection.
+    """
+
+    # The tracker never looks at appearance, and wants the detector's low-confidence boxes too
+    uses_embeddings = False
+    min_confidence = LOW_CONFIDENCE
+
+    def __init__(self, max_age: int = MAX_AGE):
+        self.max_age = max_age
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, detections: list, embeds: list = None) -> list:
+        """
+        Feed one frame of detections into this session's tracker.
+
+        Args:
+            detections (list): Detections as ([x, y, w, h], confidence, class_name).
+            embeds (list): Ignored (no appearance model).
+
+        Returns:
+            list: Confirmed tracks as dicts with 'id', 'label' and 'bbox'.
+        """
+        for track in self.tracks:
+            track.predict()
+
+        boxes = np.array([[x, y, x + w, y + h] for (x, y, w, h), _, _ in detections], dtype=float).reshape(-1, 4)
+        confidences = np.array([conf for _, conf, _ in detections], dtype=float)
+        labels = [label for _, _, label in detections]
+        high = np.flatnonzero(confidences >= HIGH_CONFIDENCE)
+        low = np.flatnonzero((confidences >= LOW_CONFIDENCE) & (confidences < HIGH_CONFIDENCE))
+        track_boxes = np.array([track.xyxy() for track in self.tracks]).reshape(-1, 4)
+
+        # Round 1: every track against the confident detections
+        matches, unmatched, new_detections = greedy_match(iou_matrix(track_boxes, boxes[high]), FIRST_MATCH_IOU)
+        for t, d in matches:
+            self.tracks[t].update(boxes[high[d]], labels[high[d]])
+
+        # Round 2: what is left against the low-confidence ones (position only, label kept)
+        matches, still_unmatched, _ = greedy_match(iou_matrix(track_boxes[unmatched], boxes[low]), SECOND_MATCH_IOU)
+        for t, d in matches:
+            self.tracks[unmatched[t]].update(boxes[low[d]])
+
+        missed = {unmatched[t] for t in still_unmatched}
+        self.tracks = [
+            track for i, track in enumerate(self.tracks)
+            if i not in missed or (track.confirmed and track.time_since_update <= self.max_age)
+        ]
+        for d in new_detections:
+            self.tracks.append(_Track(str(next(self._ids)), boxes[high[d]], labels[high[d]]))
+        return self._confirmed_objects()
+
+    def predict(self) -> list:
+        """
+        Advance every track by one step without new detections
+        (used for static frames that skip YOLO).
+
+        Returns:
+            list: Confirmed tracks at their predicted positions.
+        """
+        for track in self.tracks:
+            track.predict()
+        self.tracks = [
+            track for track in self.tracks if track.confirmed and track.time_since_update <= self.max_age
+        ]
+        return self._confirmed_objects()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory of the tracks' Kalman state.
+        """
+        return sum(track.mean.nbytes + track.covariance.nbytes for track in self.tracks)
+
+    def _confirmed_objects(self) -> list:
+        tracked_objects = []
+        for track in self.tracks:
+            if not track.confirmed:
+                continue
+            l, t, r, b = track.xyxy()
+            tracked_objects.append({
+                "id": track.track_id,
+                "label": track.label,
+                "bbox": [int(l), int(t), int(r), int(b)]
+            })
+        return tracked_objects
+
+    def close(self):
+        """
+        Drop all tracks held by this session.
+        """
+        self.tracks.clear()
@@ -1,18 +1,28 @@
-import asyncio
-from utils.moon_model import describe_image_with_moondream, get_moondream_question
+from services.moondream_worker import dispatcher
 from fastapi import WebSocket
+import logging
 import numpy as np
+import settings
+from utils.structured_log import get_logger, log_event
 
-# Global flag to prevent concurrent MoonDream requests
-is_moondream_busy = False
+if settings.INFERENCE_SERVERS:
+    # Multi-process serving: MoonDream runs on the first inference server
+    from services.inference_client import clients, connection_key
 
-async def send_moondream_result(websocket: WebSocket, image: np.ndarray, labels: set):
+log = get_logger("moondream")
+
+async def send_moondream_result(websocket: WebSocket, session_id, image: np.ndarray, labels: set):
     """
-    Asynchronously sends an image and detected labels to MoonDream for analysis.
-    Prevents concurrent processing via a global lock.
+    Queues an image and detected labels for MoonDream analysis.
+
+    The request goes to the shared MoonDream worker process (hosted by the first
+    inference server with multi-process serving). Each session keeps at
+    most one pending request (a newer frame replaces an older one), sessions are
+    served round-robin, and the answer is sent back once it is ready.
 
     Args:
         websocket (WebSocket): WebSocket connection to send result back to client.
+        session_id: Key of the robot session (one per connection).
         image (np.ndarray): Image frame (decoded from base64).
         labels (set): Set of normalized labels detected in the image.
 
@@ -22,29 +32,31 @@ async def send_moondream_result(websocket: WebSocket, image: np.ndarray, labels:
             - question: auto-generated question about the image
             - answer: visual description from MoonDream model
     """
-    global is_moondream_busy
-
-    if is_moondream_busy:
-        print("⏳ Skipping MoonDream – still processing previous request")
-        return
-
-    try:
-        is_moondream_busy = True
-
-        # Run MoonDream analysis in a thread-safe way
-        loop = asyncio.get_event_loop()
-        description = await loop.run_in_executor(None, describe_image_with_moondream, image, labels)
-        question = get_moondream_question(labels)
-
-        print(f"🧠 MoonDream analysis: {description}")
+    async def send_answer(question, description):
+        log_event(log, logging.INFO, "moondream_answer", session=session_id, question=question, answer=description)
         await websocket.send_json({
             "source": "moondream",
             "question": question,
             "answer": description
         })
 
+    if not settings.MOONDREAM_ENABLED:
+        return
+
+    try:
+        if settings.INFERENCE_SERVERS:
+            clients[0].submit_moondream(connection_key(session_id), image, labels, send_answer)
+        else:
+            dispatcher.submit(session_id, image, labels, send_answer)
     except Exception as e:
         print(f"❌ Error in send_moondream_result: {e}")
 
-    finally:
-        is_moondream_busy = False
+
+def close_moondream_session(session_id):
+    """
+    Drops pending MoonDream requests of a disconnected session.
+    """
+    if settings.INFERENCE_SERVERS:
+        clients[0].drop_moondream_session(connection_key(session_id))
+    else:
+        dispatcher.drop_session(session_id)
@@ -0,0 +1,341 @@
+"""
+moondream_worker.py – MoonDream hosted in its own process
+
+The VLM runs in a dedicated worker process that loads the model once, so it
+never competes with YOLO for the GIL. The server side (MoonDreamDispatcher)
+keeps one small queue per robot session:
+
+- a new request replaces the oldest pending one of the same session
+  (requests are coalesced to the newest frame),
+- sessions are served round-robin, so one busy robot cannot starve the others,
+- every request has a hard timeout; a stuck worker is killed and restarted.
+
+Answers are cached by (perceptual hash of the MoonDream image, question), so a
+repeated question about an unchanged scene never reaches the worker. The worker
+itself caches image encodings by the same hash, so different questions about
+one frame encode it only once.
+"""
+
+import asyncio
+import itertools
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+import cv2
+import numpy as np
+from utils import metrics
+from utils.scenario_rules import question_for_labels
+from utils.vlm_cache import SceneCache, image_signature
+
+# MoonDream input size (width, height)
+MOONDREAM_IMAGE_SIZE = (320, 240)
+
+# Pending requests kept per session (older ones are dropped)
+SESSION_QUEUE_DEPTH = 1
+
+# Hard limit for one MoonDream answer, in seconds
+REQUEST_TIMEOUT = 30.0
+
+# Hard limit for loading + warming up the model in a new worker, in seconds
+LOAD_TIMEOUT = 300.0
+
+# Worker states, reported on /readyz
+LOADING, READY, FAILED, STOPPED = "loading", "ready", "failed", "stopped"
+
+# Answer cache size and lifetime
+ANSWER_CACHE_SIZE = 256
+ANSWER_CACHE_TTL = 30.0
+
+queue_depth_gauge = metrics.gauge("moondream_queue_depth", "Pending MoonDream requests over all sessions")
+wait_time_histogram = metrics.histogram("moondream_wait_seconds", "Time a request waits before reaching the worker")
+inference_histogram = metrics.histogram("moondream_inference_seconds", "MoonDream answer time inside the worker")
+coalesced_counter = metrics.counter("moondream_requests_coalesced_total", "Requests replaced by a newer frame")
+timeout_counter = metrics.counter("moondream_requests_timed_out_total", "Requests that hit REQUEST_TIMEOUT")
+cache_gauges = {
+    (cache, stat): metrics.gauge(f"moondream_{cache}_cache_{stat}", f"MoonDream {cache} cache {stat}")
+    for cache in ("answer", "encoding")
+    for stat in ("entries", "hits", "misses", "evictions")
+}
+
+
+def prepare_image(image_np: np.ndarray) -> np.ndarray:
+    """
+    Shrinks a BGR frame to MoonDream's RGB input before it crosses the process boundary.
+    """
+    return cv2.cvtColor(cv2.resize(image_np, MOONDREAM_IMAGE_SIZE), cv2.COLOR_BGR2RGB)
+
+
+def _worker_main(requests, responses):
+    """
+    Worker process loop: load MoonDream once, then answer requests until a None arrives.
+    """
+    # The model lives only in this process
+    try:
+        from utils.moon_model import answer_question, encoding_cache, warmup_moondream, MOONDREAM_FAILED
+        warmup_moondream()
+    except Exception as e:
+        responses.put((FAILED, f"{type(e).__name__}: {e}", None, False, None))
+        return
+
+    responses.put((READY, None, None, False, None))
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, image_rgb, question, signature = request
+        started = time.perf_counter()
+        answer = answer_question(image_rgb, question, signature)
+        responses.put((
+            request_id, answer, time.perf_counter() - started, answer != MOONDREAM_FAILED, encoding_cache.stats()
+        ))
+
+
+def _publish_cache_stats(cache_name: str, stats: dict):
+    for stat, value in stats.items():
+        cache_gauges[cache_name, stat].set(value)
+
+
+class _Request:
+    __slots__ = ("session_id", "image", "signature", "question", "on_answer", "enqueued_at")
+
+    def __init__(self, session_id, image, signature, question, on_answer):
+        self.session_id = session_id
+        self.image = image
+        self.signature = signature
+        self.question = question
+        self.on_answer = on_answer
+        self.enqueued_at = time.perf_counter()
+
+    @property
+    def cache_key(self):
+        return self.signature, self.question
+
+
+class MoonDreamDispatcher:
+    """
+    Fair, coalescing front-end of the MoonDream worker process.
+
+    Args:
+        queue_depth (int): Pending requests kept per session.
+        timeout (float): Hard timeout per request, in seconds.
+    """
+
+    def __init__(self, queue_depth: int = SESSION_QUEUE_DEPTH, timeout: float = REQUEST_TIMEOUT):
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.pending = {}        # session_id -> deque of _Request
+        self.rotation = deque()  # session ids in round-robin order
+        self._wakeup = None
+        self._task = None
+        self._process = None
+        self._requests = None
+        self._responses = None
+        self._ids = itertools.count()
+        self._starting = None
+        self.status = STOPPED
+        self.error = None
+        self.answer_cache = SceneCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+        self._ctx = mp.get_context("spawn")
+
+    # ---------- worker process ----------
+
+    def _start_worker(self):
+        self._requests = self._ctx.Queue()
+        self._responses = self._ctx.Queue()
+        self._process = self._ctx.Process(
+            target=_worker_main, args=(self._requests, self._responses), name="moondream-worker", daemon=True
+        )
+        self._process.start()
+        print("🧠 MoonDream worker started")
+
+    def _stop_worker(self):
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join(timeout=5)
+        self._process = None
+
+    async def _wait_ready(self, loop):
+        try:
+            status, error, *_ = await loop.run_in_executor(None, self._responses.get, True, LOAD_TIMEOUT)
+        except queue.Empty:
+            status, error = FAILED, f"not ready after {LOAD_TIMEOUT:.0f}s"
+        if status != READY:
+            self._stop_worker()
+            self.status, self.error = FAILED, error
+            raise RuntimeError(f"MoonDream worker failed to start: {error}")
+        self.status, self.error = READY, None
+
+    async def start(self):
+        """
+        Starts the worker process and waits until MoonDream is loaded and warmed up.
+        Concurrent callers share one start-up; raises if the model can't be loaded.
+        """
+        if self._process is not None and self.status == READY:
+            return
+        if self._starting is None or self._starting.done():
+            self._starting = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._starting)
+
+    async def _start(self):
+        self.status = LOADING
+        self._start_worker()
+        await self._wait_ready(asyncio.get_running_loop())
+        print("🧠 MoonDream ready")
+
+    async def close(self):
+        """
+        Stops the scheduler and the worker process.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._stop_worker()
+        self.status = STOPPED
+
+    # ---------- public API ----------
+
+    def submit(self, session_id, image_np: np.ndarray, labels: set, on_answer):
+        """
+        Queue a MoonDream request for a session (never blocks).
+
+        If the same question was answered recently for the same scene, the cached
+        answer is delivered right away and the worker is not involved.
+
+        Args:
+            session_id: Key of the robot session.
+            image_np (np.ndarray): BGR frame.
+            labels (set): Detected labels, used to pick the question.
+            on_answer (coroutine function): Called with (question, answer) once answered.
+        """
+        if self.status == FAILED:
+            return
+        image = prepare_image(image_np)
+        request = _Request(session_id, image, image_signature(image), question_for_labels(labels), on_answer)
+
+        answer = self.answer_cache.get(request.cache_key)
+        _publish_cache_stats("answer", self.answer_cache.stats())
+        if answer is not None:
+            asyncio.create_task(self._deliver(request, answer))
+            return
+
+        self._ensure_started()
+        session_queue = self.pending.get(session_id)
+        if session_queue is None:
+            session_queue = self.pending[session_id] = deque()
+            self.rotation.append(session_id)
+        if len(session_queue) >= self.queue_depth:
+            session_queue.popleft()
+            coalesced_counter.inc()
+        session_queue.append(request)
+        self._update_depth()
+        self._wakeup.set()
+
+    def drop_session(self, session_id):
+        """
+        Forget all pending requests of a disconnected session.
+        """
+        self.pending.pop(session_id, None)
+        if session_id in self.rotation:
+            self.rotation.remove(session_id)
+        self._update_depth()
+
+    def stats(self) -> dict:
+        return {
+            "status": self.status,
+            "sessions": len(self.pending),
+            "queue_depth": queue_depth_gauge.value,
+            "coalesced": coalesced_counter.value,
+            "timed_out": timeout_counter.value,
+            "answer_cache": self.answer_cache.stats(),
+            "wait_seconds": wait_time_histogram.snapshot(),
+        }
+
+    # ---------- scheduling ----------
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _update_depth(self):
+        queue_depth_gauge.set(sum(len(q) for q in self.pending.values()))
+
+    def _next_request(self):
+        """
+        Round-robin over sessions, skipping those with nothing pending.
+        """
+        for _ in range(len(self.rotation)):
+            session_id = self.rotation[0]
+            self.rotation.rotate(-1)
+            session_queue = self.pending.get(session_id)
+            if session_queue:
+                return session_queue.popleft()
+        return None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await self.start()
+            while True:
+                request = self._next_request()
+                if request is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                self._update_depth()
+                wait_time_histogram.observe(time.perf_counter() - request.enqueued_at)
+
+                # Another session may have asked the same question about the same scene meanwhile
+                answer = self.answer_cache.get(request.cache_key, count_miss=False)
+                if answer is None:
+                    request_id = next(self._ids)
+                    self._requests.put((request_id, request.image, request.question, request.signature))
+                    answer = await self._await_answer(loop, request_id, request.cache_key)
+                _publish_cache_stats("answer", self.answer_cache.stats())
+                if answer is not None:
+                    await self._deliver(request, answer)
+
+        except RuntimeError as e:
+            # The model could not be (re)loaded – requests are ignored from now on
+            print(f"❌ {e}")
+            self.pending.clear()
+            self.rotation.clear()
+            self._update_depth()
+
+    @staticmethod
+    async def _deliver(request, answer):
+        try:
+            await request.on_answer(request.question, answer)
+        except Exception as e:
+            print(f"❌ Error delivering MoonDream answer: {e}")
+
+    async def _await_answer(self, loop, request_id, cache_key):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise queue.Empty
+                response_id, answer, duration, succeeded, encoding_stats = await loop.run_in_executor(
+                    None, self._responses.get, True, remaining
+                )
+            except queue.Empty:
+                timeout_counter.inc()
+                print(f"⏱ MoonDream request timed out after {self.timeout:.0f}s – restarting worker")
+                self._stop_worker()
+                await self.start()
+                return None
+            if encoding_stats is not None:
+                _publish_cache_stats("encoding", encoding_stats)
+            if response_id == request_id:
+                inference_histogram.observe(duration)
+                if succeeded:
+                    self.answer_cache.put(cache_key, answer)
+                return answer
+
+
+# Shared by every /ws session
+dispatcher = MoonDreamDispatcher()
@@ -0,0 +1,250 @@
+import base64
+import cv2
+import numpy as np
+
+# Input resolution of the YOLO model (square, letterboxed)
+MODEL_IMGSZ = 640
+
+# Grey used by YOLO for letterbox padding
+PAD_VALUE = 114
+
+# JPEG Start-Of-Frame markers (baseline, progressive, lossless, ...) – not DHT/JPG/DAC
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Markers that are not followed by a length field
+_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+# Reduction factor -> OpenCV flag that makes libjpeg decode directly at that scale
+_REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def jpeg_size(buf: np.ndarray):
+    """
+    Reads the image size from the JPEG header without decoding the image.
+
+    Args:
+        buf (np.ndarray): uint8 view of the JPEG bytes.
+
+    Returns:
+        Tuple[int, int]: (width, height), or None if the buffer is not a parsable JPEG.
+    """
+    n = len(buf)
+    if n < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 3 < n:
+        if buf[i] != 0xFF:
+            return None
+        marker = int(buf[i + 1])
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            height = (int(buf[i + 5]) << 8) | int(buf[i + 6])
+            width = (int(buf[i + 7]) << 8) | int(buf[i + 8])
+            return width, height
+        if marker == 0xDA:  # start of scan – no SOF before the image data
+            return None
+        i += 2 + ((int(buf[i + 2]) << 8) | int(buf[i + 3]))
+    return None
+
+
+def choose_reduction(width: int, height: int, imgsz: int = MODEL_IMGSZ) -> int:
+    """
+    Picks the largest JPEG decode reduction (1, 2, 4 or 8) that still leaves the
+    longest side at least `imgsz` pixels, so YOLO never has to upscale.
+    """
+    longest = max(width, height)
+    for factor in (8, 4, 2):
+        if longest >= imgsz * factor:
+            return factor
+    return 1
+
+
+def decode_image(buf: np.ndarray, imgsz: int = MODEL_IMGSZ):
+    """
+    Decodes an encoded frame, letting libjpeg downscale large JPEGs during decode.
+
+    Args:
+        buf (np.ndarray): uint8 view of the encoded image bytes.
+        imgsz (int): Model input size the frame will be letterboxed to.
+
+    Returns:
+        Tuple[np.ndarray, Tuple[int, int]]: (BGR image, (width, height) of the encoded frame).
+            The image is None if decoding failed.
+    """
+    size = jpeg_size(buf)
+    reduction = choose_reduction(*size, imgsz) if size else 1
+    flag = _REDUCED_DECODE_FLAGS.get(reduction, cv2.IMREAD_COLOR)
+    image = cv2.imdecode(buf, flag)
+    if image is not None and size is None:
+        size = (image.shape[1], image.shape[0])
+    return image, size
+
+
+class PreparedFrame:
+    """
+    A decoded frame plus its letterboxed model input.
+
+    Attributes:
+        image (np.ndarray): Decoded BGR image (possibly reduced in scale).
+        model_input (np.ndarray): imgsz x imgsz letterboxed view into a pooled buffer.
+        slot (int): Pool slot holding `model_input` (None if not pooled).
+        gain (float): Scale from original frame coordinates to letterbox coordinates.
+        pad (Tuple[float, float]): (x, y) letterbox padding in pixels.
+        original_size (Tuple[int, int]): (width, height) of the frame as sent by the robot.
+    """
+
+    __slots__ = ("image", "model_input", "slot", "gain", "pad", "original_size")
+
+    def __init__(self, image, model_input, slot, gain, pad, original_size):
+        self.image = image
+        self.model_input = model_input
+        self.slot = slot
+        self.gain = gain
+        self.pad = pad
+        self.original_size = original_size
+
+    def to_original(self, xyxy: np.ndarray) -> np.ndarray:
+        """
+        Maps boxes from letterbox coordinates back to original frame coordinates.
+
+        Args:
+            xyxy (np.ndarray): (N, 4) boxes in model-input pixels.
+
+        Returns:
+            np.ndarray: (N, 4) boxes in pixels of the frame sent by the robot.
+        """
+        boxes = (xyxy - (self.pad[0], self.pad[1], self.pad[0], self.pad[1])) / self.gain
+        width, height = self.original_size
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        return boxes
+
+
+class LetterboxPool:
+    """
+    A small pool of preallocated letterbox buffers owned by one session.
+
+    Frames are resized straight into a pooled buffer, so steady-state preprocessing
+    allocates nothing. A session has at most one frame being decoded, one waiting
+    and one being inferred, hence three slots by default.
+
+    Args:
+        imgsz (int): Side of the square model input.
+        slots (int): Number of buffers.
+        buffers (np.ndarray): Optional (slots, imgsz, imgsz, 3) uint8 array to use as
+            storage, e.g. a view into shared memory (see services/frame_ring.py).
+    """
+
+    def __init__(self, imgsz: int = MODEL_IMGSZ, slots: int = 3, buffers: np.ndarray = None):
+        self.imgsz = imgsz
+        if buffers is None:
+            buffers = np.empty((slots, imgsz, imgsz, 3), dtype=np.uint8)
+        buffers[...] = PAD_VALUE
+        self.buffers = buffers
+        self._free = list(range(slots))
+        self._geometry = [None] * slots  # (imgsz, top, left, h, w) last written into each slot
+
+    def acquire(self) -> int:
+        """
+        Takes a free buffer slot out of the pool.
+
+        Raises:
+            RuntimeError: If every slot is in use.
+        """
+        if not self._free:
+            raise RuntimeError("letterbox pool exhausted")
+        return self._free.pop()
+
+    def release(self, slot: int):
+        """
+        Returns a slot to the pool once its frame is no longer needed.
+        """
+        if slot is not None and slot not in self._free:
+            self._free.append(slot)
+
+    def letterbox(self, image: np.ndarray, slot: int, imgsz: int = None):
+        """
+        Resizes `image` into the buffer of `slot`, keeping its aspect ratio.
+
+        Args:
+            image (np.ndarray): Decoded BGR image.
+            slot (int): Acquired buffer slot.
+            imgsz (int): Model input size for this frame, at most the pool's imgsz
+                (a smaller input is the top-left corner of the buffer).
+
+        Returns:
+            Tuple[np.ndarray, float, Tuple[int, int]]: (model input view, scale, (pad_x, pad_y)).
+        """
+        imgsz = imgsz or self.imgsz
+        height, width = image.shape[:2]
+        scale = min(imgsz / height, imgsz / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        left, top = (imgsz - new_w) // 2, (imgsz - new_h) // 2
+
+        buffer = self.buffers[slot, :imgsz, :imgsz]
+        geometry = (imgsz, top, left, new_h, new_w)
+        if self._geometry[slot] != geometry:
+            # Only repaint the padding when the frame geometry changes
+            buffer.fill(PAD_VALUE)
+            self._geometry[slot] = geometry
+
+        target = buffer[top:top + new_h, left:left + new_w]
+        if (new_w, new_h) == (width, height):
+            target[...] = image
+        else:
+            cv2.resize(image, (new_w, new_h), dst=target, interpolation=cv2.INTER_LINEAR)
+        return buffer, scale, (left, top)
+
+
+def prepare_frame(data, pool: LetterboxPool = None, imgsz: int = None) -> PreparedFrame:
+    """
+    Decodes a received frame and letterboxes it into a (pooled) model input buffer.
+
+    Args:
+        data (str | np.ndarray): Base64-encoded image (legacy text protocol) or a
+            uint8 view of the raw image bytes (binary protocol).
+        pool (LetterboxPool): Session buffer pool; a one-off buffer is used if None.
+        imgsz (int): Model input size (default: the pool's), e.g. smaller for an idle session.
+
+    Returns:
+        PreparedFrame: Decoded frame, or None if the data is not a valid image.
+    """
+    if isinstance(data, str):
+        data = np.frombuffer(base64.b64decode(data), dtype=np.uint8)
+
+    if pool is None:
+        pool = LetterboxPool(slots=1)
+
+    imgsz = imgsz or pool.imgsz
+    image, original_size = decode_image(data, imgsz)
+    if image is None:
+        return None
+
+    slot = pool.acquire()
+    try:
+        model_input, scale, pad = pool.letterbox(image, slot, imgsz)
+    except Exception:
+        pool.release(slot)
+        raise
+
+    # `scale` maps the (reduced) decoded image; fold the decode reduction in as well
+    return PreparedFrame(
+        image=image,
+        model_input=model_input,
+        slot=slot,
+        gain=scale * image.shape[1] / original_size[0],
+        pad=pad,
+        original_size=original_size,
+    )
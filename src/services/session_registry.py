@@ -0,0 +1,217 @@
+"""
+session_registry.py – Per-robot session state that survives reconnects
+
+Robots on flaky Wi-Fi reconnect often. Instead of starting every connection
+with an empty tracker and scenario history (duplicate announcements, a warm-up
+period without usable tracks), the state of a robot (services/inference_worker.py
+SessionState: tracker, scenario handler with its cooldowns, scene-change gate,
+inference profile and MoonDream throttle) is kept here, keyed by robot id, and
+picked up again by the robot's next connection.
+
+A session is dropped
+- once its robot has sent no frame for `grace_period` seconds, or
+- earlier, least recently used first, while all sessions together are above
+  `memory_budget` bytes – sessions that are streaming right now are never evicted.
+
+Sizes are estimates (track and embedding arrays plus a fixed overhead per
+session), re-measured on every sweep in the tracking thread, where the trackers
+are updated. Live counts and sizes are on /metrics and GET /sessions.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+import settings
+from utils import metrics
+from utils.structured_log import get_logger, log_event
+import logging
+
+# Seconds between two eviction sweeps
+EVICTION_INTERVAL = 10.0
+
+# A robot that sent a frame this recently is streaming and never evicted for memory
+STREAMING_WINDOW = 5.0
+
+sessions_gauge = metrics.gauge("robot_sessions", "Robot sessions held (connected or within their grace period)")
+session_bytes_gauge = metrics.gauge("robot_session_bytes", "Estimated memory of all robot sessions")
+sessions_created = metrics.counter("robot_sessions_created_total", "Robot sessions created (not resumed)")
+sessions_evicted = metrics.counter_family("robot_sessions_evicted_total", "Robot sessions dropped", ("reason",))
+
+log = get_logger("sessions")
+
+
+def connection_key(session_id) -> str:
+    """
+    Key of a connection that is unique over all web worker processes
+    (robots without a robot id are keyed per connection).
+    """
+    return f"conn-{os.getpid()}-{session_id}"
+
+
+class SessionRegistry:
+    """
+    LRU map of robot key -> session state.
+
+    Args:
+        factory (callable): Creates the state of a new session. The state needs an
+            `nbytes` estimate, a `lock` (held while a frame is processed) and `async close()`.
+        grace_period (float): Seconds without frames before a session is dropped.
+        memory_budget (int): Bytes all sessions together may use.
+        measure_executor (Executor): Thread the sizes are measured in (the one the trackers run in).
+    """
+
+    def __init__(self, factory, grace_period: float = settings.SESSION_GRACE_PERIOD,
+                 memory_budget: int = settings.SESSION_MEMORY_BUDGET, measure_executor=None):
+        self.factory = factory
+        self.grace_period = grace_period
+        self.memory_budget = memory_budget
+        self.measure_executor = measure_executor
+        self.sessions = OrderedDict()  # robot key -> state, least recently used first
+        self.last_seen = {}            # robot key -> time.monotonic() of its last frame
+        self.sizes = {}                # robot key -> estimated bytes at the last sweep
+        self.resumed = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    def get(self, robot_key: str, new_connection: bool = False):
+        """
+        State of a robot for its next frame, created if the robot has none (any more).
+
+        Args:
+            robot_key (str): Robot id (or a per-connection key for clients without one).
+            new_connection (bool): First frame of a connection – counts as a resume if state exists.
+
+        Returns:
+            SessionState: The robot's state, now the most recently used.
+        """
+        self._ensure_started()
+        state = self.sessions.get(robot_key)
+        if state is None:
+            state = self.sessions[robot_key] = self.factory()
+            self.sizes[robot_key] = state.nbytes
+            sessions_created.inc()
+            log_event(log, logging.INFO, "session_created", robot=robot_key, sessions=len(self.sessions))
+            self._evict_over_budget(time.monotonic(), keep=robot_key)
+        else:
+            self.sessions.move_to_end(robot_key)
+            if new_connection:
+                self.resumed += 1
+                log_event(log, logging.INFO, "session_resumed", robot=robot_key,
+                          idle=round(time.monotonic() - self.last_seen[robot_key], 1))
+        self.last_seen[robot_key] = time.monotonic()
+        self._update_gauges()
+        return state
+
+    def release(self, robot_key: str):
+        """
+        Drops a session right away (e.g. a per-connection key whose connection closed).
+        """
+        self._drop(robot_key, "released")
+
+    def _drop(self, robot_key: str, reason: str):
+        state = self.sessions.pop(robot_key, None)
+        self.last_seen.pop(robot_key, None)
+        self.sizes.pop(robot_key, None)
+        if state is None:
+            return
+        sessions_evicted.labels(reason).inc()
+        asyncio.create_task(state.close())
+        self._update_gauges()
+
+    def _evictable(self, robot_key: str) -> bool:
+        return not self.sessions[robot_key].lock.locked()
+
+    def _evict_over_budget(self, now: float, keep: str = None):
+        """
+        Drops least recently used sessions that aren't streaming until the total fits the budget.
+        """
+        if self.total_bytes <= self.memory_budget:
+            return
+        for robot_key in list(self.sessions):
+            if self.total_bytes <= self.memory_budget:
+                break
+            if robot_key == keep or now - self.last_seen[robot_key] < STREAMING_WINDOW or not self._evictable(robot_key):
+                continue
+            log_event(log, logging.INFO, "session_evicted", robot=robot_key, reason="memory",
+                      bytes=self.sizes[robot_key], total=self.total_bytes, budget=self.memory_budget)
+            self._drop(robot_key, "memory")
+
+    def evict(self, now: float = None):
+        """
+        One sweep: drops sessions past their grace period, then evicts for memory.
+        """
+        now = time.monotonic() if now is None else now
+        for robot_key in list(self.sessions):
+            if now - self.last_seen[robot_key] > self.grace_period and self._evictable(robot_key):
+                log_event(log, logging.INFO, "session_evicted", robot=robot_key, reason="idle",
+                          idle=round(now - self.last_seen[robot_key], 1))
+                self._drop(robot_key, "idle")
+        self._evict_over_budget(now)
+
+    def _measure(self) -> dict:
+        sizes = {}
+        for robot_key, state in list(self.sessions.items()):
+            try:
+                sizes[robot_key] = state.nbytes
+            except RuntimeError:  # changed while measuring – keep the last estimate
+                pass
+        return sizes
+
+    async def _sweep_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            try:
+                sizes = await loop.run_in_executor(self.measure_executor, self._measure)
+                self.sizes.update((key, size) for key, size in sizes.items() if key in self.sessions)
+                self.evict()
+            except Exception as e:
+                log_event(log, logging.ERROR, "session_sweep_error", error=str(e))
+
+    def _update_gauges(self):
+        sessions_gauge.set(len(self.sessions))
+        session_bytes_gauge.set(self.total_bytes)
+
+    def stats(self) -> dict:
+        """
+        Live session counts and sizes (served on GET /sessions).
+        """
+        now = time.monotonic()
+        return {
+            "sessions": len(self.sessions),
+            "streaming": sum(now - seen < STREAMING_WINDOW for seen in self.last_seen.values()),
+            "bytes": self.total_bytes,
+            "memory_budget": self.memory_budget,
+            "grace_period": self.grace_period,
+            "resumed": self.resumed,
+            "robots": [
+                {"robot": key, "idle": round(now - self.last_seen[key], 1), "bytes": self.sizes.get(key, 0)}
+                for key in reversed(self.sessions)
+            ],
+        }
+
+    async def close(self):
+        """
+        Stops the sweeps and frees every session.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        states = list(self.sessions.values())
+        self.sessions.clear()
+        self.last_seen.clear()
+        self.sizes.clear()
+        self._update_gauges()
+        await asyncio.gather(*(state.close() for state in states), return_exceptions=True)
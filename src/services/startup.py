@@ -0,0 +1,104 @@
+"""
+startup.py – Model loading, warmup and readiness of the server
+
+Nothing here runs at import time. main.py's lifespan calls `load_models()`, which
+loads and warms up YOLO (+ the Deep SORT embedder) in the inference thread while
+the MoonDream worker process loads its model, so both happen concurrently.
+/readyz reports ready once YOLO is warm and MoonDream is either warm, disabled
+or failed (MoonDream is optional – the safety pipeline runs without it).
+
+With multi-process serving (settings.INFERENCE_SERVERS) a web worker loads no
+model: it is ready once it is connected to every inference server, which only
+accept connections after their own warmup.
+"""
+
+import asyncio
+import time
+import traceback
+from functools import partial
+import settings
+from services import yolo_service, inference_profiles
+from services.moondream_worker import dispatcher, LOADING, READY, FAILED
+from services import inference_client
+from services.inference_worker import sessions
+
+DISABLED = "disabled"
+REMOTE = "remote"
+
+yolo_status = {"status": LOADING, "error": None, "seconds": None}
+
+
+async def _load_yolo():
+    started = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            yolo_service.inference_executor,
+            partial(yolo_service.warmup, settings.WARMUP_ITERATIONS, sizes=inference_profiles.PROFILE_SIZES)
+        )
+    except Exception as e:
+        yolo_status.update(status=FAILED, error=f"{type(e).__name__}: {e}")
+        print(f"❌ YOLO failed to load: {e}")
+        traceback.print_exc()
+        return
+    yolo_status.update(status=READY, error=None, seconds=round(time.perf_counter() - started, 2))
+    print(f"✅ YOLO warmed up in {yolo_status['seconds']}s")
+
+
+async def _load_moondream():
+    try:
+        await dispatcher.start()
+    except RuntimeError as e:
+        print(f"❌ {e} – continuing without MoonDream")
+
+
+async def _connect_inference_servers():
+    started = time.perf_counter()
+    await inference_client.connect_all()
+    yolo_status.update(status=READY, error=None, seconds=round(time.perf_counter() - started, 2))
+    print(f"✅ Connected to {len(inference_client.clients)} inference server(s) in {yolo_status['seconds']}s")
+
+
+async def load_models():
+    """
+    Loads and warms up all models concurrently.
+    """
+    if settings.INFERENCE_SERVERS:
+        await _connect_inference_servers()
+        return
+    tasks = [_load_yolo()]
+    if settings.MOONDREAM_ENABLED:
+        tasks.append(_load_moondream())
+    await asyncio.gather(*tasks)
+
+
+async def unload_models():
+    inference_client.close_all()
+    await sessions.close()
+    await dispatcher.close()
+
+
+def _remote_status() -> dict:
+    clients = inference_client.clients
+    if all(client.connected for client in clients):
+        return {"status": READY, "error": None, "seconds": yolo_status["seconds"]}
+    errors = [f"{client.address[0]}:{client.address[1]}: {client.error}" for client in clients if not client.connected]
+    return {"status": LOADING, "error": "; ".join(errors), "seconds": None}
+
+
+def moondream_status() -> dict:
+    if not settings.MOONDREAM_ENABLED:
+        return {"status": DISABLED, "error": None}
+    if settings.INFERENCE_SERVERS:
+        return {"status": REMOTE, "error": None}
+    return {"status": dispatcher.status, "error": dispatcher.error}
+
+
+def readiness() -> tuple:
+    """
+    Returns:
+        Tuple[bool, dict]: Whether the server accepts robots, and the status of every model.
+    """
+    yolo = _remote_status() if settings.INFERENCE_SERVERS else dict(yolo_status)
+    models = {"yolo": yolo, "moondream": moondream_status()}
+    ready = models["yolo"]["status"] == READY and models["moondream"]["status"] != LOADING
+    return ready, models
@@ -0,0 +1,169 @@
+import threading
+import numpy as np
+import torch
+from deep_sort_realtime.deepsort_tracker import DeepSort
+from deep_sort_realtime.embedder.embedder_pytorch import MobileNetv2_Embedder
+
+# Deep SORT settings used for every session
+TRACKER_MAX_AGE = 30
+EMBEDDER_MAX_BATCH_SIZE = 64
+
+# ✅ The re-ID network is heavy – it is loaded once and shared by all sessions
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_shared_embedder() -> MobileNetv2_Embedder:
+    """
+    Returns the process-wide appearance embedder, loading it on first use.
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = MobileNetv2_Embedder(
+                half=True,
+                max_batch_size=EMBEDDER_MAX_BATCH_SIZE,
+                bgr=True,
+                gpu=torch.cuda.is_available(),
+            )
+        return _embedder
+
+
+def warmup_embedder(frame: np.ndarray, crops: int = 4):
+    """
+    Loads the embedder and runs it once on a few crops of `frame`.
+    """
+    height, width = frame.shape[:2]
+    box = np.array([[0, 0, min(width, 64), min(height, 128)]], dtype=np.float32)
+    get_shared_embedder().predict(crop_boxes(frame, np.repeat(box, crops, axis=0)))
+
+
+def crop_boxes(frame: np.ndarray, boxes: np.ndarray) -> list:
+    """
+    Cuts the image patch of every box out of the frame.
+
+    Args:
+        frame (np.ndarray): BGR image the boxes refer to.
+        boxes (np.ndarray): (N, 4) boxes as x1, y1, x2, y2 in `frame` pixels.
+
+    Returns:
+        list: One BGR crop per box (views into `frame`, never empty).
+    """
+    height, width = frame.shape[:2]
+    crops = []
+    for x1, y1, x2, y2 in boxes:
+        left = min(max(int(x1), 0), width - 1)
+        top = min(max(int(y1), 0), height - 1)
+        right = max(min(int(x2), width), left + 1)
+        bottom = max(min(int(y2), height), top + 1)
+        crops.append(frame[top:bottom, left:right])
+    return crops
+
+
+def embed_frames(frames: list, boxes_per_frame: list) -> list:
+    """
+    Computes appearance embeddings for the detections of several frames
+    (possibly from different robots) with a single embedder call.
+
+    Args:
+        frames (list): BGR images to crop from.
+        boxes_per_frame (list): (N, 4) xyxy boxes of each frame, in that frame's pixels.
+
+    Returns:
+        list: One list of embeddings per frame, matching its boxes.
+    """
+    crops = []
+    counts = []
+    for frame, boxes in zip(frames, boxes_per_frame):
+        frame_crops = crop_boxes(frame, boxes) if len(boxes) else []
+        crops.extend(frame_crops)
+        counts.append(len(frame_crops))
+
+    embeddings = get_shared_embedder().predict(crops) if crops else []
+
+    per_frame = []
+    start = 0
+    for count in counts:
+        per_frame.append(list(embeddings[start:start + count]))
+        start += count
+    return per_frame
+
+
+class SessionTracker:
+    """
+    Deep SORT state (Kalman filters + track association) for a single robot session.
+
+    The tracker is created without its own embedder – appearance features are
+    computed by the shared embedder and passed in with the detections, so each
+    session only owns the lightweight association state.
+
+    Args:
+        max_age (int): Frames a track survives without a matching detection.
+    """
+
+    # Appearance features come from the shared embedder (see yolo_service.detect_batch)
+    uses_embeddings = True
+    min_confidence = None
+
+    def __init__(self, max_age: int = TRACKER_MAX_AGE):
+        self.deepsort = DeepSort(max_age=max_age, embedder=None)
+
+    def update(self, detections: list, embeds: list) -> list:
+        """
+        Feed one frame of detections into this session's tracker.
+
+        Args:
+            detections (list): Detections as ([x, y, w, h], confidence, class_name).
+            embeds (list): Appearance embeddings, one per detection.
+
+        Returns:
+            list: Confirmed tracks as dicts with 'id', 'label' and 'bbox'.
+        """
+        tracks = self.deepsort.update_tracks(detections, embeds=embeds)
+        return self._confirmed_objects(tracks)
+
+    def predict(self) -> list:
+        """
+        Advance every track's Kalman filter by one step without new detections
+        (used for static frames that skip YOLO).
+
+        Returns:
+            list: Confirmed tracks at their predicted positions.
+        """
+        self.deepsort.tracker.predict()
+        return self._confirmed_objects(self.deepsort.tracker.tracks)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory of the Kalman state and the appearance features kept for association.
+        """
+        tracker = self.deepsort.tracker
+        total = sum(feature.nbytes for samples in tracker.metric.samples.values() for feature in samples)
+        for track in tracker.tracks:
+            total += track.mean.nbytes + track.covariance.nbytes
+            total += sum(feature.nbytes for feature in track.features)
+        return total
+
+    @staticmethod
+    def _confirmed_objects(tracks) -> list:
+        tracked_objects = []
+        for track in tracks:
+            if not track.is_confirmed():
+                continue
+            track_id = track.track_id
+            l, t, w, h = track.to_ltrb()
+            label = track.get_det_class() if track.get_det_class() else "object"
+            tracked_objects.append({
+                "id": track_id,
+                "label": label,
+                "bbox": [int(l), int(t), int(w), int(h)]
+            })
+
+        return tracked_objects
+
+    def close(self):
+        """
+        Drop all tracks held by this session.
+        """
+        self.deepsort.delete_all_tracks()
@@ -1,95 +1,321 @@
-from ultralytics import YOLO
-import base64, io, traceback
+import asyncio
 import numpy as np
-from PIL import Image
-import torch
 from utils.helpers import normalize_class_names, classify_scenario
-from deep_sort_realtime.deepsort_tracker import DeepSort
-import cv2
-import os
-from datetime import datetime
+from services.tracking_service import SessionTracker, embed_frames, warmup_embedder
+from services.iou_tracker import IouTracker
+from services.preprocess import PreparedFrame, LetterboxPool, PAD_VALUE
+from services.inference_backends import load_backend, load_inference_config
 from pathlib import Path
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import settings
+from utils import metrics
+from utils.structured_log import get_logger, SampledLog
 
 # ✅ Load YOLO model with relative path
 base_dir = Path(__file__).resolve().parent
 model_path = base_dir / "../model_train/yolo_custom_training/yolov8s_run/weights/best.pt"
 model_path = str(model_path.resolve())
-yolo_model = YOLO(model_path)
-if torch.cuda.is_available():
-    yolo_model.to("cuda")
 
-# ✅ Initialize Deep SORT
-tracker = DeepSort(max_age=30)
+# ✅ The detector runs on the backend picked by the autotuner (PyTorch best.pt by default).
+# Only the config is read at import; the model itself is loaded by `get_backend()` –
+# at server startup (main.py lifespan) or on first use in offline tools.
+inference_config = load_inference_config(settings.INFERENCE_CONFIG)
+if settings.YOLO_WEIGHTS:
+    inference_config["weights"] = settings.YOLO_WEIGHTS
+MODEL_IMGSZ = int(inference_config["imgsz"])
 
-# def save_image(image_np, prefix="frame"):
-#     os.makedirs("saved_frames", exist_ok=True)
-#     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-#     path = f"saved_frames/{prefix}_{timestamp}.jpg"
-#     cv2.imwrite(path, image_np)
-#     print(f"🖼 Frame saved: {path}")
+# Detections below this confidence don't count for labels, predictions and scenarios
+DETECTION_CONFIDENCE = 0.3
 
-async def process_frame_and_predict(base64_string: str):
+# ✅ Tracker backends – every session gets one from `create_tracker()`. A tracker has
+#   update(detections, embeds) -> tracks, predict() -> tracks, close() and an `nbytes` estimate, plus
+#   `uses_embeddings` (does detect_batch need to run the appearance embedder) and
+#   `min_confidence` (lowest detection confidence it wants, None = DETECTION_CONFIDENCE).
+TRACKERS = {
+    "deepsort": SessionTracker,  # appearance + motion, runs the re-ID CNN on every detection
+    "bytetrack": IouTracker,     # motion + IoU only, also uses low-confidence detections
+}
+if settings.TRACKER not in TRACKERS:
+    raise ValueError(f"Unknown TRACKER {settings.TRACKER!r}, expected one of {', '.join(TRACKERS)}")
+tracker_cls = TRACKERS[settings.TRACKER]
+
+backend = None
+_backend_lock = threading.Lock()
+
+# Decoding/letterboxing is mostly GIL-free OpenCV work, so a couple of threads can run side by side
+decode_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="decode")
+
+# YOLO is not thread-safe – every (batched) predict goes through a single thread
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+# Tracker updates (Kalman + association, pure Python) run on their own thread;
+# each session has exactly one frame in flight, so its tracker is never updated concurrently
+tracking_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracking")
+
+# ✅ Micro-batching: wait at most this long for more frames before running predict
+BATCH_DEADLINE = 0.010  # seconds
+MAX_BATCH_SIZE = 8
+
+batch_size_histogram = metrics.histogram(
+    "yolo_batch_size", "Number of frames per batched YOLO predict",
+    buckets=tuple(range(1, MAX_BATCH_SIZE + 1)),
+)
+queue_delay_histogram = metrics.histogram(
+    "yolo_batch_queue_delay_seconds", "Time a frame waits before its batch starts"
+)
+batch_predict_histogram = metrics.histogram(
+    "yolo_batch_predict_seconds", "Duration of one batched YOLO predict"
+)
+
+# ✅ Per-frame stage latencies (served on /metrics)
+decode_histogram = metrics.histogram("frame_decode_seconds", "Decode + letterbox time per frame")
+inference_histogram = metrics.histogram(
+    "frame_inference_seconds", "Time from handing a frame to the batch scheduler to its detections"
+)
+tracking_histogram = metrics.histogram("frame_tracking_seconds", "Deep SORT update (or coast) time per frame")
+
+log = get_logger("yolo")
+error_log = SampledLog(log, interval=5.0)
+
+def get_backend():
+    """
+    Returns the detector backend, loading it on first use.
+    """
+    global backend
+    if backend is None:
+        with _backend_lock:
+            if backend is None:
+                loaded = load_backend(inference_config)
+                print(f"✅ YOLO backend: {loaded.name} @ {MODEL_IMGSZ}px, threads={inference_config.get('threads')}")
+                backend = loaded
+    return backend
+
+
+def create_tracker(kind: str = None):
+    """
+    New per-session tracker of the configured (or the given) kind.
+    """
+    return (TRACKERS[kind] if kind else tracker_cls)()
+
+
+def warmup(iterations: int = settings.WARMUP_ITERATIONS, embedder: bool = None, sizes: tuple = (MODEL_IMGSZ,)):
+    """
+    Loads the detector (and the appearance embedder, if the tracker uses it) and runs
+    a few inferences at every input size sessions will use, so the first robot frame
+    doesn't pay for lazy initialisation. Blocking – run it in the inference executor.
+
+    Args:
+        iterations (int): Predicts per batch size and input size.
+        embedder (bool): Also load the embedder (default: if the configured tracker uses it).
+        sizes (tuple): Model input sizes to warm up (see services/inference_profiles.py).
+    """
+    model = get_backend()
+    pool = LetterboxPool(MODEL_IMGSZ, slots=1)
+    for imgsz in sizes:
+        model_input, _, _ = pool.letterbox(np.full((480, 640, 3), PAD_VALUE, dtype=np.uint8), 0, imgsz)
+        for batch_size in (1, MAX_BATCH_SIZE):
+            for _ in range(iterations):
+                model.predict([model_input] * batch_size, conf=DETECTION_CONFIDENCE)
+    if tracker_cls.uses_embeddings if embedder is None else embedder:
+        warmup_embedder(model_input)
+
+
+_class_ids = {}  # frozenset of class names -> class ids
+
+
+def class_ids(class_names: frozenset) -> list:
     """
-    Decodes a base64-encoded image, performs YOLOv8 object detection and Deep SORT tracking,
-    then classifies the scenario based on detected objects.
+    Detector class ids of the given class names (names the model doesn't know are ignored).
 
     Args:
-        base64_string (str): Base64-encoded image sent from the TEMI robot.
+        class_names (frozenset): Class names, or None for all classes.
+
+    Returns:
+        list: Sorted class ids, or None for all classes.
+    """
+    if class_names is None:
+        return None
+    ids = _class_ids.get(class_names)
+    if ids is None:
+        ids = _class_ids[class_names] = sorted(i for i, name in get_backend().names.items() if name in class_names)
+    return ids
+
+
+def _parse_result(raw_detections, frame: PreparedFrame):
+    """
+    Converts the raw backend output of one frame into labels and tracker detections.
+
+    Args:
+        raw_detections (tuple): (xyxy, confidences, class_ids) in model-input pixels.
+        frame (PreparedFrame): Frame the detections belong to.
 
     Returns:
         Tuple:
-            - img_np (np.ndarray): Decoded OpenCV image.
-            - prediction (str): Classified scenario name (e.g., "pouring_food").
+            - prediction (str): Classified scenario name.
             - normalized (set): Set of normalized class labels detected.
-            - tracked_objects (list): List of tracked objects with IDs, labels, and bounding boxes.
-    """
-    try:
-        # ✅ Decode and prepare image
-        image_data = base64.b64decode(base64_string)
-        image_array = np.frombuffer(image_data, dtype=np.uint8)
-        img_np = cv2.imdecode(image_array, cv2.IMREAD_COLOR)  # זה יחזיר BGR עם צבעים נכונים
-
-        # ✅ Run YOLO
-        results = yolo_model.predict(img_np, conf=0.3)
-        boxes = results[0].boxes
-        names = results[0].names
-
-        # ✅ Save image for debugging
-        # save_image(img_np, prefix="yolo")
-
-        if not boxes or boxes.cls is None:
-            return img_np, "no_objects", set(), []
-
-        detected_classes = boxes.cls.cpu().numpy().astype(int)
-        class_names = [names[i] for i in detected_classes]
-        normalized = normalize_class_names(class_names)
-        prediction = classify_scenario(normalized)
-
-        # ✅ Convert YOLO boxes to format: [x1, y1, x2, y2, confidence, class_id]
-        detections = []
-        for box, cls, conf in zip(boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy()):
-            x1, y1, x2, y2 = box
-            detections.append(([x1, y1, x2 - x1, y2 - y1], conf, names[int(cls)]))
-
-        # ✅ Track with Deep SORT
-        tracked_objects = []
-        tracks = tracker.update_tracks(detections, frame=img_np)
-
-        for track in tracks:
-            if not track.is_confirmed():
-                continue
-            track_id = track.track_id
-            l, t, w, h = track.to_ltrb()
-            label = track.get_det_class() if track.get_det_class() else "object"
-            tracked_objects.append({
-                "id": track_id,
-                "label": label,
-                "bbox": [int(l), int(t), int(w), int(h)]
-            })
-
-        return img_np, prediction, normalized, tracked_objects
-
-    except Exception as e:
-        print(f"❌ YOLO/DeepSORT error: {e}")
-        traceback.print_exc()
-        return None, None, set(), []
+            - detections (list): Tracker input as ([x, y, w, h], confidence, class_name),
+              in pixels of the frame sent by the robot (may include boxes below
+              DETECTION_CONFIDENCE if the tracker asked for them).
+            - model_boxes (np.ndarray): (N, 4) xyxy boxes in model-input pixels.
+    """
+    model_boxes, confidences, detected_classes = raw_detections
+    names = get_backend().names
+
+    if len(detected_classes) == 0:
+        return "no_objects", set(), [], model_boxes
+
+    class_names = [names[i] for i in detected_classes]
+    normalized = normalize_class_names(
+        [name for name, conf in zip(class_names, confidences) if conf >= DETECTION_CONFIDENCE]
+    )
+    prediction = classify_scenario(normalized) if normalized else "no_objects"
+
+    # ✅ Map letterboxed boxes back to the robot's frame and convert to ([x, y, w, h], confidence, class_name)
+    detections = []
+    for box, class_name, conf in zip(frame.to_original(model_boxes), class_names, confidences):
+        x1, y1, x2, y2 = box
+        detections.append(([x1, y1, x2 - x1, y2 - y1], conf, class_name))
+
+    return prediction, normalized, detections, model_boxes
+
+
+def detect_batch(frames: list, tracker=None, classes: frozenset = None) -> list:
+    """
+    Runs a single batched YOLOv8 predict over several prepared frames, followed by
+    one batched appearance-embedder pass over all detected objects (only if the
+    tracker uses appearance).
+
+    Args:
+        frames (list): PreparedFrame objects of one input size (may come from different robots).
+        tracker (type): Tracker class the detections are for (default: the configured one).
+        classes (frozenset): Class names to detect, None = all.
+
+    Returns:
+        list: One (prediction, normalized, detections, embeds) tuple per frame, in input order.
+    """
+    tracker = tracker or tracker_cls
+    conf = min(DETECTION_CONFIDENCE, tracker.min_confidence or DETECTION_CONFIDENCE)
+    raw = get_backend().predict([frame.model_input for frame in frames], conf=conf, classes=class_ids(classes))
+    parsed = [_parse_result(raw_detections, frame) for raw_detections, frame in zip(raw, frames)]
+
+    if not tracker.uses_embeddings:
+        return [(prediction, normalized, detections, []) for prediction, normalized, detections, _ in parsed]
+
+    # Crops are cut from the letterboxed inputs – the embedder resizes them to 64x128 anyway
+    embeds = embed_frames(
+        [frame.model_input for frame in frames],
+        [model_boxes for _, _, _, model_boxes in parsed],
+    )
+    return [
+        (prediction, normalized, detections, frame_embeds)
+        for (prediction, normalized, detections, _), frame_embeds in zip(parsed, embeds)
+    ]
+
+
+def track_objects(session_tracker: SessionTracker, detections: list, embeds: list) -> list:
+    """
+    Updates a session's Deep SORT state with the detections of one frame.
+
+    Args:
+        session_tracker (SessionTracker): Tracker state of the robot the frame came from.
+        detections (list): Detections as returned by `detect_batch`.
+        embeds (list): Appearance embeddings as returned by `detect_batch`.
+
+    Returns:
+        list: Confirmed tracks as dicts with 'id', 'label' and 'bbox'.
+    """
+    return session_tracker.update(detections, embeds)
+
+
+class BatchScheduler:
+    """
+    Collects frames from all active `/ws` sessions and runs them through YOLO
+    as one batched predict.
+
+    A batch is flushed as soon as it holds `max_batch_size` frames or the oldest
+    frame has waited `deadline` seconds, whichever comes first. Frames of sessions
+    in different inference profiles (input size, class subset) or with different
+    tracker backends are predicted in one call per group.
+
+    Args:
+        deadline (float): Maximum time (seconds) a frame waits for the batch to fill.
+        max_batch_size (int): Maximum number of frames per predict call.
+    """
+
+    def __init__(self, deadline: float = BATCH_DEADLINE, max_batch_size: int = MAX_BATCH_SIZE):
+        self.deadline = deadline
+        self.max_batch_size = max_batch_size
+        self._queue = None
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, frame: PreparedFrame, classes: frozenset = None, tracker=None):
+        """
+        Queue a prepared frame for the next batch and wait for its detections.
+
+        Args:
+            frame (PreparedFrame): Letterboxed frame.
+            classes (frozenset): Class names to detect, None = all.
+            tracker (type): Tracker class the detections are for (default: the configured one).
+
+        Returns:
+            Tuple: (prediction, normalized, detections, embeds) for this frame.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((frame, classes, tracker or tracker_cls, time.perf_counter(), future))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        flush_at = batch[0][3] + self.deadline
+        while len(batch) < self.max_batch_size:
+            timeout = flush_at - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            batch_size_histogram.observe(len(batch))
+            for _, _, _, enqueued_at, _ in batch:
+                queue_delay_histogram.observe(started - enqueued_at)
+
+            groups = {}  # (input size, classes, tracker) -> queued frames
+            for item in batch:
+                frame, classes, tracker, _, _ = item
+                groups.setdefault((frame.model_input.shape[0], classes, tracker), []).append(item)
+
+            for (_, classes, tracker), group in groups.items():
+                try:
+                    results = await loop.run_in_executor(
+                        inference_executor, detect_batch, [frame for frame, _, _, _, _ in group], tracker, classes
+                    )
+                except Exception as e:
+                    error_log.error("batch_error", error=str(e), batch_size=len(group), exc_info=True)
+                    for _, _, _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, _, _, _, future), result in zip(group, results):
+                    if not future.done():
+                        future.set_result(result)
+            batch_predict_histogram.observe(time.perf_counter() - started)
+
+
+# Shared by every /ws session
+batch_scheduler = BatchScheduler()
@@ -0,0 +1,62 @@
+"""
+settings.py – Server settings
+
+Paths and switches that differ between machines. Every value can be overridden
+with the environment variable of the same name, e.g.
+
+    MOONDREAM_MODEL=/models/moondream-0_5b-int8.mf uvicorn main:app
+
+Importing this module never loads a model.
+"""
+
+import os
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# Trained detector weights, and where the autotuner (utils/autotune_backends.py) writes its config
+WEIGHTS_DIR = SRC_DIR / "model_train" / "yolo_custom_training" / "yolov8s_run" / "weights"
+INFERENCE_CONFIG_PATH = WEIGHTS_DIR / "inference_config.json"
+
+# Detector: the autotuned inference config, and optionally other weights than the ones it names
+INFERENCE_CONFIG = Path(os.environ.get("INFERENCE_CONFIG", INFERENCE_CONFIG_PATH))
+YOLO_WEIGHTS = os.environ.get("YOLO_WEIGHTS")
+
+# Per-session tracker: "deepsort" (appearance + motion) or "bytetrack" (motion + IoU, no re-ID CNN)
+TRACKER = os.environ.get("TRACKER", "deepsort").lower()
+
+# Scenario-driven inference profiles (services/inference_profiles.py): quiet scenes get
+# a cheaper detector setup until a trigger object shows up. 0 keeps every session at full rate.
+ADAPTIVE_PROFILES = os.environ.get("ADAPTIVE_PROFILES", "1") != "0"
+
+# MoonDream model file (too large for git – see README) and whether to load it at all
+MOONDREAM_MODEL = Path(os.environ.get("MOONDREAM_MODEL", SRC_DIR / "moondream-0_5b-int8.mf"))
+MOONDREAM_ENABLED = os.environ.get("MOONDREAM_ENABLED", "1") != "0"
+
+# Robot sessions (services/session_registry.py): tracker and scenario state of a robot is kept
+# this many seconds after its last frame, so a reconnect resumes it; idle sessions are evicted
+# earlier, least recently used first, while all sessions together need more than the budget.
+SESSION_GRACE_PERIOD = float(os.environ.get("SESSION_GRACE_PERIOD", "60"))
+SESSION_MEMORY_BUDGET = int(float(os.environ.get("SESSION_MEMORY_BUDGET_MB", "256")) * 2**20)
+
+# Warmup inferences run at startup, before /readyz reports ready
+WARMUP_ITERATIONS = int(os.environ.get("WARMUP_ITERATIONS", "3"))
+
+# If set, every /ws session's raw frames are recorded there (replay with utils/replay_session.py)
+RECORDINGS_DIR = os.environ.get("RECORDINGS_DIR")
+
+# SQLite file the scenario events are stored in (services/event_store.py); empty disables the store
+EVENT_STORE = os.environ.get("EVENT_STORE", str(SRC_DIR / "scenario_events.db"))
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Multi-process serving (see serve.py): "host:port" of the model-owning inference
+# servers, comma separated. Empty (the default) runs the models inside this process.
+INFERENCE_SERVERS = [
+    (host, int(port))
+    for host, port in (address.rsplit(":", 1) for address in os.environ.get("INFERENCE_SERVERS", "").split(",") if address)
+]
+# Shared secret of the web workers <-> inference server connections. These connections
+# unpickle what they receive, so there is no default: serve.py generates a random key,
+# servers started by hand refuse to run without one (empty = not set).
+INFERENCE_AUTHKEY = os.environ.get("INFERENCE_AUTHKEY", "").encode()
@@ -1,73 +1,334 @@
+"""
+analyze_saved_frames.py – Offline YOLO + Deep SORT + scenario analysis of saved frames
 
-from utils.scenario_handler import ScenarioHandler
-from services.yolo_service import yolo_model, normalize_class_names, classify_scenario, tracker
+Reads the `.frames` archives written by /save_frames (utils/frame_saver.py) and
+recordings (see utils/frame_archive.py), as well as plain .jpg/.png files. Archive
+frames are named `<archive>_<index>.jpg` in the results and keep their recorded
+receive timestamps.
+
+Pipeline:
+- a process pool reads, decodes and letterboxes the images (in a bounded window),
+- the detector runs in batches of `--batch` frames,
+- tracking and the scenario handler see the frames strictly in capture order,
+- a background thread draws and writes the annotated images and appends one row per
+  frame to `results.csv` (optionally converted to Parquet at the end).
+
+Files already listed in `results.csv` are skipped, so an interrupted run can simply
+be restarted. Tracker and scenario state start fresh on every run.
+
+Usage (from src/):
+    python -m utils.analyze_saved_frames --input saved_frames --output annotated_output
+    python -m utils.analyze_saved_frames --input saved_frames --workers 8 --batch 16 --parquet
+"""
+
+import argparse
+import csv
+import json
 import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import NamedTuple
 import cv2
 import numpy as np
-from datetime import datetime
+
+from services.preprocess import LetterboxPool, PreparedFrame
+from utils.frame_archive import FrameArchive
+from utils.scenario_handler import ScenarioHandler
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+RESULTS_FILE = "results.csv"
+RESULT_COLUMNS = ("filename", "timestamp", "labels", "prediction", "scenario", "incident_id", "detections", "tracks")
+
+# frame_20250101_120000_123456.jpg (written by utils/frame_saver.py)
+FRAME_NAME_PATTERN = re.compile(r"(\d{8}_\d{6}_\d{6})")
+
+# Annotated images waiting for the writer thread
+WRITE_QUEUE_SIZE = 64
+
+
+class SavedFrame(NamedTuple):
+    """
+    Attributes:
+        name (str): File name in the results table (and of the annotated image).
+        timestamp (float): Capture time in seconds.
+        source (str | tuple): Image path, or (archive path, frame index).
+    """
+    name: str
+    timestamp: float
+    source: object
+
+
+def frame_time(path: Path) -> float:
+    """
+    Capture time of a saved image file, from its file name if possible, else its mtime.
+    """
+    match = FRAME_NAME_PATTERN.search(path.name)
+    if match:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S_%f").timestamp()
+    return path.stat().st_mtime
+
+
+def list_frames(input_dir: Path) -> list:
+    """
+    Every frame of a folder – image files and the frames of its `.frames` archives – in capture order.
+    """
+    frames = []
+    for path in sorted(input_dir.iterdir()):
+        suffix = path.suffix.lower()
+        if suffix in IMAGE_SUFFIXES:
+            frames.append(SavedFrame(path.name, frame_time(path), str(path)))
+        elif suffix == ".frames":
+            with FrameArchive(path) as archive:
+                frames.extend(
+                    SavedFrame(f"{path.stem}_{i:06d}.jpg", float(ts), (str(path), i))
+                    for i, ts in enumerate(archive.timestamps)
+                )
+    frames.sort(key=lambda frame: frame.timestamp)
+    return frames
+
+
+# Archives opened by this decode worker (archive path -> FrameArchive)
+_archives = {}
+
+
+def _read_image(source):
+    if isinstance(source, str):
+        return cv2.imread(source)
+    path, index = source
+    archive = _archives.get(path)
+    if archive is None:
+        archive = _archives[path] = FrameArchive(path)
+    return cv2.imdecode(np.frombuffer(archive.read(index), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _load_frame(source, imgsz: int):
+    """
+    Reads and letterboxes one image (runs in a worker process).
+
+    Args:
+        source (str | tuple): Image path, or (archive path, frame index).
+
+    Returns:
+        tuple: (image, model_input, gain, pad), or None if the frame is not a readable image.
+    """
+    image = _read_image(source)
+    if image is None:
+        return None
+    model_input, scale, pad = LetterboxPool(imgsz, slots=1).letterbox(image, 0)
+    return image, model_input, scale, pad
+
+
+def load_processed(results_path: Path) -> set:
+    """
+    File names already present in a previous run's results table.
+    """
+    if not results_path.exists():
+        return set()
+    with open(results_path, newline="") as f:
+        return {row["filename"] for row in csv.DictReader(f)}
+
+
+def annotate(image, detections: list, tracked_objects: list):
+    """
+    Draws detections (with confidence) and track ids onto the image in place.
+    """
+    for (x, y, w, h), conf, label in detections:
+        top_left = (int(x), int(y))
+        cv2.rectangle(image, top_left, (int(x + w), int(y + h)), (255, 128, 0), 2)
+        cv2.putText(image, f"{label} {conf:.2f}", (top_left[0], top_left[1] - 4),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 128, 0), 1)
+    for obj in tracked_objects:
+        l, t = (int(v) for v in obj["bbox"][:2])
+        cv2.putText(image, f"{obj['label']} ({obj['id']})", (l, t - 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return image
+
+
+class ResultWriter:
+    """
+    Background thread that writes annotated images and appends result rows.
+
+    A row is appended only after its image is on disk, so every file listed in
+    the results table is complete.
+    """
+
+    def __init__(self, output_dir: Path, results_path: Path):
+        self.output_dir = output_dir
+        self.results_path = results_path
+        self.written = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, image, detections, tracked_objects, row: dict):
+        if self.error is not None:
+            raise RuntimeError(f"Result writer failed: {self.error}")
+        self._queue.put((image, detections, tracked_objects, row))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        new_file = not self.results_path.exists()
+        with open(self.results_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+            if new_file:
+                writer.writeheader()
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                image, detections, tracked_objects, row = item
+                try:
+                    out_path = self.output_dir / f"annotated_{row['filename']}"
+                    cv2.imwrite(str(out_path), annotate(image, detections, tracked_objects))
+                    writer.writerow(row)
+                    if self._queue.empty():
+                        f.flush()
+                    self.written += 1
+                except Exception as e:
+                    self.error = e
+                    print(f"❌ Could not write {row['filename']}: {e}")
+
+
+def iter_loaded(executor, frames: list, imgsz: int, window: int):
+    """
+    Yields (SavedFrame, loaded frame) in input order while up to `window` loads run in parallel.
+    """
+    pending = deque()
+    frames = iter(frames)
+    for frame in frames:
+        pending.append((frame, executor.submit(_load_frame, frame.source, imgsz)))
+        if len(pending) >= window:
+            break
+    while pending:
+        frame, future = pending.popleft()
+        next_frame = next(frames, None)
+        if next_frame is not None:
+            pending.append((next_frame, executor.submit(_load_frame, next_frame.source, imgsz)))
+        yield frame, future.result()
+
+
+def analyze(input_dir: Path, output_dir: Path, workers: int, batch_size: int) -> int:
+    """
+    Runs the whole folder through the pipeline.
+
+    Returns:
+        int: Number of frames processed in this run.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results_path = output_dir / RESULTS_FILE
+    done = load_processed(results_path)
+
+    frames = list_frames(input_dir)
+    todo = [frame for frame in frames if frame.name not in done]
+    print(f"🗂️ {len(frames)} frames, {len(frames) - len(todo)} already processed, {len(todo)} to go")
+    if not todo:
+        return 0
+
+    # The decode workers re-import this module; keep the detector imports out of them
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+    from services.yolo_service import detect_batch, track_objects, create_tracker, MODEL_IMGSZ
+
+    tracker = create_tracker()
+    scenario_handler = ScenarioHandler()
+    writer = ResultWriter(output_dir, results_path)
+    processed = 0
+    started = time.perf_counter()
+
+    def flush(batch):
+        nonlocal processed
+        frames = [frame for _, frame in batch]
+        # Detection is order-independent; tracking and scenarios below are not
+        for (saved, frame), (prediction, normalized, detections, embeds) in zip(batch, detect_batch(frames)):
+            ts = saved.timestamp
+            tracked_objects = track_objects(tracker, detections, embeds) if detections else []
+            scenario_handler.update(normalized, ts)
+            scenario_handler.update_tracking(tracked_objects)
+            scenario = scenario_handler.get_active_scenario(ts)
+
+            writer.put(frame.image, detections, tracked_objects, {
+                "filename": saved.name,
+                "timestamp": ts,
+                "labels": ";".join(sorted(normalized)),
+                "prediction": prediction,
+                "scenario": scenario["scenario"] if scenario else "",
+                "incident_id": (scenario or {}).get("incident_id") or "",
+                "detections": len(detections),
+                "tracks": json.dumps([[obj["id"], obj["label"], *map(float, obj["bbox"])] for obj in tracked_objects]),
+            })
+            processed += 1
+            if scenario:
+                print(f"⚠️ {saved.name}: {scenario['scenario']}")
+
+        rate = processed / (time.perf_counter() - started)
+        print(f"🔎 {processed}/{len(todo)} frames ({rate:.1f} FPS)")
+
+    try:
+        batch = []
+        for saved, loaded in iter_loaded(executor, todo, MODEL_IMGSZ, window=max(2 * batch_size, 4 * workers)):
+            if loaded is None:
+                print(f"❌ Could not read {saved.name}")
+                continue
+            image, model_input, scale, pad = loaded
+            batch.append((saved, PreparedFrame(
+                image=image, model_input=model_input, slot=None,
+                gain=scale, pad=pad, original_size=(image.shape[1], image.shape[0]),
+            )))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        writer.close()
+        tracker.close()
+
+    return processed
+
+
+def write_parquet(results_path: Path):
+    """
+    Converts the CSV results table to Parquet (needs pyarrow or fastparquet).
+    """
+    import pandas as pd
+
+    parquet_path = results_path.with_suffix(".parquet")
+    try:
+        pd.read_csv(results_path, keep_default_na=False).to_parquet(parquet_path, index=False)
+    except ImportError as e:
+        print(f"❌ Parquet output needs pyarrow or fastparquet: {e}")
+        return
+    print(f"✅ Results table: {parquet_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run YOLO + Deep SORT + scenarios over a folder of saved frames.")
+    parser.add_argument("--input", default="saved_frames", help="Folder with .frames archives and/or .jpg/.png frames")
+    parser.add_argument("--output", default="annotated_output", help="Folder for annotated images and results")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode processes")
+    parser.add_argument("--batch", type=int, default=16, help="Frames per detector batch")
+    parser.add_argument("--parquet", action="store_true", help="Also write results.parquet")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output)
+    started = time.perf_counter()
+    processed = analyze(Path(args.input), output_dir, args.workers, args.batch)
+    print(f"✅ {processed} frames in {time.perf_counter() - started:.1f}s – results in {output_dir / RESULTS_FILE}")
+
+    if args.parquet:
+        write_parquet(output_dir / RESULTS_FILE)
 
 
-# Initialize scenario handler
-scenario_handler = ScenarioHandler()
-
-# Directory with saved images
-image_dir = "saved_frames"
-output_dir = "annotated_output"
-os.makedirs(output_dir, exist_ok=True)
-
-results = []
-
-# Go through each image in the folder
-for filename in sorted(os.listdir(image_dir)):
-    if filename.endswith(".jpg") or filename.endswith(".png"):
-        path = os.path.join(image_dir, filename)
-        image = cv2.imread(path)
-
-        # Run YOLO
-        results_yolo = yolo_model.predict(image, conf=0.3)
-        boxes = results_yolo[0].boxes
-        names = results_yolo[0].names
-        annotated_image = results_yolo[0].plot()
-
-        if not boxes or boxes.cls is None:
-            detected_labels = set()
-            tracked_objects = []
-        else:
-            detected_classes = boxes.cls.cpu().numpy().astype(int)
-            class_names = [names[i] for i in detected_classes]
-            normalized = normalize_class_names(class_names)
-            detected_labels = set(normalized)
-
-            # Format for Deep SORT
-            detections = []
-            for box, cls, conf in zip(boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy()):
-                x1, y1, x2, y2 = box
-                detections.append(([x1, y1, x2 - x1, y2 - y1], conf, names[int(cls)]))
-
-            tracked_objects = []
-            tracks = tracker.update_tracks(detections, frame=image)
-            for track in tracks:
-                if not track.is_confirmed():
-                    continue
-                track_id = track.track_id
-                l, t, w, h = track.to_ltrb()
-                label = track.get_det_class() if track.get_det_class() else "object"
-                tracked_objects.append({
-                    "id": track_id,
-                    "label": label,
-                    "bbox": [int(l), int(t), int(w), int(h)]
-                })
-                # Draw track ID on annotated image
-                cv2.putText(annotated_image, f"{label} ({track_id})", (int(l), int(t) - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-        # Update scenario handler
-        scenario_handler.update(detected_labels)
-        scenario_handler.update_tracking(tracked_objects)
-        scenario = scenario_handler.get_active_scenario()
-
-        # Save annotated image
-        out_path = os.path.join(output_dir, f"annotated_{filename}")
-        cv2.imwrite(out_path, annotated_image)
-
-        print(f"{filename} | Labels: {list(detected_labels)} | Scenario: {scenario} | Saved: {out_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
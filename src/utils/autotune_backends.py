@@ -0,0 +1,126 @@
+"""
+autotune_backends.py – Pick the fastest YOLO backend for this machine
+
+Benchmarks every combination of backend x input size x thread count on a
+folder of recorded frames, prints a table and saves the fastest combination
+to INFERENCE_CONFIG_PATH, which the server loads at startup.
+
+Usage (from src/):
+    python -m utils.autotune_backends --frames saved_frames
+    python -m utils.autotune_backends --frames saved_frames --backends onnx,openvino --imgsz 640 --threads 2,4
+"""
+
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+import cv2
+
+from services.inference_backends import (
+    BACKENDS, DEFAULT_WEIGHTS, INFERENCE_CONFIG_PATH, export_model, load_backend, save_inference_config
+)
+from services.preprocess import LetterboxPool
+
+
+def load_frames(frames_dir: str, imgsz: int, limit: int) -> list:
+    """
+    Reads and letterboxes up to `limit` recorded frames for one input size.
+    """
+    paths = sorted(p for p in Path(frames_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))[:limit]
+    if not paths:
+        raise SystemExit(f"❌ No frames found in {frames_dir}")
+
+    pool = LetterboxPool(imgsz, slots=1)
+    frames = []
+    for path in paths:
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        model_input, _, _ = pool.letterbox(image, 0)
+        frames.append(model_input.copy())
+    return frames
+
+
+def benchmark(backend, frames: list, warmup: int, iterations: int) -> dict:
+    """
+    Times single-frame predicts (the latency the robot sees).
+
+    Returns:
+        dict: Median / p90 latency in milliseconds and achieved FPS.
+    """
+    for i in range(warmup):
+        backend.predict([frames[i % len(frames)]])
+
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        backend.predict([frames[i % len(frames)]])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    median = statistics.median(latencies)
+    return {
+        "median_ms": round(median, 2),
+        "p90_ms": round(latencies[int(0.9 * (len(latencies) - 1))], 2),
+        "fps": round(1000 / median, 1),
+    }
+
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark YOLO backends and save the fastest config.")
+    parser.add_argument("--frames", required=True, help="Folder with recorded .jpg/.png frames")
+    parser.add_argument("--weights", default=str(DEFAULT_WEIGHTS), help="PyTorch weights to export from")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends")
+    parser.add_argument("--imgsz", default="320,480,640", help="Comma-separated input sizes")
+    parser.add_argument("--threads", default=None, help=f"Comma-separated thread counts (default: 1..{os.cpu_count()})")
+    parser.add_argument("--max-frames", type=int, default=50, help="Frames to load from --frames")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default=str(INFERENCE_CONFIG_PATH), help="Where to save the selected config")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    thread_options = parse_list(args.threads, int) if args.threads else sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1)))
+
+    results = []
+    for imgsz in parse_list(args.imgsz, int):
+        frames = load_frames(args.frames, imgsz, args.max_frames)
+        for backend_name in parse_list(args.backends):
+            try:
+                weights = export_model(args.weights, backend_name, imgsz)
+            except Exception as e:
+                print(f"⚠️ Skipping {backend_name} @ {imgsz}: export failed ({e})")
+                continue
+
+            for threads in thread_options:
+                config = {"backend": backend_name, "weights": weights, "imgsz": imgsz, "threads": threads}
+                try:
+                    backend = load_backend(config)
+                    stats = benchmark(backend, frames, args.warmup, args.iterations)
+                except Exception as e:
+                    print(f"⚠️ Skipping {backend_name} @ {imgsz} x{threads}: {e}")
+                    continue
+                del backend
+
+                results.append({**config, **stats})
+                print(f"⏱ {backend_name:9s} imgsz={imgsz:4d} threads={threads:2d} | "
+                      f"median {stats['median_ms']:7.2f} ms | p90 {stats['p90_ms']:7.2f} ms | {stats['fps']:6.1f} FPS")
+
+    if not results:
+        raise SystemExit("❌ No backend could be benchmarked")
+
+    fastest = min(results, key=lambda r: r["median_ms"])
+    selected = {key: fastest[key] for key in ("backend", "weights", "imgsz", "threads")}
+    save_inference_config(selected, results, Path(args.output))
+    print(f"✅ Fastest: {selected} – saved to {args.output}")
+    if len(parse_list(args.imgsz)) > 1:
+        print("ℹ️ Smaller input sizes trade accuracy for speed – restrict --imgsz if recall matters more.")
+
+
+if __name__ == "__main__":
+    main()
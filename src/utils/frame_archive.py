@@ -0,0 +1,294 @@
+"""
+frame_archive.py – Compact append-only container for received JPEG frames
+
+A recording is two files:
+
+- `<name>.frames` : the magic bytes, then one record per frame:
+                    <receive timestamp: f64><length: u32><JPEG bytes>
+- `<name>.frames.idx` : one <record offset: u64><receive timestamp: f64> entry per frame
+
+The JPEG bytes are stored exactly as received (never re-encoded). The index
+makes random access and seeking O(1); if it is missing or shorter than the data
+file (e.g. after a crash), it is rebuilt by scanning the records.
+
+Writing happens on a background thread, so recording never blocks the event loop.
+Long captures can be split into segments (`<stem>_00000.frames`, `<stem>_00001.frames`, ...)
+that rotate after a size limit; `iter_frames` streams them back in order.
+
+Usage (from src/):
+    python -m utils.frame_archive saved_frames                       # list archives
+    python -m utils.frame_archive saved_frames --export frames_jpg   # write the JPEGs back out
+"""
+
+import argparse
+import base64
+import queue
+import struct
+import threading
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+MAGIC = b"TFA1"
+RECORD_HEADER = struct.Struct("<dI")
+INDEX_ENTRY = struct.Struct("<Qd")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("timestamp", "<f8")])
+INDEX_SUFFIX = ".idx"
+
+# Frames buffered for the writer thread before new ones are dropped
+WRITE_QUEUE_SIZE = 256
+
+# Default size at which a segmented capture starts a new file
+SEGMENT_BYTES = 256 * 1024 * 1024
+
+
+def index_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def to_jpeg_bytes(data):
+    """
+    Raw image bytes of a received frame (base64 text frames are decoded).
+    """
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return data
+
+
+class FrameArchiveWriter:
+    """
+    Appends frames to a recording from a background thread.
+
+    Args:
+        path (str | Path): Data file to create (or append to). With `segment_bytes`,
+            the base name of the segments (`<stem>_<n>.frames`).
+        queue_size (int): Frames buffered before `append` starts dropping.
+        segment_bytes (int): Start a new segment once the current one reaches this
+            size; None writes a single file.
+    """
+
+    def __init__(self, path, queue_size: int = WRITE_QUEUE_SIZE, segment_bytes: int = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.segments = []
+        self.bytes_written = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name=f"archive-{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def append(self, data, timestamp: float) -> bool:
+        """
+        Queue a frame for writing (never blocks).
+
+        Args:
+            data (bytes | np.ndarray | str): JPEG bytes, a uint8 view of them, or base64 text.
+            timestamp (float): Receive time in seconds.
+
+        Returns:
+            bool: False if the writer is behind and the frame was dropped.
+        """
+        try:
+            self._queue.put_nowait((data, timestamp))
+            return True
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+
+    def close(self):
+        """
+        Flush pending frames and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _segment_path(self) -> Path:
+        if self.segment_bytes is None:
+            return self.path
+        return self.path.with_name(f"{self.path.stem}_{len(self.segments):05d}{self.path.suffix}")
+
+    def _open_segment(self):
+        path = self._segment_path()
+        self.segments.append(path)
+        data_file = open(path, "ab")
+        if data_file.tell() == 0:
+            data_file.write(MAGIC)
+        return data_file, open(index_path(path), "ab")
+
+    def _write_loop(self):
+        data_file, index_file = self._open_segment()
+        offset = data_file.tell()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                data, timestamp = item
+                try:
+                    jpeg = to_jpeg_bytes(data)
+                except ValueError as e:
+                    print(f"❌ Could not record frame: {e}")
+                    continue
+
+                if self.segment_bytes is not None and offset >= self.segment_bytes:
+                    data_file.close()
+                    index_file.close()
+                    data_file, index_file = self._open_segment()
+                    offset = data_file.tell()
+
+                length = len(memoryview(jpeg).cast("B"))
+                data_file.write(RECORD_HEADER.pack(timestamp, length))
+                data_file.write(jpeg)
+                index_file.write(INDEX_ENTRY.pack(offset, timestamp))
+                offset += RECORD_HEADER.size + length
+                self.bytes_written += RECORD_HEADER.size + length
+                self.frames_written += 1
+                if self._queue.empty():
+                    data_file.flush()
+                    index_file.flush()
+        finally:
+            data_file.close()
+            index_file.close()
+
+
+class FrameArchive:
+    """
+    Random-access reader of a recording.
+
+    Args:
+        path (str | Path): Data file written by FrameArchiveWriter.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a frame archive")
+        self.index = self._load_index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.index["timestamp"]
+
+    def close(self):
+        self._file.close()
+
+    def _load_index(self) -> np.ndarray:
+        idx = index_path(self.path)
+        size = self.path.stat().st_size
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        if idx.exists():
+            index = np.fromfile(idx, dtype=INDEX_DTYPE, count=idx.stat().st_size // INDEX_DTYPE.itemsize)
+
+        # Trust the index only if it covers the data file exactly
+        if len(index) and int(index["offset"][-1]) + RECORD_HEADER.size <= size:
+            last = int(index["offset"][-1])
+            self._file.seek(last)
+            _, length = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+            if last + RECORD_HEADER.size + length == size:
+                return index
+        elif not len(index) and size == len(MAGIC):
+            return index
+        return self._rebuild_index(size)
+
+    def _rebuild_index(self, size: int) -> np.ndarray:
+        entries = []
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            self._file.seek(offset)
+            timestamp, length = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+            if offset + RECORD_HEADER.size + length > size:
+                break  # truncated last record
+            entries.append((offset, timestamp))
+            offset += RECORD_HEADER.size + length
+        print(f"⚠️ Rebuilt index of {self.path} ({len(entries)} frames)")
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def read(self, i: int) -> bytes:
+        """
+        JPEG bytes of frame `i`.
+        """
+        self._file.seek(int(self.index["offset"][i]))
+        _, length = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+        return self._file.read(length)
+
+    def __iter__(self):
+        """
+        Yields (receive timestamp, JPEG bytes) for every frame, in order.
+        """
+        for i in range(len(self.index)):
+            yield float(self.index["timestamp"][i]), self.read(i)
+
+
+def archive_paths(*sources) -> list:
+    """
+    Data files of one or more archives, in capture order.
+
+    Args:
+        sources: `.frames` files and/or directories containing them.
+    """
+    paths = []
+    for source in map(Path, sources):
+        if source.is_dir():
+            paths.extend(sorted(source.glob("*.frames")))
+        else:
+            paths.append(source)
+    return paths
+
+
+def iter_frames(*sources):
+    """
+    Streams (receive timestamp, JPEG bytes) from archives and segments, in order.
+    """
+    for path in archive_paths(*sources):
+        with FrameArchive(path) as archive:
+            yield from archive
+
+
+def export_frames(sources, output_dir) -> int:
+    """
+    Writes every archived frame back out as a JPEG file, byte for byte.
+    File names carry the receive time, as the old per-frame capture did.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    count = 0
+    for timestamp, jpeg in iter_frames(*sources):
+        name = datetime.fromtimestamp(timestamp).strftime("%Y%m%d_%H%M%S_%f")
+        (output_dir / f"frame_{name}.jpg").write_bytes(jpeg)
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or export frame archives.")
+    parser.add_argument("sources", nargs="+", help=".frames files or folders containing them")
+    parser.add_argument("--export", help="Write all frames as .jpg files into this folder")
+    args = parser.parse_args()
+
+    if args.export:
+        count = export_frames(args.sources, args.export)
+        print(f"✅ Exported {count} frames to {args.export}")
+        return
+
+    for path in archive_paths(*args.sources):
+        with FrameArchive(path) as archive:
+            timestamps = archive.timestamps
+            span = float(timestamps[-1] - timestamps[0]) if len(archive) else 0.0
+            print(f"{path}: {len(archive)} frames, {path.stat().st_size / 1e6:.1f} MB, {span:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+frame_protocol.py – Binary WebSocket frame protocol (v1)
+
+Robots that support it send each frame as a single binary WebSocket message:
+
+    offset  size  field
+    0       2     magic b"TF"
+    2       1     protocol version (1)
+    3       1     flags (reserved, 0)
+    4       4     frame sequence number (uint32, little-endian)
+    8       8     capture timestamp (float64, seconds since epoch)
+    16      1     robot id length N (uint8)
+    17      N     robot id (UTF-8)
+    17+N    ...   JPEG bytes, unchanged
+
+The server answers every processed frame with one msgpack-encoded reply
+(see `encode_reply`). Clients that keep sending base64 text frames are served
+by the legacy text protocol.
+"""
+
+import struct
+from typing import NamedTuple
+import msgpack
+import numpy as np
+
+MAGIC = b"TF"
+PROTOCOL_VERSION = 1
+
+_HEADER = struct.Struct("<2sBBIdB")
+
+
+class FrameHeader(NamedTuple):
+    version: int
+    flags: int
+    seq: int
+    capture_ts: float
+    robot_id: str
+
+
+class FrameProtocolError(ValueError):
+    """
+    Raised when a binary message is not a valid v1 frame.
+    """
+
+
+def parse_frame(data: bytes):
+    """
+    Splits a binary frame message into its header and JPEG payload.
+
+    The payload is returned as a NumPy view on the received buffer – no bytes are copied.
+
+    Args:
+        data (bytes): Binary WebSocket message.
+
+    Returns:
+        Tuple[FrameHeader, np.ndarray]: Parsed header and uint8 view of the JPEG bytes.
+
+    Raises:
+        FrameProtocolError: If the message is truncated, has a wrong magic or an unknown version.
+    """
+    if len(data) < _HEADER.size:
+        raise FrameProtocolError("frame shorter than header")
+
+    magic, version, flags, seq, capture_ts, robot_id_len = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise FrameProtocolError(f"bad magic {magic!r}")
+    if version != PROTOCOL_VERSION:
+        raise FrameProtocolError(f"unsupported protocol version {version}")
+
+    payload_offset = _HEADER.size + robot_id_len
+    if len(data) <= payload_offset:
+        raise FrameProtocolError("frame has no image payload")
+
+    robot_id = bytes(data[_HEADER.size:payload_offset]).decode("utf-8", errors="replace")
+    payload = np.frombuffer(data, dtype=np.uint8, offset=payload_offset)
+    return FrameHeader(version, flags, seq, capture_ts, robot_id), payload
+
+
+def build_frame(jpeg_bytes: bytes, seq: int, capture_ts: float, robot_id: str = "", flags: int = 0) -> bytes:
+    """
+    Builds a v1 binary frame message (used by test clients and tools).
+    """
+    robot_id_bytes = robot_id.encode("utf-8")
+    header = _HEADER.pack(MAGIC, PROTOCOL_VERSION, flags, seq & 0xFFFFFFFF, capture_ts, len(robot_id_bytes))
+    return header + robot_id_bytes + jpeg_bytes
+
+
+def encode_reply(header: FrameHeader, prediction, scenario, tracked_objects: list, profile=None) -> bytes:
+    """
+    Packs the result of one frame into a single compact msgpack message.
+
+    Reply fields:
+        - v: protocol version
+        - type: "frame"
+        - seq / ts: echoed frame sequence number and capture timestamp
+        - prediction: frame-level classification (e.g. "metal_pot") or None
+        - scenario: {"name", "timestamp", "incident_id"} or None
+        - tracks: list of [id, label, x1, y1, x2, y2]
+        - profile: {"name", "imgsz", "max_fps"} of the robot's current inference profile
+          (max_fps None = no limit) – robots may lower their capture rate to max_fps
+
+    Args:
+        header (FrameHeader): Header of the frame being answered.
+        prediction (str): Raw YOLO-based prediction.
+        scenario (dict): Result of `ScenarioHandler.get_active_scenario()` (may be None).
+        tracked_objects (list): Tracked objects with 'id', 'label' and 'bbox'.
+        profile (InferenceProfile): Active inference profile (see services/inference_profiles.py).
+
+    Returns:
+        bytes: msgpack-encoded reply.
+    """
+    return msgpack.packb({
+        "v": PROTOCOL_VERSION,
+        "type": "frame",
+        "seq": header.seq,
+        "ts": header.capture_ts,
+        "prediction": prediction,
+        "scenario": {
+            "name": scenario["scenario"],
+            "timestamp": scenario["timestamp"],
+            "incident_id": scenario["incident_id"],
+        } if scenario else None,
+        "tracks": [[str(obj["id"]), obj["label"], *obj["bbox"]] for obj in tracked_objects],
+        "profile": {
+            "name": profile.name,
+            "imgsz": profile.imgsz,
+            "max_fps": profile.max_fps,
+        } if profile else None,
+    }, use_bin_type=True)
+
+
+def decode_reply(data: bytes) -> dict:
+    """
+    Unpacks a reply produced by `encode_reply` (used by test clients and tools).
+    """
+    return msgpack.unpackb(data, raw=False)
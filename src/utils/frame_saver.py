@@ -1,40 +1,76 @@
 import os
-import io
-import base64
 import time
-from PIL import Image
-from fastapi import WebSocket
+import asyncio
+import itertools
+from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime
+from utils.frame_archive import FrameArchiveWriter, SEGMENT_BYTES
+from utils.frame_protocol import parse_frame, FrameProtocolError
 
 # הגדר תיקייה לשמירת תמונות
 SAVE_DIR = "saved_frames"
 os.makedirs(SAVE_DIR, exist_ok=True)
 
-# שמור כמה זמן עבר מהשמירה האחרונה
-last_saved_time = 0
+# Minimum time between two saved frames of the same connection
 SAVE_INTERVAL = 0.1  # שניות (כל 0.1 שנייה)
 
+# Frames are appended, unchanged, to rotating segment files of this size
+CAPTURE_SEGMENT_BYTES = SEGMENT_BYTES
+
+capture_ids = itertools.count(1)
+
 async def save_frame_from_websocket(websocket: WebSocket):
-    global last_saved_time
+    """
+    Records the frames of one connection for dataset collection.
+
+    The received JPEG bytes are written as they are (no decode / re-encode) by a
+    background writer into `SAVE_DIR/capture_<time>_<n>_<segment>.frames` archives.
+    Each connection has its own rate limit. Export the frames as .jpg files with
+    `python -m utils.frame_archive saved_frames --export <folder>`.
+
+    Accepts binary v1 frames (see utils/frame_protocol.py) and legacy base64 text.
+    """
     await websocket.accept()
-    print("🖼️ Frame saving started...")
+    started = datetime.now().strftime("%Y%m%d_%H%M%S")
+    writer = FrameArchiveWriter(
+        os.path.join(SAVE_DIR, f"capture_{started}_{next(capture_ids)}.frames"),
+        segment_bytes=CAPTURE_SEGMENT_BYTES,
+    )
+    last_saved_time = 0
+    print(f"🖼️ Frame saving started... ({writer.path.stem}_*.frames)")
 
     try:
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
             now = time.time()
+            if now - last_saved_time < SAVE_INTERVAL:
+                continue
 
-            if now - last_saved_time >= SAVE_INTERVAL:
-                last_saved_time = now
+            if message.get("bytes") is not None:
+                try:
+                    _, data = parse_frame(message["bytes"])
+                except FrameProtocolError as e:
+                    print(f"❌ Invalid binary frame: {e}")
+                    continue
+            else:
+                data = message.get("text")
 
-                # Decode and save image
-                image_data = base64.b64decode(data)
-                image = Image.open(io.BytesIO(image_data)).convert("RGB")
+            # The writer thread decodes base64 text and does all file I/O
+            if writer.append(data, now):
+                last_saved_time = now
+            else:
+                print("⏭️ Frame writer is behind – frame dropped")
 
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                filename = f"{SAVE_DIR}/frame_{timestamp}.jpg"
-                image.save(filename)
-                print(f"✅ Saved: {filename}")
+    except WebSocketDisconnect:
+        print("🖼️ Frame saving stopped")
 
     except Exception as e:
         print(f"❌ Error saving frame: {e}")
+
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, writer.close)
+        print(f"✅ Saved {writer.frames_written} frames ({writer.bytes_written / 1e6:.1f} MB) "
+              f"in {len(writer.segments)} segment(s), {writer.frames_dropped} dropped")
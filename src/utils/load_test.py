@@ -0,0 +1,432 @@
+"""
+load_test.py – Synthetic multi-robot load on /ws and a capacity curve
+
+Answers "how many robots can this box serve at N FPS?". For a growing number of
+simulated robots, every robot opens its own /ws connection (and, with
+--save-frames, a /save_frames connection next to it) and streams recorded JPEG
+frames as binary v1 frames (see utils/frame_protocol.py) at a fixed rate. Per step
+it reports:
+
+- round-trip latency from sending a frame to receiving its reply (p50/p90/p99),
+- dropped frames: sent but never answered (replaced by a newer frame in the
+  server's pipeline, or skipped by an inference profile's frame budget),
+- late frames: answered more than --deadline ms after they were sent,
+- reply FPS per robot,
+- CPU and RSS of the server process and its children (psutil).
+
+The capacity is the largest robot count whose step stays within --max-drop and
+--max-late. Everything runs locally: --serve starts the server itself (uvicorn
+main:app, or serve.py with --workers), otherwise pass --url and, for CPU/RSS,
+--server-pid of a running one. Started servers get ADAPTIVE_PROFILES=0 unless
+--adaptive is given, so every robot is measured at its full frame rate.
+
+Usage (from src/):
+    python -m utils.load_test --frames saved_frames --serve --robots 1,2,4,8 --fps 10
+    python -m utils.load_test --frames recordings --serve --workers 4 --robots 4,8,16,32 --output capacity.json
+    python -m utils.load_test --frames saved_frames --url ws://127.0.0.1:8000 --server-pid 1234 --save-frames
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+import numpy as np
+
+from utils.frame_archive import archive_paths, iter_frames
+from utils.frame_protocol import build_frame, decode_reply
+
+PERCENTILES = (50, 90, 99)
+
+# Frames kept in memory and cycled through by every robot
+MAX_FRAMES = 200
+
+# After a step, replies of frames still in flight are waited for this long before they count as dropped
+DRAIN_SECONDS = 2.0
+
+# Pause between two steps, so the server forgets the previous step's robots' frames
+STEP_PAUSE = 2.0
+
+# Server CPU/RSS sampling interval
+SAMPLE_INTERVAL = 0.5
+
+SERVER_START_TIMEOUT = 300.0
+
+
+def load_frames(sources: list, limit: int = MAX_FRAMES) -> list:
+    """
+    JPEG bytes of up to `limit` recorded frames: `.frames` archives (see
+    utils/frame_archive.py), folders of archives or folders of .jpg files.
+    """
+    frames = []
+    for source in map(Path, sources):
+        if source.is_dir() and not any(source.glob("*.frames")):
+            paths = sorted(p for p in source.iterdir() if p.suffix.lower() in (".jpg", ".jpeg"))
+            frames.extend(p.read_bytes() for p in paths[:limit - len(frames)])
+        else:
+            for _, jpeg in iter_frames(*archive_paths(source)):
+                frames.append(jpeg)
+                if len(frames) >= limit:
+                    break
+        if len(frames) >= limit:
+            break
+    if not frames:
+        raise SystemExit(f"❌ No JPEG frames found in {', '.join(map(str, sources))}")
+    return frames
+
+
+def summarize(samples: list) -> dict:
+    """
+    Round-trip percentiles, in milliseconds.
+    """
+    if not samples:
+        return {f"p{p}_ms": None for p in PERCENTILES}
+    values = np.asarray(samples) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+
+
+# ---------- server ----------
+
+def _http_url(ws_url: str) -> str:
+    return "http" + ws_url[len("ws"):] if ws_url.startswith("ws") else ws_url
+
+
+def wait_ready(url: str, timeout: float = SERVER_START_TIMEOUT, process=None):
+    """
+    Polls /readyz until the server accepts robots.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"❌ Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{_http_url(url)}/readyz", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"❌ Server at {url} not ready after {timeout:.0f}s")
+
+
+def start_server(port: int, workers: int = None, adaptive: bool = False) -> subprocess.Popen:
+    """
+    Starts the server on localhost in a child process (uvicorn main:app, or serve.py for --workers).
+    """
+    src_dir = Path(__file__).resolve().parent.parent
+    if workers:
+        command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)]
+    env = dict(os.environ)
+    if not adaptive:
+        env["ADAPTIVE_PROFILES"] = "0"
+    print(f"🚀 Starting server: {' '.join(command[1:])}")
+    return subprocess.Popen(command, cwd=src_dir, env=env)
+
+
+class ServerSampler:
+    """
+    Samples CPU and RSS of a process and all its children (web workers, inference servers).
+
+    Args:
+        pid (int): Server process, None disables sampling.
+    """
+
+    def __init__(self, pid: int = None):
+        self.process = None
+        if pid is not None:
+            import psutil
+            self.process = psutil.Process(pid)
+        self.cpu = []
+        self.rss = []
+        self._known = {}
+
+    def _processes(self) -> list:
+        import psutil
+        try:
+            processes = [self.process, *self.process.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+        # cpu_percent() needs the same Process object between two calls
+        known = {}
+        for process in processes:
+            known[process.pid] = self._known.get(process.pid, process)
+        self._known = known
+        return list(known.values())
+
+    def sample(self):
+        import psutil
+        cpu = rss = 0.0
+        for process in self._processes():
+            try:
+                cpu += process.cpu_percent()
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return cpu, rss
+
+    async def run(self):
+        if self.process is None:
+            return
+        self.sample()  # primes cpu_percent
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            cpu, rss = self.sample()
+            self.cpu.append(cpu)
+            self.rss.append(rss)
+
+    def reset(self):
+        self.cpu.clear()
+        self.rss.clear()
+
+    def summary(self) -> dict:
+        if not self.cpu:
+            return {"server_cpu_percent": None, "server_rss_mb": None}
+        return {
+            "server_cpu_percent": round(float(np.mean(self.cpu)), 1),
+            "server_rss_mb": round(max(self.rss) / 2**20, 1),
+        }
+
+
+# ---------- robots ----------
+
+class SimulatedRobot:
+    """
+    One robot: streams frames on /ws at `fps` and matches replies to frames by sequence number.
+
+    Args:
+        url (str): ws://host:port of the server.
+        robot_id (str): Robot id sent in every frame header.
+        frames (list): JPEG bytes to cycle through (each robot starts at another frame).
+        fps (float): Frames per second to send.
+        save_frames (bool): Also stream every frame to /save_frames.
+    """
+
+    def __init__(self, url: str, robot_id: str, frames: list, fps: float, save_frames: bool = False):
+        self.url = url
+        self.robot_id = robot_id
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self.save_frames = save_frames
+        self.in_flight = {}   # seq -> perf_counter() when sent
+        self.rtts = []
+        self.sent = 0
+        self.skipped = 0      # send slots missed because this client fell behind
+        self.error = None
+
+    async def _receive(self, ws):
+        async for message in ws:
+            if not isinstance(message, bytes):
+                continue  # MoonDream answers
+            received = time.perf_counter()
+            sent = self.in_flight.pop(decode_reply(message)["seq"], None)
+            if sent is not None:
+                self.rtts.append(received - sent)
+
+    async def run(self, duration: float):
+        from websockets.asyncio.client import connect
+
+        try:
+            async with connect(f"{self.url}/ws", max_size=None) as ws:
+                save_ws = await connect(f"{self.url}/save_frames", max_size=None) if self.save_frames else None
+                receiver = asyncio.create_task(self._receive(ws))
+                try:
+                    await self._send(ws, save_ws, duration)
+                    deadline = time.monotonic() + DRAIN_SECONDS
+                    while self.in_flight and time.monotonic() < deadline and not receiver.done():
+                        await asyncio.sleep(0.05)
+                finally:
+                    receiver.cancel()
+                    await asyncio.gather(receiver, return_exceptions=True)
+                    if save_ws is not None:
+                        await save_ws.close()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    async def _send(self, ws, save_ws, duration: float):
+        offset = random.randrange(len(self.frames))
+        # Robots start spread over one frame interval, like real, unsynchronized cameras
+        await asyncio.sleep(random.uniform(0, self.interval))
+        started = time.perf_counter()
+        for seq in range(int(duration / self.interval)):
+            due = started + seq * self.interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > self.interval:
+                self.skipped += 1
+                continue
+            message = build_frame(self.frames[(offset + seq) % len(self.frames)], seq, time.time(), self.robot_id)
+            self.in_flight[seq] = time.perf_counter()
+            await ws.send(message)
+            if save_ws is not None:
+                await save_ws.send(message)
+            self.sent += 1
+
+    @property
+    def dropped(self) -> int:
+        return len(self.in_flight)
+
+
+async def run_step(url: str, frames: list, robots: int, fps: float, duration: float, deadline: float,
+                   save_frames: bool, sampler: ServerSampler, step: int) -> dict:
+    """
+    Runs `robots` simulated robots for `duration` seconds.
+
+    Returns:
+        dict: Latency percentiles, drop / late ratios, reply FPS and server CPU/RSS of the step.
+    """
+    fleet = [
+        SimulatedRobot(url, f"load-{step}-{i}", frames, fps, save_frames)
+        for i in range(robots)
+    ]
+    sampler.reset()
+    sampling = asyncio.create_task(sampler.run())
+    try:
+        await asyncio.gather(*(robot.run(duration) for robot in fleet))
+    finally:
+        sampling.cancel()
+        await asyncio.gather(sampling, return_exceptions=True)
+
+    rtts = [rtt for robot in fleet for rtt in robot.rtts]
+    sent = sum(robot.sent for robot in fleet)
+    dropped = sum(robot.dropped for robot in fleet)
+    late = sum(rtt > deadline for rtt in rtts)
+    errors = [f"{robot.robot_id}: {robot.error}" for robot in fleet if robot.error]
+    result = {
+        "robots": robots,
+        "fps": fps,
+        "sent": sent,
+        "replies": len(rtts),
+        "reply_fps_per_robot": round(len(rtts) / duration / robots, 2),
+        **summarize(rtts),
+        "dropped_ratio": round(dropped / sent, 4) if sent else None,
+        "late_ratio": round(late / len(rtts), 4) if rtts else None,
+        "client_skipped": sum(robot.skipped for robot in fleet),
+        **sampler.summary(),
+        "errors": errors,
+    }
+    return result
+
+
+def passes(result: dict, max_drop: float, max_late: float) -> bool:
+    return (
+        not result["errors"] and result["replies"] > 0
+        and result["dropped_ratio"] <= max_drop and result["late_ratio"] <= max_late
+    )
+
+
+def print_curve(results: list, deadline_ms: float):
+    print()
+    print(f"{'robots':>6} {'reply fps':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'dropped':>8} "
+          f"{'late>' + format(deadline_ms, '.0f') + 'ms':>10} {'cpu %':>7} {'rss MB':>8}  ok")
+    for r in results:
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else "-"
+        print(
+            f"{r['robots']:>6} {r['reply_fps_per_robot']:>9.2f} {fmt(r['p50_ms'], '8.1f')} {fmt(r['p90_ms'], '8.1f')} "
+            f"{fmt(r['p99_ms'], '8.1f')} {fmt(r['dropped_ratio'], '8.1%')} {fmt(r['late_ratio'], '10.1%')} "
+            f"{fmt(r['server_cpu_percent'], '7.0f')} {fmt(r['server_rss_mb'], '8.0f')}  {'✅' if r['ok'] else '❌'}"
+        )
+    for r in results:
+        for error in r["errors"][:3]:
+            print(f"⚠️ {r['robots']} robots – {error}")
+
+
+async def run_curve(args, frames: list, sampler: ServerSampler) -> list:
+    deadline = (args.deadline or 1000.0 / args.fps) / 1000
+    results = []
+    for step, robots in enumerate(args.robots):
+        print(f"⏱️ {robots} robot(s) at {args.fps:g} FPS for {args.duration:g}s ...")
+        result = await run_step(args.url, frames, robots, args.fps, args.duration, deadline,
+                                args.save_frames, sampler, step)
+        result["ok"] = passes(result, args.max_drop, args.max_late)
+        results.append(result)
+        if not result["ok"] and args.stop_on_fail:
+            break
+        await asyncio.sleep(STEP_PAUSE)
+    return results
+
+
+def capacity(results: list):
+    """
+    Largest robot count before the first step that missed the targets.
+    """
+    best = None
+    for result in results:
+        if not result["ok"]:
+            break
+        best = result["robots"]
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream recorded frames from simulated robots and measure capacity.")
+    parser.add_argument("--frames", nargs="+", required=True, help=".frames archives or folders (of archives or .jpg files)")
+    parser.add_argument("--url", default=None, help="ws://host:port of a running server (default with --serve: localhost)")
+    parser.add_argument("--serve", action="store_true", help="Start the server locally for the test")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the server started with --serve")
+    parser.add_argument("--workers", type=int, default=None, help="With --serve: multi-process serving (serve.py) with this many web workers")
+    parser.add_argument("--adaptive", action="store_true", help="With --serve: keep adaptive inference profiles on")
+    parser.add_argument("--server-pid", type=int, default=None, help="Measure CPU/RSS of this process (and its children)")
+    parser.add_argument("--robots", default="1,2,4,8,16", help="Comma-separated robot counts, one step each")
+    parser.add_argument("--fps", type=float, default=10.0, help="Frames per second per robot")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per step")
+    parser.add_argument("--deadline", type=float, default=None, help="Replies later than this (ms) are late (default: one frame interval)")
+    parser.add_argument("--max-drop", type=float, default=0.05, help="Highest dropped ratio a step may have to pass")
+    parser.add_argument("--max-late", type=float, default=0.05, help="Highest late ratio a step may have to pass")
+    parser.add_argument("--save-frames", action="store_true", help="Every robot also streams to /save_frames")
+    parser.add_argument("--stop-on-fail", action="store_true", help="Stop after the first step that misses the targets")
+    parser.add_argument("--max-frames", type=int, default=MAX_FRAMES, help="Recorded frames to cycle through")
+    parser.add_argument("--output", default=None, help="Write the curve as JSON")
+    args = parser.parse_args()
+    args.robots = [int(n) for n in args.robots.split(",")]
+    if args.url is None:
+        if not args.serve:
+            parser.error("pass --url of a running server or --serve")
+        args.url = f"ws://127.0.0.1:{args.port}"
+    args.url = args.url.rstrip("/")
+
+    frames = load_frames(args.frames, args.max_frames)
+    print(f"🖼️ {len(frames)} frames, {np.mean([len(f) for f in frames]) / 1024:.0f} KiB on average")
+
+    server = None
+    if args.serve:
+        server = start_server(args.port, args.workers, args.adaptive)
+        args.server_pid = server.pid
+    try:
+        wait_ready(args.url, process=server)
+        results = asyncio.run(run_curve(args, frames, ServerSampler(args.server_pid)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    deadline_ms = args.deadline or 1000.0 / args.fps
+    print_curve(results, deadline_ms)
+    best = capacity(results)
+    if best is None:
+        print(f"\n❌ Not even {args.robots[0]} robot(s) at {args.fps:g} FPS met the targets")
+    else:
+        print(f"\n✅ Capacity: {best} robot(s) at {args.fps:g} FPS "
+              f"(≤{args.max_drop:.0%} dropped, ≤{args.max_late:.0%} later than {deadline_ms:.0f} ms)")
+
+    if args.output:
+        report = {
+            "url": args.url, "fps": args.fps, "duration": args.duration, "deadline_ms": deadline_ms,
+            "max_drop": args.max_drop, "max_late": args.max_late, "save_frames": args.save_frames,
+            "workers": args.workers, "cpu_count": os.cpu_count(), "capacity": best, "steps": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Curve written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+metrics.py – Lightweight in-process metrics
+
+Minimal counters and histograms used to tune the inference pipeline
+(batch sizes, queueing delays, dropped frames, ...). Everything is kept
+in memory; `snapshot()` returns a plain dict that can be logged or served,
+and `render_prometheus()` the Prometheus text format served on /metrics.
+
+Metrics with labels (e.g. one counter per robot) are created through
+`counter_family()` / `histogram_family()` and `.labels(value, ...)`.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Default histogram buckets, in seconds (1 ms .. 5 s)
+DEFAULT_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """
+    A monotonically increasing counter.
+    """
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """
+    A value that can go up and down.
+    """
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram that also keeps count, sum and max.
+
+    Args:
+        name (str): Metric name.
+        buckets (tuple): Sorted upper bounds of the buckets.
+    """
+
+    def __init__(self, name: str, description: str = "", buckets=DEFAULT_TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.bucket_counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "max": self.max,
+                "buckets": dict(zip([*self.buckets, float("inf")], self.bucket_counts)),
+            }
+
+
+class MetricFamily:
+    """
+    A set of metrics of one kind, told apart by label values.
+
+    Args:
+        metric_cls (type): Counter, Gauge or Histogram.
+        label_names (tuple): Names of the labels, e.g. ("robot",).
+    """
+
+    def __init__(self, name: str, description: str = "", metric_cls=Counter, label_names=(), **kwargs):
+        self.metric_cls = metric_cls
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.kwargs = kwargs
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Returns the metric for these label values, creating it on first use.
+        """
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            with self._lock:
+                child = self.children.setdefault(values, self.metric_cls(self.name, self.description, **self.kwargs))
+        return child
+
+    def snapshot(self):
+        return {",".join(values): child.snapshot() for values, child in list(self.children.items())}
+
+
+def _get_or_create(cls, name, description, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name: str, description: str = "") -> Counter:
+    """
+    Returns the counter registered under `name`, creating it on first use.
+    """
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    """
+    Returns the gauge registered under `name`, creating it on first use.
+    """
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str = "", buckets=DEFAULT_TIME_BUCKETS) -> Histogram:
+    """
+    Returns the histogram registered under `name`, creating it on first use.
+    """
+    return _get_or_create(Histogram, name, description, buckets=buckets)
+
+
+def counter_family(name: str, description: str = "", label_names=()) -> MetricFamily:
+    """
+    Returns the labelled counter family registered under `name`, creating it on first use.
+    """
+    return _get_or_create(MetricFamily, name, description, metric_cls=Counter, label_names=label_names)
+
+
+def histogram_family(name: str, description: str = "", label_names=(), buckets=DEFAULT_TIME_BUCKETS) -> MetricFamily:
+    """
+    Returns the labelled histogram family registered under `name`, creating it on first use.
+    """
+    return _get_or_create(
+        MetricFamily, name, description, metric_cls=Histogram, label_names=label_names, buckets=buckets
+    )
+
+
+def snapshot() -> dict:
+    """
+    Returns the current value of every registered metric.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+# =======================
+# PROMETHEUS TEXT FORMAT
+# =======================
+
+_PROMETHEUS_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_metric(lines: list, metric, pairs: tuple):
+    name = metric.name
+    if isinstance(metric, Histogram):
+        with metric._lock:
+            bucket_counts = list(metric.bucket_counts)
+            count, total = metric.count, metric.sum
+        cumulative = 0
+        for bound, bucket_count in zip([*metric.buckets, float("inf")], bucket_counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_label_text(pairs + (('le', _format_number(bound)),))} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(pairs)} {_format_number(total)}")
+        lines.append(f"{name}_count{_label_text(pairs)} {count}")
+    else:
+        lines.append(f"{name}{_label_text(pairs)} {_format_number(metric.value)}")
+
+
+def render_prometheus() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+
+    lines = []
+    for metric in metrics:
+        cls = metric.metric_cls if isinstance(metric, MetricFamily) else type(metric)
+        if metric.description:
+            lines.append(f"# HELP {metric.name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {_PROMETHEUS_TYPES[cls]}")
+        if isinstance(metric, MetricFamily):
+            for values, child in list(metric.children.items()):
+                _render_metric(lines, child, tuple(zip(metric.label_names, values)))
+        else:
+            _render_metric(lines, metric, ())
+    return "\n".join(lines) + "\n"
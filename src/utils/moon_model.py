@@ -1,27 +1,61 @@
 import moondream as md
 import cv2
+import numpy as np
 from PIL import Image
+import settings
+from utils.scenario_rules import question_for_labels
+from utils.vlm_cache import SceneCache, image_signature
 
-md_model = md.vl(model="C:/Users/Idan Vahab/Desktop/TemiSafetyApp/src/moondream-0_5b-int8.mf")
+# Loaded by `load_moondream()` (the MoonDream worker process does it at start-up)
+md_model = None
+
+MOONDREAM_FAILED = "MoonDream failed to generate description."
+
+# Encoded images by scene signature, so several questions about one frame share an encoding
+encoding_cache = SceneCache(max_entries=16, ttl=60.0)
+
+def load_moondream(path=settings.MOONDREAM_MODEL):
+    """
+    Loads the MoonDream model file (path from settings.MOONDREAM_MODEL by default).
+    """
+    global md_model
+    if md_model is None:
+        if not path.exists():
+            raise FileNotFoundError(f"MoonDream model not found at {path} (set MOONDREAM_MODEL)")
+        md_model = md.vl(model=str(path))
+    return md_model
+
+def warmup_moondream(iterations: int = 1):
+    """
+    Runs a full encode + query on a blank image so the first real request is not slowed down.
+    """
+    model = load_moondream()
+    blank = Image.fromarray(np.zeros((240, 320, 3), dtype=np.uint8))
+    for _ in range(iterations):
+        model.query(model.encode_image(blank), "Is there anything in the image?")
 
 def describe_image_with_moondream(image_np, labels):
+    image_rgb = cv2.cvtColor(cv2.resize(image_np, (320, 240)), cv2.COLOR_BGR2RGB)
+    return answer_question(image_rgb, get_moondream_question(labels))
+
+def encode_image(image_rgb, signature=None):
+    if signature is None:
+        signature = image_signature(image_rgb)
+    encoded = encoding_cache.get((signature,))
+    if encoded is None:
+        encoded = load_moondream().encode_image(Image.fromarray(image_rgb))
+        encoding_cache.put((signature,), encoded)
+    return encoded
+
+def answer_question(image_rgb, question, signature=None):
     try:
-        image_pil = Image.fromarray(cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)).resize((320, 240))
-        encoded = md_model.encode_image(image_pil)
-        question = get_moondream_question(labels)
+        encoded = encode_image(image_rgb, signature)
         print(f"❓ MoonDream question: {question}")
-        result = md_model.query(encoded, question)
+        result = load_moondream().query(encoded, question)
         return result.get("answer", "No description")
     except Exception as e:
         print(f"❌ MoonDream error: {e}")
-        return "MoonDream failed to generate description."
+        return MOONDREAM_FAILED
 
 def get_moondream_question(labels: set) -> str:
-    if "metal pot in a microwave" in labels:
-        return "Is there a metal pot inside the microwave?"
-    if "pot" in labels and "Plate"  in labels:
-        return "Is someone pouring food from a pot to a plate?"
-    if "pot" in labels and "Bowl"  in labels:
-        return "Is someone pouring food from a pot to a Bowl?"
-
-    return "Does the image show a kitchen-related action? yes or no?" 
+    return question_for_labels(labels)
@@ -0,0 +1,298 @@
+"""
+replay_session.py – Replay a recorded /ws session through the live pipeline
+
+Feeds a recording (see utils/frame_archive.py) frame by frame through the same
+code as routes/websocket.py: the decode stage of services/inference_worker.py,
+then `SessionState.process` (scene-change gate -> batch scheduler / YOLO ->
+tracker -> ScenarioHandler). The session's inference profile applies as it would
+live: frames are letterboxed to the profile's input size, and frames beyond an
+idle profile's frame budget are skipped (`--no-profiles` keeps every frame at full
+size). The recorded receive timestamps are used as frame times, so the emitted
+scenario sequence is reproducible and can be compared before and after an
+optimization.
+
+`--compare-trackers` replays the recording once per tracker backend (Deep SORT,
+ByteTrack-style IoU) and compares FPS, tracking latency, number of track ids and
+ID switches. Without ground truth an ID switch is counted when a track vanishes
+and a new id of the same label appears where it was (IoU >= ID_SWITCH_IOU).
+
+Usage (from src/):
+    python -m utils.replay_session recordings/session_1.frames
+    python -m utils.replay_session recordings/session_1.frames --speed 1 --output report.json
+    python -m utils.replay_session recordings/session_1.frames --expect report.json
+    python -m utils.replay_session recordings/session_1.frames --tracker bytetrack
+    python -m utils.replay_session recordings/session_1.frames --compare-trackers
+
+Recordings are written by the server when RECORDINGS_DIR is set.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+import settings
+from services.yolo_service import warmup, TRACKERS, MODEL_IMGSZ
+from services.iou_tracker import iou_matrix
+from services.inference_worker import SessionState, prepare_and_thumbnail
+from services.preprocess import LetterboxPool
+from utils.frame_archive import FrameArchive
+
+STAGES = ("decode", "gate", "detect", "track", "scenario")
+PERCENTILES = (50, 90, 99)
+
+# A new track this close to one that just vanished (same label) counts as an ID switch
+ID_SWITCH_IOU = 0.5
+
+
+def summarize(samples: list) -> dict:
+    """
+    Latency percentiles of one stage, in milliseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    summary = {"count": len(values)}
+    summary.update({f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in PERCENTILES})
+    summary["max_ms"] = round(float(values.max()), 2)
+    return summary
+
+
+def count_id_switches(previous: list, current: list) -> int:
+    """
+    Tracks of `previous` that are gone in `current` while a new id of the same
+    label took their place.
+
+    Args:
+        previous (list): Tracked objects of the previous frame.
+        current (list): Tracked objects of this frame.
+    """
+    current_ids = {obj["id"] for obj in current}
+    previous_ids = {obj["id"] for obj in previous}
+    lost = [obj for obj in previous if obj["id"] not in current_ids]
+    new = [obj for obj in current if obj["id"] not in previous_ids]
+    if not lost or not new:
+        return 0
+    iou = iou_matrix(
+        np.array([obj["bbox"] for obj in lost], dtype=float),
+        np.array([obj["bbox"] for obj in new], dtype=float),
+    )
+    switches = 0
+    taken = set()
+    for i, obj in enumerate(lost):
+        for j in np.argsort(-iou[i]):
+            if iou[i, j] < ID_SWITCH_IOU:
+                break
+            if j not in taken and new[j]["label"] == obj["label"]:
+                taken.add(j)
+                switches += 1
+                break
+    return switches
+
+
+def replay(archive: FrameArchive, speed: float = 0.0, use_gate: bool = True, limit: int = None,
+           tracker_kind: str = settings.TRACKER, adaptive_profiles: bool = settings.ADAPTIVE_PROFILES) -> dict:
+    """
+    Runs every recorded frame through the pipeline.
+
+    Args:
+        archive (FrameArchive): Recording to replay.
+        speed (float): 1.0 replays at recorded speed, 2.0 twice as fast; 0 = as fast as possible.
+        use_gate (bool): Whether static frames may skip YOLO, as in the live server.
+        limit (int): Replay only the first `limit` frames.
+        tracker_kind (str): Tracker backend, a key of yolo_service.TRACKERS.
+        adaptive_profiles (bool): Apply the inference profiles (input size, classes, frame budget).
+
+    Returns:
+        dict: Report with per-stage latency, FPS, tracking statistics and the emitted scenarios.
+    """
+    return asyncio.run(_replay(archive, speed, use_gate, limit, tracker_kind, adaptive_profiles))
+
+
+async def _replay(archive: FrameArchive, speed: float, use_gate: bool, limit: int, tracker_kind: str,
+                  adaptive_profiles: bool) -> dict:
+    # The live session state: gate, batch scheduler, tracker, scenario handler, inference profile
+    state = SessionState(tracker_kind, use_gate=use_gate)
+    state.profiles.enabled = adaptive_profiles
+    profile = state.profiles.profile
+    last_admitted = None
+    pool = LetterboxPool(MODEL_IMGSZ, slots=1)
+
+    timings = {stage: [] for stage in STAGES}
+    lag = []
+    scenarios = []
+    predictions = []
+    frames = skipped = failed = throttled = switches = 0
+    track_ids = set()
+    id_switches = 0
+    previous_tracks = []
+
+    first_ts = float(archive.timestamps[0]) if len(archive) else 0.0
+    started = time.perf_counter()
+
+    for i, (ts, jpeg) in enumerate(archive):
+        if limit is not None and i >= limit:
+            break
+
+        if speed > 0:
+            due = started + (ts - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag.append(max(0.0, -delay))
+
+        # Frames beyond the profile's frame budget never reach the pipeline (see FramePipeline.submit)
+        if not profile.admits(last_admitted, ts):
+            throttled += 1
+            continue
+        last_admitted = ts
+
+        t0 = time.perf_counter()
+        frame, thumbnail = prepare_and_thumbnail(np.frombuffer(jpeg, dtype=np.uint8), pool, profile.imgsz)
+        if frame is None:
+            failed += 1
+            continue
+        timings["decode"].append(time.perf_counter() - t0)
+
+        stages = {}
+        prediction, _, tracked_objects, scenario, next_profile, _ = await state.process(
+            frame, thumbnail, pool.release, now=ts, timings=stages
+        )
+        switches += next_profile != profile
+        profile = next_profile
+        for stage, seconds in stages.items():
+            timings[stage].append(seconds)
+        if "detect" not in stages:
+            skipped += 1
+
+        track_ids.update(obj["id"] for obj in tracked_objects)
+        id_switches += count_id_switches(previous_tracks, tracked_objects)
+        previous_tracks = tracked_objects
+
+        predictions.append(prediction)
+        if scenario:
+            scenarios.append({
+                "frame": i,
+                "offset": round(ts - first_ts, 3),
+                "scenario": scenario["scenario"],
+                "incident_id": scenario["incident_id"],
+            })
+        frames += 1
+
+    elapsed = time.perf_counter() - started
+    await state.close()
+    report = {
+        "tracker": tracker_kind,
+        "frames": frames,
+        "undecodable": failed,
+        "yolo_skipped": skipped,
+        "throttled": throttled,
+        "profile_switches": switches,
+        "elapsed_s": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+        "track_ids": len(track_ids),
+        "id_switches": id_switches,
+        "scenarios": scenarios,
+        "predictions": predictions,
+    }
+    if speed > 0:
+        report["lag"] = summarize(lag)
+    return report
+
+
+def compare_scenarios(expected: list, actual: list) -> list:
+    """
+    Differences between two scenario sequences, as printable lines.
+    """
+    key = lambda s: (s["frame"], s["scenario"], s["incident_id"])
+    expected_keys = {key(s) for s in expected}
+    actual_keys = {key(s) for s in actual}
+    return (
+        [f"missing  {k}" for k in sorted(expected_keys - actual_keys)]
+        + [f"extra    {k}" for k in sorted(actual_keys - expected_keys)]
+    )
+
+
+def print_report(report: dict):
+    print(f"🎞️ {report['frames']} frames in {report['elapsed_s']}s -> {report['fps']} FPS "
+          f"({report['yolo_skipped']} skipped YOLO, {report['undecodable']} undecodable)")
+    print(f"🎚️ {report['throttled']} frames over an idle frame budget, {report['profile_switches']} profile switches")
+    print(f"🧭 Tracker {report['tracker']}: {report['track_ids']} track ids, {report['id_switches']} ID switches")
+    print(f"{'stage':<10}{'count':>7}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    stages = dict(report["stages"])
+    if "lag" in report:
+        stages["lag"] = report["lag"]
+    for stage, s in stages.items():
+        if not s["count"]:
+            continue
+        print(f"{stage:<10}{s['count']:>7}" + "".join(f"{s[f'p{p}_ms']:>10}" for p in PERCENTILES) + f"{s['max_ms']:>10}")
+    print(f"⚠️ {len(report['scenarios'])} scenarios:")
+    for s in report["scenarios"]:
+        print(f"  #{s['frame']:<6} +{s['offset']:>8.3f}s  {s['scenario']}" + (f"  ({s['incident_id']})" if s["incident_id"] else ""))
+
+
+def print_tracker_comparison(reports: list):
+    print(f"{'tracker':<12}{'FPS':>8}{'track p50 ms':>14}{'track p99 ms':>14}{'track ids':>11}{'ID switches':>13}{'scenarios':>11}")
+    for r in reports:
+        track = r["stages"]["track"]
+        print(f"{r['tracker']:<12}{r['fps']:>8}{track.get('p50_ms', '-'):>14}{track.get('p99_ms', '-'):>14}"
+              f"{r['track_ids']:>11}{r['id_switches']:>13}{len(r['scenarios']):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded /ws session through YOLO + Deep SORT + scenarios.")
+    parser.add_argument("recording", help="Recording (.frames) written by the server")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = recorded speed, 0 = as fast as possible")
+    parser.add_argument("--no-gate", action="store_true", help="Run YOLO on every frame")
+    parser.add_argument("--limit", type=int, help="Replay only the first N frames")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--expect", help="Report JSON whose scenario sequence must be reproduced")
+    parser.add_argument("--tracker", choices=sorted(TRACKERS), default=settings.TRACKER, help="Tracker backend")
+    parser.add_argument("--no-profiles", action="store_true", help="Keep every frame at full size and rate (ADAPTIVE_PROFILES=0)")
+    parser.add_argument("--compare-trackers", action="store_true", help="Replay once per tracker backend and compare them")
+    args = parser.parse_args()
+    # Same profiles as the server would use
+    adaptive_profiles = settings.ADAPTIVE_PROFILES and not args.no_profiles
+
+    if args.compare_trackers:
+        # Load the detector and the embedder up front, so neither backend pays for it
+        warmup(embedder=True)
+        reports = []
+        with FrameArchive(args.recording) as archive:
+            for kind in TRACKERS:
+                reports.append(replay(archive, speed=args.speed, use_gate=not args.no_gate, limit=args.limit,
+                                      tracker_kind=kind, adaptive_profiles=adaptive_profiles))
+                print_report(reports[-1])
+        print_tracker_comparison(reports)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(reports, f, indent=2)
+            print(f"✅ Reports written to {args.output}")
+        return
+
+    with FrameArchive(args.recording) as archive:
+        report = replay(archive, speed=args.speed, use_gate=not args.no_gate, limit=args.limit,
+                        tracker_kind=args.tracker, adaptive_profiles=adaptive_profiles)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+
+    if args.expect:
+        with open(args.expect) as f:
+            expected = json.load(f)["scenarios"]
+        differences = compare_scenarios(expected, report["scenarios"])
+        if differences:
+            print(f"❌ Scenario sequence differs from {args.expect}:")
+            for line in differences:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print(f"✅ Scenario sequence matches {args.expect}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+scenario_rules.py – Declarative scenario rule table and its incremental evaluator
+
+Every label rule of the system lives in RULES, in priority order. A rule has a
+condition (what must be true about labels/tracks) and up to three outputs:
+
+- scenario : reported by ScenarioHandler (temporal, per session)
+- prediction : frame-level classification sent with every frame (helpers.classify_scenario)
+- question : MoonDream question for the current labels (moon_model.get_moondream_question)
+
+Each consumer walks the table in order and uses the rules that define its output,
+so all three share a single source of truth.
+
+Condition kinds:
+- present(*labels)            : all labels in the current frame (co-occurrence)
+- present_any(*labels)        : at least one label in the current frame
+- seen_recently(*labels)      : any label seen within the label history window
+- within(a, any_of, seconds)  : `a` and one of `any_of` seen within `seconds` of each other
+- disappeared(any_of, context): one of `any_of` left the view while `context` was visible
+- moving(label)               : a track with that label is currently moving
+"""
+
+PRESENT = "present"
+PRESENT_ANY = "present_any"
+SEEN_RECENTLY = "seen_recently"
+WITHIN = "within"
+DISAPPEARED = "disappeared"
+MOVING = "moving"
+
+# Kinds that only look at the labels of a single frame (usable without any history)
+FRAME_KINDS = (PRESENT, PRESENT_ANY)
+
+
+class Rule:
+    """
+    One entry of the rule table.
+
+    Args:
+        kind (str): Condition kind (see module docstring).
+        labels (tuple): Primary labels of the condition.
+        others (tuple): Secondary labels (`any_of` for within/disappeared context).
+        seconds (float): Time window for `within`.
+        cooldown (float): Minimum time between two positive results of this rule.
+        scenario / prediction / question (str): Outputs, None if the rule doesn't produce one.
+    """
+
+    __slots__ = ("kind", "labels", "others", "seconds", "cooldown", "scenario", "prediction", "question")
+
+    def __init__(self, kind, labels, others=(), seconds=None, cooldown=None,
+                 scenario=None, prediction=None, question=None):
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.others = tuple(others)
+        self.seconds = seconds
+        self.cooldown = cooldown
+        self.scenario = scenario
+        self.prediction = prediction
+        self.question = question
+
+    @property
+    def inputs(self) -> tuple:
+        """
+        Every label this rule depends on.
+        """
+        return self.labels + self.others
+
+    def matches_labels(self, labels: set) -> bool:
+        """
+        Stateless check against one frame's labels (frame kinds only).
+        """
+        if self.kind == PRESENT:
+            return all(label in labels for label in self.labels)
+        if self.kind == PRESENT_ANY:
+            return any(label in labels for label in self.labels)
+        raise ValueError(f"'{self.kind}' rules need label history")
+
+
+def present(*labels, **outputs) -> Rule:
+    return Rule(PRESENT, labels, **outputs)
+
+
+def present_any(*labels, **outputs) -> Rule:
+    return Rule(PRESENT_ANY, labels, **outputs)
+
+
+def seen_recently(*labels, **outputs) -> Rule:
+    return Rule(SEEN_RECENTLY, labels, **outputs)
+
+
+def within(label, any_of, seconds, **outputs) -> Rule:
+    return Rule(WITHIN, (label,), others=any_of, seconds=seconds, **outputs)
+
+
+def disappeared(any_of, context, **outputs) -> Rule:
+    return Rule(DISAPPEARED, any_of, others=(context,), **outputs)
+
+
+def moving(label, **outputs) -> Rule:
+    return Rule(MOVING, (label,), **outputs)
+
+
+# =======================
+# RULE TABLE (priority order)
+# =======================
+
+RULES = (
+    # Emergency – always first
+    present_any("metal pot in a microwave", "metal_pot_in_microwave",
+                scenario="metal_pot_in_microwave", prediction="metal_pot_in_microwave",
+                question="Is there a metal pot inside the microwave?"),
+    within("pot", ("Plate", "Bowl"), seconds=1.5, cooldown=4, scenario="pouring_food"),
+    disappeared(("Plate", "Bowl"), "open microwave", scenario="plate_removed_from_microwave"),
+    present("pot", "Plate", scenario="pot_and_plate_on_counter", prediction="metal_pot_and_plate",
+            question="Is someone pouring food from a pot to a plate?"),
+    present("pot", "Bowl", question="Is someone pouring food from a pot to a Bowl?"),
+    present("pot", prediction="metal_pot"),
+    present_any("Plate", "Bowl", prediction="plastic_plate"),
+    seen_recently("cutlery", scenario="cutlery_detected"),
+    present("cutlery", "person", prediction="utensil_with_hand"),
+    present("Plate", "open microwave", scenario="plate_inserted_into_microwave"),
+    present("open microwave", prediction="microwave_door_open"),
+    present("closed microwave", prediction="microwave_door_closed"),
+    present("open refrigerator", prediction="door_open"),
+    present("closed refrigerator", prediction="fridge_detected"),
+    moving("Plate", scenario="plate_moved"),
+    moving("pot", scenario="pot_moved"),
+    moving("cutlery", scenario="cutlery_used"),
+    moving("person", scenario="person_interacts"),
+)
+
+DEFAULT_QUESTION = "Does the image show a kitchen-related action? yes or no?"
+
+PREDICTION_RULES = tuple(rule for rule in RULES if rule.prediction)
+QUESTION_RULES = tuple(rule for rule in RULES if rule.question)
+SCENARIO_RULES = tuple(rule for rule in RULES if rule.scenario)
+
+
+def classify_labels(labels: set) -> str:
+    """
+    Frame-level classification: output of the first matching prediction rule.
+    Falls back to any detected label, or "no_objects".
+    """
+    for rule in PREDICTION_RULES:
+        if rule.matches_labels(labels):
+            return rule.prediction
+    return next(iter(labels)) if labels else "no_objects"
+
+
+def question_for_labels(labels: set) -> str:
+    """
+    MoonDream question for the current labels (first matching question rule).
+    """
+    for rule in QUESTION_RULES:
+        if rule.matches_labels(labels):
+            return rule.question
+    return DEFAULT_QUESTION
+
+
+class RuleEvaluator:
+    """
+    Compiled, incremental evaluator of the scenario rules for one session.
+
+    It keeps per-label first-seen/last-seen indexes instead of rescanning the label
+    history, and after each frame re-evaluates only the rules whose input labels
+    appeared, disappeared, left the history window or changed motion state.
+
+    Args:
+        rules (tuple): Rules to evaluate, in priority order.
+        max_history (int): Size of the label history window, in frames.
+    """
+
+    def __init__(self, rules=SCENARIO_RULES, max_history: int = 10):
+        self.rules = tuple(rules)
+        self.max_history = max_history
+
+        self.frame = -1
+        self.current = frozenset()
+        self.previous = frozenset()
+        self.last_seen_frame = {}   # label -> index of the last frame it was seen in
+        self.last_seen_time = {}    # label -> timestamp of that frame
+        self.first_seen_frame = {}  # label -> first frame of its current uninterrupted presence
+        self.moving_labels = frozenset()
+
+        self._expiring = {}         # frame index -> labels whose last sighting was then
+        self._results = [False] * len(self.rules)
+        self._last_fired = [0.0] * len(self.rules)
+        self._pending = set()       # labels with events not evaluated yet
+        self._pending_present = set()
+        self._previous_changes = set()
+
+        # Compile: label -> indices of rules that depend on it
+        self._rules_by_label = {}
+        for index, rule in enumerate(self.rules):
+            for label in rule.inputs:
+                self._rules_by_label.setdefault(label, []).append(index)
+
+    def seen_within_history(self, label) -> bool:
+        """
+        Whether `label` was seen in one of the last `max_history` frames.
+        """
+        last = self.last_seen_frame.get(label)
+        return last is not None and last > self.frame - self.max_history
+
+    def update_labels(self, labels: set, timestamp: float):
+        """
+        Register the labels of a new frame.
+        """
+        self.frame += 1
+        self.previous, self.current = self.current, frozenset(labels)
+
+        changed = self.previous ^ self.current
+        expired = {
+            label for label in self._expiring.pop(self.frame - self.max_history, ())
+            if self.last_seen_frame.get(label) == self.frame - self.max_history
+        }
+
+        for label in self.current:
+            if label not in self.previous:
+                self.first_seen_frame[label] = self.frame
+            self.last_seen_frame[label] = self.frame
+            self.last_seen_time[label] = timestamp
+            self._expiring.setdefault(self.frame, set()).add(label)
+        for label in changed - self.current:
+            self.first_seen_frame.pop(label, None)
+
+        # Absence-after-presence looks one frame back, so last frame's changes matter too
+        self._pending |= changed | expired | self._previous_changes
+        self._pending_present |= self.current
+        self._previous_changes = changed
+
+    def update_moving(self, moving_labels: set):
+        """
+        Register the set of labels that currently have at least one moving track.
+        """
+        moving_labels = frozenset(moving_labels)
+        self._pending |= self.moving_labels ^ moving_labels
+        self.moving_labels = moving_labels
+
+    def _evaluate(self, rule: Rule) -> bool:
+        kind = rule.kind
+        if kind in FRAME_KINDS:
+            return rule.matches_labels(self.current)
+
+        if kind == SEEN_RECENTLY:
+            return any(self.seen_within_history(label) for label in rule.labels)
+
+        if kind == WITHIN:
+            label = rule.labels[0]
+            others = [self.last_seen_time[o] for o in rule.others if self.seen_within_history(o)]
+            if not others or not self.seen_within_history(label):
+                return False
+            return abs(self.last_seen_time[label] - max(others)) < rule.seconds
+
+        if kind == DISAPPEARED:
+            if self.frame < 1:
+                return False
+            was_there = any(label in self.previous for label in rule.labels)
+            is_there = any(label in self.current for label in rule.labels)
+            context = any(label in self.current or label in self.previous for label in rule.others)
+            return was_there and not is_there and context
+
+        if kind == MOVING:
+            return rule.labels[0] in self.moving_labels
+
+        raise ValueError(f"Unknown rule kind: {kind}")
+
+    def refresh(self):
+        """
+        Re-evaluate only the rules affected by events since the last refresh.
+        """
+        dirty = set()
+        for label in self._pending:
+            dirty.update(self._rules_by_label.get(label, ()))
+        # Time-window rules also move while their labels stay in view
+        for label in self._pending_present:
+            dirty.update(i for i in self._rules_by_label.get(label, ()) if self.rules[i].kind == WITHIN)
+        self._pending.clear()
+        self._pending_present.clear()
+
+        for index in dirty:
+            self._results[index] = self._evaluate(self.rules[index])
+
+    def active_rules(self, now: float):
+        """
+        Yields matching rules in priority order, honouring per-rule cooldowns.
+
+        A rule with a cooldown counts as fired (and starts its cooldown) when it is yielded.
+        """
+        self.refresh()
+        for index, rule in enumerate(self.rules):
+            if not self._results[index]:
+                continue
+            if rule.cooldown is not None:
+                if now - self._last_fired[index] <= rule.cooldown:
+                    continue
+                self._last_fired[index] = now
+            yield rule
@@ -0,0 +1,139 @@
+"""
+structured_log.py – JSON-lines logging with per-event sampling for the hot path
+
+Per-frame events go through a SampledLog, which emits a given (event, key)
+at most once per interval and reports how many were suppressed in between:
+
+    frame_log = SampledLog(get_logger("ws"), interval=1.0)
+    frame_log.info("frame", key=robot_id, robot=robot_id, prediction=prediction)
+
+produces (at most once per second and robot)
+
+    {"ts": 1718000000.123, "level": "INFO", "logger": "temi.ws", "event": "frame",
+     "robot": "temi-1", "prediction": "metal_pot", "suppressed": 14}
+
+The level comes from settings.LOG_LEVEL (LOG_LEVEL environment variable, default INFO).
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+
+# Default minimum time between two records of the same sampled event
+DEFAULT_SAMPLE_INTERVAL = 1.0
+
+ROOT_LOGGER = "temi"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line; structured fields come from `extra={"fields": ...}`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=_to_json)
+
+
+def _to_json(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, "item"):  # NumPy scalars
+        return value.item()
+    return str(value)
+
+
+def configure_logging(level: str = "INFO"):
+    """
+    Sends all `temi.*` loggers to stderr as JSON lines. Safe to call more than once.
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    if not any(getattr(handler, "_temi_json", False) for handler in logger.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        handler._temi_json = True
+        logger.addHandler(handler)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, event: str, exc_info=None, **fields):
+    """
+    Logs one structured event (unsampled).
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+
+class SampledLog:
+    """
+    Rate-limited structured logging for events that can happen on every frame.
+
+    Args:
+        logger (logging.Logger): Destination logger.
+        interval (float): Minimum seconds between two records of the same (event, key).
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self._last = {}        # (event, key) -> time of the last emitted record
+        self._suppressed = {}  # (event, key) -> records dropped since then
+        self._lock = threading.Lock()
+
+    def log(self, level: int, event: str, key=None, exc_info=None, **fields) -> bool:
+        """
+        Emits the event unless the same (event, key) was emitted less than `interval` ago.
+
+        Returns:
+            bool: True if a record was written.
+        """
+        if not self.logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        slot = (event, key)
+        with self._lock:
+            if now - self._last.get(slot, -self.interval) < self.interval:
+                self._suppressed[slot] = self._suppressed.get(slot, 0) + 1
+                return False
+            self._last[slot] = now
+            suppressed = self._suppressed.pop(slot, 0)
+        if suppressed:
+            fields["suppressed"] = suppressed
+        self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+        return True
+
+    def debug(self, event: str, key=None, **fields) -> bool:
+        return self.log(logging.DEBUG, event, key, **fields)
+
+    def info(self, event: str, key=None, **fields) -> bool:
+        return self.log(logging.INFO, event, key, **fields)
+
+    def warning(self, event: str, key=None, **fields) -> bool:
+        return self.log(logging.WARNING, event, key, **fields)
+
+    def error(self, event: str, key=None, exc_info=None, **fields) -> bool:
+        return self.log(logging.ERROR, event, key, exc_info=exc_info, **fields)
+
+    def forget(self, key):
+        """
+        Drop the sampling state of a key (e.g. a disconnected robot).
+        """
+        with self._lock:
+            for slot in [slot for slot in self._last if slot[1] == key]:
+                self._last.pop(slot, None)
+                self._suppressed.pop(slot, None)
@@ -0,0 +1,158 @@
+import numpy as np
+
+
+class TrackStore:
+    """
+    Bounded-memory motion history of the tracked objects of one session.
+
+    Every live track owns a slot in a set of NumPy arrays: a ring buffer of its
+    last `history` centers, its label id and the update at which it was last seen.
+    Tracks that Deep SORT has dropped (not reported for `max_age` updates) are
+    evicted and their slot is reused, so memory follows the number of live tracks
+    instead of growing for the whole session.
+
+    Args:
+        history (int): Number of centers kept per track.
+        max_age (int): Updates a track may be missing before it is evicted
+            (same meaning as Deep SORT's max_age).
+        capacity (int): Initial number of slots; doubled when full.
+    """
+
+    def __init__(self, history: int = 5, max_age: int = 30, capacity: int = 32):
+        self.history = history
+        self.max_age = max_age
+        self.frame = 0
+
+        self.centers = np.zeros((capacity, history, 2), dtype=np.float32)
+        self.counts = np.zeros(capacity, dtype=np.int32)       # centers stored (<= history)
+        self.heads = np.zeros(capacity, dtype=np.int32)        # next write position
+        self.label_ids = np.full(capacity, -1, dtype=np.int32)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        self.slot_by_track = {}                 # track_id -> slot
+        self.track_by_slot = [None] * capacity  # slot -> track_id
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        self.label_names = []                   # label id -> label
+        self.label_index = {}                   # label -> label id
+
+    def __len__(self):
+        return len(self.slot_by_track)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the slot arrays.
+        """
+        return sum(a.nbytes for a in (self.centers, self.counts, self.heads, self.label_ids, self.last_seen, self.alive))
+
+    def _grow(self):
+        old = len(self.alive)
+        new = old * 2
+        self.centers = np.concatenate([self.centers, np.zeros((old, self.history, 2), dtype=np.float32)])
+        self.counts = np.concatenate([self.counts, np.zeros(old, dtype=np.int32)])
+        self.heads = np.concatenate([self.heads, np.zeros(old, dtype=np.int32)])
+        self.label_ids = np.concatenate([self.label_ids, np.full(old, -1, dtype=np.int32)])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros(old, dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.zeros(old, dtype=bool)])
+        self.track_by_slot.extend([None] * old)
+        self.free_slots.extend(range(new - 1, old - 1, -1))
+
+    def _label_id(self, label) -> int:
+        label_id = self.label_index.get(label)
+        if label_id is None:
+            label_id = len(self.label_names)
+            self.label_names.append(label)
+            self.label_index[label] = label_id
+        return label_id
+
+    def _slot_for(self, track_id) -> int:
+        slot = self.slot_by_track.get(track_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.free_slots.pop()
+            self.slot_by_track[track_id] = slot
+            self.track_by_slot[slot] = track_id
+            self.counts[slot] = 0
+            self.heads[slot] = 0
+            self.alive[slot] = True
+        return slot
+
+    def update(self, tracked_objects: list):
+        """
+        Append the current center of every reported track and evict tracks
+        that have been missing for more than `max_age` updates.
+
+        Args:
+            tracked_objects (list): Objects with keys 'id', 'bbox', 'label'.
+        """
+        self.frame += 1
+        for obj in tracked_objects:
+            bbox = obj["bbox"]
+            slot = self._slot_for(obj["id"])
+            head = self.heads[slot]
+            self.centers[slot, head, 0] = bbox[0] + bbox[2] / 2
+            self.centers[slot, head, 1] = bbox[1] + bbox[3] / 2
+            self.heads[slot] = (head + 1) % self.history
+            if self.counts[slot] < self.history:
+                self.counts[slot] += 1
+            self.label_ids[slot] = self._label_id(obj["label"])
+            self.last_seen[slot] = self.frame
+
+        stale = np.flatnonzero(self.alive & (self.frame - self.last_seen > self.max_age))
+        if len(stale):
+            self.evict([self.track_by_slot[slot] for slot in stale])
+
+    def evict(self, track_ids):
+        """
+        Free the slots of tracks that no longer exist (e.g. deleted by Deep SORT).
+        """
+        for track_id in track_ids:
+            slot = self.slot_by_track.pop(track_id, None)
+            if slot is None:
+                continue
+            self.alive[slot] = False
+            self.counts[slot] = 0
+            self.label_ids[slot] = -1
+            self.track_by_slot[slot] = None
+            self.free_slots.append(slot)
+
+    def label_of(self, track_id):
+        slot = self.slot_by_track.get(track_id)
+        return None if slot is None else self.label_names[self.label_ids[slot]]
+
+    def moving_mask(self, threshold: float, smooth: bool = False) -> np.ndarray:
+        """
+        Motion state of every slot, computed in one vectorized pass.
+
+        Args:
+            threshold (float): Minimum displacement per update, in pixels.
+            smooth (bool): If True, use the average displacement over the whole
+                history window instead of only the last two centers.
+
+        Returns:
+            np.ndarray: Boolean mask over slots (always False for free slots).
+        """
+        slots = np.arange(len(self.alive))
+        last = self.centers[slots, (self.heads - 1) % self.history]
+        if smooth:
+            first = self.centers[slots, (self.heads - self.counts) % self.history]
+            steps = np.maximum(self.counts - 1, 1)
+            distance = np.linalg.norm(last - first, axis=1) / steps
+        else:
+            previous = self.centers[slots, (self.heads - 2) % self.history]
+            distance = np.linalg.norm(last - previous, axis=1)
+        return self.alive & (self.counts >= 2) & (distance > threshold)
+
+    def is_moving(self, track_id, threshold: float, smooth: bool = False) -> bool:
+        slot = self.slot_by_track.get(track_id)
+        return slot is not None and bool(self.moving_mask(threshold, smooth)[slot])
+
+    def moving_labels(self, threshold: float, smooth: bool = False) -> set:
+        """
+        Labels that have at least one moving live track.
+        """
+        label_ids = np.unique(self.label_ids[self.moving_mask(threshold, smooth)])
+        return {self.label_names[i] for i in label_ids}
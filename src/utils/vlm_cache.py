@@ -0,0 +1,128 @@
+"""
+vlm_cache.py – Scene-signature caches for MoonDream
+
+- `image_signature` is a 64-bit perceptual hash (DCT hash) of the image that is
+  sent to MoonDream, so re-encoded or slightly noisy copies of the same scene
+  share a key.
+- `TTLCache` is a small LRU cache whose entries also expire after `ttl` seconds,
+  with hit/miss/eviction counters.
+- `SceneCache` is a TTLCache keyed by (signature, *rest) that also accepts
+  signatures a few bits away from a stored one (same scene, new JPEG noise).
+"""
+
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Side of the greyscale image the DCT is taken from, and of the kept low-frequency block
+HASH_IMAGE_SIZE = 32
+HASH_BLOCK_SIZE = 8
+
+# Hamming distance up to which two signatures count as the same scene
+MAX_SIGNATURE_DISTANCE = 4
+
+
+def image_signature(image: np.ndarray) -> int:
+    """
+    Perceptual hash of an image (BGR, RGB or greyscale).
+
+    Returns:
+        int: 64-bit hash; one bit per low-frequency DCT coefficient above the median.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(image, (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), interpolation=cv2.INTER_AREA)
+    block = cv2.dct(small.astype(np.float32))[:HASH_BLOCK_SIZE, :HASH_BLOCK_SIZE].flatten()
+    bits = block > np.median(block[1:])  # the DC term would dominate the median
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class TTLCache:
+    """
+    LRU cache with a per-entry time-to-live.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used one is evicted.
+        ttl (float): Seconds an entry stays valid after it was stored.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None, count_miss: bool = True):
+        """
+        Returns the live value for `key`, or `default`.
+
+        Args:
+            count_miss (bool): Whether a miss counts in `misses` (False for re-checks
+                of a key that already missed once).
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+            self.evictions += 1
+        if count_miss:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SceneCache(TTLCache):
+    """
+    TTLCache for keys of the form (signature, *rest).
+
+    On an exact miss, the closest live entry with the same `rest` whose signature
+    is within `max_distance` bits is returned instead.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_distance: int = MAX_SIGNATURE_DISTANCE):
+        super().__init__(max_entries, ttl)
+        self.max_distance = max_distance
+
+    def get(self, key, default=None, count_miss: bool = True):
+        value = super().get(key, None, count_miss=False)
+        if value is None:
+            value = self._get_similar(key)
+        if value is None:
+            if count_miss:
+                self.misses += 1
+            return default
+        return value
+
+    def _get_similar(self, key):
+        signature, rest = key[0], key[1:]
+        now = time.monotonic()
+        best_key, best_distance = None, self.max_distance + 1
+        for stored_key, (expires_at, _) in self.entries.items():
+            if stored_key[1:] != rest or expires_at <= now:
+                continue
+            distance = (stored_key[0] ^ signature).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = stored_key, distance
+        if best_key is None:
+            return None
+        self.entries.move_to_end(best_key)
+        self.hits += 1
+        return self.entries[best_key][1]